@@ -1,4 +1,5 @@
 """ These constants act as a way to refer to what button is pressed. """
+import sys
 
 TOGGLE_LIKE = "TOGGLE_LIKE"
 
@@ -9,3 +10,24 @@ SAVE_OTHER = "SAVE_OTHER"
 UNDO_SAVE = "UNDO_SAVE"
 
 QUIT_APP = "QUIT_APP"
+
+# Any number of playlists can be saved to: the playlist under "<name>_playlist" in the config is saved to by
+# the SAVE_<NAME> action, pressed with the "button_save_<name>" pin (e.g. main_playlist, SAVE_MAIN, button_save_main)
+SAVE_PREFIX = "SAVE_"
+PLAYLIST_SUFFIX = "_playlist"
+
+
+def save_action(playlist_key: str) -> str:
+    """ Gets the action that quick saves to the playlist under the given config key (e.g. "main_playlist" -> SAVE_MAIN).
+        The action is interned, so it can be compared with `is` like the constants above. """
+    if not playlist_key.endswith(PLAYLIST_SUFFIX) or len(playlist_key) == len(PLAYLIST_SUFFIX):
+        raise ValueError(f'Invalid playlist key in config: {playlist_key} (must be "<name>{PLAYLIST_SUFFIX}")')
+    return sys.intern(SAVE_PREFIX + playlist_key[:-len(PLAYLIST_SUFFIX)].upper())
+
+def playlist_key(action: str) -> str:
+    """ Gets the config key of the playlist the given save action saves to (e.g. SAVE_MAIN -> "main_playlist"). """
+    return action[len(SAVE_PREFIX):].lower() + PLAYLIST_SUFFIX
+
+def button_pin_key(action: str) -> str:
+    """ Gets the config key of the pin of the given action's button (e.g. SAVE_MAIN -> "button_save_main"). """
+    return 'button_' + action.lower()
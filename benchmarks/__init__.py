@@ -0,0 +1 @@
+""" Benchmarks that run QuickSaver against a local fake Spotify Web API (run from the project root). """
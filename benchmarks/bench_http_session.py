@@ -0,0 +1,66 @@
+""" Compares cold and warm press latency against a local HTTPS stand-in for the API.
+
+A cold press opens a new connection (TCP + TLS handshake), like the first press after the
+server closed an idle connection. A warm press reuses a pooled connection kept open by the
+keep-warm pings.
+
+Usage: python -m benchmarks.bench_http_session [--presses N] [--latency SECONDS] [--connect-latency SECONDS]
+"""
+from benchmarks.fake_spotify_api import FakeSpotifyAPI, fake_track_id
+from http_session import build_session, ping
+import statistics
+import argparse
+import spotipy
+import time
+
+
+def stand_in_client(api: FakeSpotifyAPI) -> spotipy.Spotify:
+    """ Builds a Spotipy client with its own pooled session that trusts the stand-in's self-signed certificate. """
+    session = build_session()
+    session.trust_env = False  # Otherwise a CA bundle from the environment replaces the certificate below
+    session.verify = api.cert_file
+    sp = spotipy.Spotify(auth='fake-access-token', requests_session=session)
+    sp.prefix = api.prefix
+    return sp
+
+
+def press_latency(sp: spotipy.Spotify) -> float:
+    """ Times a single currently playing lookup (the first call of every press). """
+    start = time.perf_counter()
+    sp.current_user_playing_track()
+    return time.perf_counter() - start
+
+
+def summary(latencies: list[float]) -> str:
+    """ Formats the p50 and p95 of the given latencies in milliseconds. """
+    p50 = statistics.median(latencies) * 1000
+    p95 = statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) > 1 else p50
+    return f'p50 {p50:7.1f} ms   p95 {p95:7.1f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--presses', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated request round trip in seconds')
+    parser.add_argument('--connect-latency', type=float, default=0.06,
+                        help='simulated TCP + TLS handshake time of a new connection in seconds')
+    args = parser.parse_args()
+
+    with FakeSpotifyAPI(args.latency, connect_latency=args.connect_latency, tls=True) as api:
+        api.now_playing = fake_track_id(1)
+
+        # Cold: every press gets a fresh session, so it has to open a new connection
+        cold = [press_latency(stand_in_client(api)) for _ in range(args.presses)]
+
+        # Warm: one pooled session that was pinged ahead of the presses
+        sp = stand_in_client(api)
+        ping(sp._session, api.prefix)
+        warm = [press_latency(sp) for _ in range(args.presses)]
+
+        print(f'cold  {summary(cold)}')
+        print(f'warm  {summary(warm)}')
+        print(f'connections opened: {api.connections}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+""" Measures how long the LED feedback keeps the press thread busy when presses come back to back,
+without the LED animator (the triggers sleep on the caller's thread) and with it (both feedback policies).
+
+Fires a press feedback trigger every interval seconds at simulated LEDs (which take no time to switch, the waits
+are real), mixed with the odd error. Reports how long each trigger call blocked, how late the presses got handled
+because the ones before them were still blocked, and how long the animations waited to start playing.
+
+Usage: python -m benchmarks.bench_leds [--presses N] [--interval SECONDS] [--error-share SHARE]
+"""
+from raspi_notifier import RasPiNotifier
+from led_animator import QUEUE, PREEMPT
+from sim_io import SimLEDSink
+from benchmarks.bench_quicksaver import GPIO_PINS
+import statistics
+import argparse
+import random
+import time
+
+FEEDBACK = ('trigger_song_saved_success', 'trigger_undo_save_success', 'trigger_duplicate_song_warning',
+            'trigger_song_unlike_success')
+MODES = ("no animator", QUEUE, PREEMPT)
+
+
+def run(mode: str, args) -> dict:
+    """ Fires the triggers at a fresh notifier in the given mode and returns the measurements. """
+    sink = SimLEDSink()
+    animate = mode != MODES[0]
+    notifier = RasPiNotifier(GPIO_PINS, sink.led, time.sleep, animate, mode if animate else QUEUE)
+
+    rand = random.Random(args.seed)
+    triggers = ['trigger_os_error' if rand.random() < args.error_share else rand.choice(FEEDBACK)
+                for _ in range(args.presses)]
+
+    # Each press is handled once the one before it returned (like on the GPIO callback thread)
+    blocked, late = [], []
+    start = time.perf_counter()
+    for n, trigger in enumerate(triggers):
+        pressed_at = start + n * args.interval
+        time.sleep(max(0.0, pressed_at - time.perf_counter()))
+        call_start = time.perf_counter()
+        getattr(notifier, trigger)()
+        blocked.append(time.perf_counter() - call_start)
+        late.append(call_start - pressed_at)
+    handled = time.perf_counter() - start
+
+    notifier.clean_up_leds()  # Lets the queued animations play
+    animator_stats = notifier.animator.stats() if notifier.animator is not None else None
+    return {'blocked': blocked, 'late': late, 'handled': handled, 'animator': animator_stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--presses', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.3, help='seconds between presses')
+    parser.add_argument('--error-share', type=float, default=0.1, help='share of the presses that flash an error')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f'{args.presses} presses {args.interval:g}s apart, {args.error_share:.0%} errors')
+    print(f'{"mode":<12} {"handled in":>10} {"blocked p50":>12} {"blocked max":>12} {"late max":>10} '
+          f'{"start delay avg":>16} {"max":>7}  animations')
+    for mode in MODES:
+        results = run(mode, args)
+        stats = results['animator']
+        delays = f'{stats["avg_delay"] or 0.0:15.3f}s {stats["max_delay"]:6.3f}s' if stats is not None else f'{"-":>16} {"-":>7}'
+        counts = f'played={stats["played"]}, cut_short={stats["cut_short"]}, dropped={stats["dropped"]}' \
+            if stats is not None else '-'
+        print(f'{mode:<12} {results["handled"]:9.2f}s {statistics.median(results["blocked"]) * 1000:9.2f} ms '
+              f'{max(results["blocked"]) * 1000:9.2f} ms {max(results["late"]):9.2f}s {delays}  {counts}')
+
+
+if __name__ == "__main__":
+    main()
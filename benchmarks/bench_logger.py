@@ -0,0 +1,50 @@
+""" Compares how long a log call holds up the calling thread with synchronous and async file writes.
+
+Usage: python -m benchmarks.bench_logger [--records N] [--max-bytes N]
+"""
+from logger import Logger
+import statistics
+import tempfile
+import argparse
+import time
+import os
+
+
+def time_log_calls(logger: Logger, records: int) -> list[float]:
+    """ Times every error() call (the ones that write to the file). """
+    latencies = []
+    for n in range(records):
+        start = time.perf_counter()
+        logger.error(f'Action <SAVE_MAIN> was only partially written: record {n}')
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def summary(latencies: list[float]) -> str:
+    """ Formats the p50, p99, and max of the given latencies in microseconds. """
+    percentiles = statistics.quantiles(latencies, n=100)
+    return f'p50 {percentiles[49] * 1e6:7.1f} us   p99 {percentiles[98] * 1e6:7.1f} us   max {max(latencies) * 1e6:8.1f} us'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=5000)
+    parser.add_argument('--max-bytes', type=int, default=200_000, help='log size that triggers a rotation')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        for label, async_writes in (('sync ', False), ('async', True)):
+            filename = os.path.join(log_dir, label.strip() + '.log')
+            logger = Logger(filename, async_writes, max_bytes=args.max_bytes)
+            logger.console_available = False
+            latencies = time_log_calls(logger, args.records)
+            start = time.perf_counter()
+            logger.close()
+            drain = time.perf_counter() - start
+            stats = logger.stats()
+            print(f'{label}  {summary(latencies)}   close {drain * 1000:6.1f} ms   '
+                  f'batches {stats["batches"]}, rotations {stats["rotations"]}, dropped {stats["dropped"]}')
+
+
+if __name__ == "__main__":
+    main()
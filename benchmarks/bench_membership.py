@@ -0,0 +1,75 @@
+""" Compares the memory of one set of track IDs per playlist with the shared playlist membership index
+(dict of ID strings, and compact), as the number of playlists grows.
+
+The playlists draw their tracks from a shared pool (e.g. genre playlists of one music library), so many
+tracks are in several playlists. Also times finding every playlist a track is in: a lookup per set,
+against a single lookup of the track's mask.
+
+Usage: python -m benchmarks.bench_membership [--playlists N,N,...] [--playlist-size N] [--pool-size N]
+"""
+from playlist_membership import PlaylistMembership
+import utils as utl
+import tracemalloc
+import argparse
+import random
+import time
+import gc
+
+
+def measure(build) -> tuple[object, int]:
+    """ Builds the track lists and returns them with the bytes they hold on to (the IDs come in as fresh strings). """
+    gc.collect()
+    tracemalloc.start()
+    track_lists = build()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return track_lists, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--playlists', default='2,4,8,16,32', help='comma separated numbers of playlists')
+    parser.add_argument('--playlist-size', type=int, default=20_000)
+    parser.add_argument('--pool-size', type=int, default=50_000, help='different tracks the playlists draw from')
+    parser.add_argument('--lookups', type=int, default=20_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rand = random.Random(args.seed)
+    pool = [rand.getrandbits(128) for _ in range(args.pool_size)]
+
+    print(f'{"playlists":>9} {"sets":>10} {"shared":>10} {"compact":>10}   {"lookup (sets)":>14} {"lookup (mask)":>14}')
+    for count in (int(count) for count in args.playlists.split(',')):
+        playlists = [rand.sample(pool, args.playlist_size) for _ in range(count)]
+
+        def build_sets() -> list[set]:
+            return [set(utl.int_to_track_id(key) for key in keys) for keys in playlists]
+
+        def build_membership(compact: bool) -> PlaylistMembership:
+            membership = PlaylistMembership(compact)
+            for bit, keys in enumerate(playlists):
+                membership.load(1 << bit, (utl.int_to_track_id(key) for key in keys))
+            return membership
+
+        sets, sets_memory = measure(build_sets)
+        membership, shared_memory = measure(lambda: build_membership(False))
+        compact_memory = measure(lambda: build_membership(True))[1]
+
+        # Which of the playlists each looked up track is in
+        lookups = [utl.int_to_track_id(rand.choice(pool)) for _ in range(args.lookups)]
+        start = time.perf_counter()
+        for track_id in lookups:
+            [n for n, track_set in enumerate(sets) if track_id in track_set]
+        sets_lookup = (time.perf_counter() - start) / len(lookups)
+        start = time.perf_counter()
+        for track_id in lookups:
+            membership.mask(track_id)
+        mask_lookup = (time.perf_counter() - start) / len(lookups)
+
+        print(f'{count:9d} {sets_memory / 1e6:7.1f} MB {shared_memory / 1e6:7.1f} MB {compact_memory / 1e6:7.1f} MB   '
+              f'{sets_lookup * 1e6:11.2f} us {mask_lookup * 1e6:11.2f} us')
+        del sets, membership
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+""" Measures how long presses take while the network is degraded (the fake API holds every response back),
+without and with the circuit breaker.
+
+Runs the whole app (with simulated buttons and LEDs) through a few presses on a healthy network, then presses
+during the outage, then presses once the network is back. Reports the latency of the presses in each phase
+and how many of them flashed the error LED.
+
+Usage: python -m benchmarks.bench_outage [--presses N] [--stall SECONDS] [--option KEY=VALUE ...]
+"""
+from benchmarks.fake_spotify_api import FakeSpotifyAPI, fake_track_id
+from benchmarks.bench_quicksaver import MAIN_PLAYLIST, OTHER_PLAYLIST, GPIO_PINS, NEW_TRACKS_START, write_config, \
+    parse_option, app_session
+from actions import SAVE_MAIN
+from quicksaver import QuickSaver
+import statistics
+import tempfile
+import argparse
+import logging
+import time
+import os
+
+PHASES = ("healthy", "outage", "recovered")
+FEEDBACK_WAIT = 0.05  # Seconds to wait for the LED feedback of a press (played in the background by the LED animator)
+
+
+def press(quicksaver, api: FakeSpotifyAPI, track_id: str) -> tuple[float, bool]:
+    """ Presses the main save button while the given track plays, and returns how long the press took
+        and whether it flashed the error LED. """
+    errors_before = error_flashes(quicksaver)
+    api.now_playing = track_id
+    start = time.perf_counter()
+    quicksaver.button_source.press(SAVE_MAIN)
+    latency = time.perf_counter() - start
+    time.sleep(FEEDBACK_WAIT)
+    return latency, error_flashes(quicksaver) > errors_before
+
+
+def error_flashes(quicksaver) -> int:
+    """ Counts the times the error LED was turned on so far. """
+    error_pin = GPIO_PINS['led_error']
+    return sum(1 for _, pin, state in quicksaver.led_sink.events if pin == error_pin and state != 'off')
+
+
+def run(options: dict, args) -> dict:
+    """ Presses through the healthy, outage, and recovered phases and returns each phase's (latencies, errors). """
+    results = {}
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir, FakeSpotifyAPI(args.latency) as api:
+        os.chdir(work_dir)
+        try:
+            api.add_playlist(MAIN_PLAYLIST, 100)
+            api.add_playlist(OTHER_PLAYLIST, 100, first_track=100)
+            write_config(options)
+            quicksaver = QuickSaver(spotify_api=api.client(app_session(options)))
+            quicksaver.start_quicksaver(wait=False)
+            if quicksaver.notifier.animator is not None:
+                quicksaver.notifier.animator.wait_idle()  # The ready lights light the error LED too
+
+            track = NEW_TRACKS_START
+            for phase in PHASES:
+                # Hold the responses back during the outage, and give the breaker time to try again after it
+                api.stall = args.stall if phase == 'outage' else 0.0
+                if phase == 'recovered':
+                    time.sleep(args.recovery_wait)
+
+                latencies, errors = [], 0
+                for _ in range(args.presses):
+                    latency, flashed = press(quicksaver, api, fake_track_id(track))
+                    latencies.append(latency)
+                    errors += flashed
+                    track += 1
+                results[phase] = (latencies, errors)
+
+            guard_stats = quicksaver.controller.client.guard.stats() if quicksaver.controller.client.guard else None
+            quicksaver.stop_quicksaver(exit_app=False)
+        finally:
+            os.chdir(original_dir)
+    return results, guard_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--presses', type=int, default=8, help='presses in each phase')
+    parser.add_argument('--stall', type=float, default=30.0, help='seconds every response is held back during the outage')
+    parser.add_argument('--recovery-wait', type=float, default=2.5, help='seconds between the outage and the next presses')
+    parser.add_argument('--latency', type=float, default=0.03, help='simulated request round trip in seconds')
+    parser.add_argument('--option', action='append', default=[], metavar='KEY=VALUE',
+                        help='config option to set for both runs (can be repeated)')
+    args = parser.parse_args()
+    logging.getLogger('spotipy').setLevel(logging.CRITICAL)  # Spotipy logs every failed request
+    options = dict(parse_option(option) for option in args.option)
+    options.setdefault('breaker_reset_timeout', args.recovery_wait - 0.5)
+
+    print(f'{args.presses} presses per phase, responses held back {args.stall:g}s during the outage')
+    print(f'{"breaker":<8} {"phase":<10} {"p50":>9} {"max":>9} {"total":>8} {"error LED":>10}')
+    for breaker in (False, True):
+        results, guard_stats = run(dict(options, circuit_breaker=breaker), args)
+        for phase in PHASES:
+            latencies, errors = results[phase]
+            print(f'{"on" if breaker else "off":<8} {phase:<10} {statistics.median(latencies) * 1000:6.0f} ms '
+                  f'{max(latencies) * 1000:6.0f} ms {sum(latencies):7.2f}s {errors:10d}')
+        if guard_stats is not None:
+            print('         ' + ', '.join(f'{key}={value}' for key, value in guard_stats.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+""" Compares the memory used while loading a large playlist page by page (Spotipy parsing whole pages of
+full track objects) with the streaming page parser (only the track IDs are kept).
+
+The fake API runs in this process and each load runs in a fresh child process, so the peak RSS is the
+loader's own. Reports the peak RSS growth and the garbage collections during the load (a generation 0
+collection follows every ~700 container allocations, so they also count the allocations), then the peak
+traced memory (from a second child, since tracemalloc slows the load down and takes memory of its own).
+
+Usage: python -m benchmarks.bench_page_stream [--tracks N] [--latency SECONDS]
+"""
+from benchmarks.fake_spotify_api import FakeSpotifyAPI
+import subprocess
+import argparse
+import resource
+import json
+import time
+import sys
+import gc
+
+PLAYLIST = "bigplaylist"
+MODES = ("pages", "stream")
+
+
+def load_playlist(mode: str, prefix: str, trace_allocations: bool) -> dict:
+    """ Loads the playlist from the fake API at the given prefix (run in a child process) and returns the measurements. """
+    from spotify_client import SpotifyClient
+    import tracemalloc
+    import spotipy
+
+    sp = spotipy.Spotify(auth='fake-access-token')
+    sp.prefix = prefix
+    client = SpotifyClient(None, None, None, spotify_api=sp)
+
+    gc.collect()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    collections_before = [stats['collections'] for stats in gc.get_stats()]
+    if trace_allocations is True:
+        tracemalloc.start()
+    start = time.perf_counter()
+
+    if mode == 'pages':
+        track_ids = set(client.get_playlist_tracks(PLAYLIST))
+    else:
+        track_ids = set(client.stream_playlist_tracks(PLAYLIST))
+
+    elapsed = time.perf_counter() - start
+    results = {'tracks': len(track_ids), 'seconds': elapsed,
+               'rss_growth_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before,
+               'collections': [stats['collections'] - before for stats, before in zip(gc.get_stats(), collections_before)]}
+    if trace_allocations is True:
+        results['traced_peak'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return results
+
+
+def run_child(mode: str, prefix: str, trace_allocations: bool) -> dict:
+    """ Runs load_playlist in a fresh Python process and returns its measurements. """
+    command = [sys.executable, '-m', 'benchmarks.bench_page_stream', '--child', mode, '--prefix', prefix]
+    if trace_allocations is True:
+        command.append('--trace-allocations')
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tracks', type=int, default=10_000)
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated request round trip in seconds')
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--prefix', help=argparse.SUPPRESS)
+    parser.add_argument('--trace-allocations', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(load_playlist(args.child, args.prefix, args.trace_allocations)))
+        return
+
+    with FakeSpotifyAPI(args.latency, 0.0) as api:
+        api.add_playlist(PLAYLIST, args.tracks)
+        print(f'{args.tracks} tracks')
+        print(f'{"mode":<8} {"time":>8} {"peak RSS growth":>16} {"GC runs (gen 0/1/2)":>20} {"traced peak":>12}')
+        for mode in MODES:
+            results = run_child(mode, api.prefix, trace_allocations=False)
+            assert results['tracks'] == args.tracks
+            traced_peak = run_child(mode, api.prefix, trace_allocations=True)['traced_peak']
+            collections = '/'.join(str(count) for count in results['collections'])
+            print(f'{mode:<8} {results["seconds"]:7.2f}s {results["rss_growth_kb"] / 1024:13.1f} MB '
+                  f'{collections:>20} {traced_peak / 1e6:9.2f} MB')
+
+
+if __name__ == "__main__":
+    main()
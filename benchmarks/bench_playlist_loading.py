@@ -0,0 +1,57 @@
+""" Compares time-to-ready of sequential, parallel and indexed playlist loading against the fake API.
+
+Usage: python -m benchmarks.bench_playlist_loading [--latency SECONDS] [--sizes N N ...]
+"""
+from benchmarks.fake_spotify_api import FakeSpotifyAPI
+from quicksave_controller import QuickSaveController
+import playlist_index
+import tempfile
+import argparse
+import time
+
+MAIN_PLAYLIST = "mainplaylist"
+OTHER_PLAYLIST = "otherplaylist"
+
+
+def time_to_ready(api: FakeSpotifyAPI, options: dict) -> tuple[float, QuickSaveController]:
+    """ Times how long the controller takes to load both playlists with the given options. """
+    controller = QuickSaveController(None, None, None, options, spotify_api=api.client())
+    start = time.perf_counter()
+    controller.set_playlists([MAIN_PLAYLIST, OTHER_PLAYLIST])
+    return time.perf_counter() - start, controller
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated round trip time in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01, help='extra random delay in seconds')
+    parser.add_argument('--workers', type=int, default=4, help='parallel loader worker count')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 500, 1000, 2500, 5000])
+    args = parser.parse_args()
+
+    print(f'{"tracks":>8} {"sequential":>12} {"parallel":>12} {"speedup":>8} {"indexed":>12}')
+    with FakeSpotifyAPI(args.latency, args.jitter) as api, tempfile.TemporaryDirectory() as index_dir:
+        playlist_index.INDEX_DIR = index_dir
+        for size in args.sizes:
+            api.add_playlist(MAIN_PLAYLIST, size)
+            api.add_playlist(OTHER_PLAYLIST, size // 4, first_track=size)
+
+            seq_time, seq = time_to_ready(api, {'parallel_loading': False, 'playlist_index': False})
+            par_time, par = time_to_ready(api, {'parallel_loading': True, 'loader_workers': args.workers,
+                                                'playlist_index': False})
+
+            # Restart twice with the on-disk index: the first run writes it, the second one reads it
+            time_to_ready(api, {'parallel_loading': True, 'playlist_index': True})
+            idx_time, idx = time_to_ready(api, {'parallel_loading': True, 'playlist_index': True})
+
+            # Both loading modes must produce the exact same local track lists
+            for playlist_id in (MAIN_PLAYLIST, OTHER_PLAYLIST):
+                expected = set(api.playlists[playlist_id])
+                assert seq.get_local_track_list(playlist_id) == par.get_local_track_list(playlist_id) == \
+                    idx.get_local_track_list(playlist_id) == expected
+
+            print(f'{size:>8} {seq_time:>11.3f}s {par_time:>11.3f}s {seq_time / par_time:>7.1f}x {idx_time:>11.3f}s')
+
+
+if __name__ == "__main__":
+    main()
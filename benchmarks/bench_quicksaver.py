@@ -0,0 +1,215 @@
+""" Runs the whole QuickSaver app against the local fake API and reports startup time, press throughput, and latency percentiles.
+
+Startup covers QuickSaver.__init__ through the ready lights. The presses are scripted (a seeded mix of
+saves, duplicate saves, likes, undos, and presses with nothing playing) and pressed on the simulated
+buttons, so each one takes the same path as a real press. The simulated LEDs record the feedback instead
+of holding the press up, its total time is reported separately. Run it with the same arguments before and
+after a change to catch regressions.
+
+Usage: python -m benchmarks.bench_quicksaver [--presses N] [--main-size N] [--other-size N] [--liked-size N]
+                                             [--latency SECONDS] [--jitter SECONDS] [--rate-limit FRACTION]
+                                             [--extra-playlists N] [--seed N] [--profile-startup] [--option KEY=VALUE ...]
+"""
+from benchmarks.fake_spotify_api import FakeSpotifyAPI, fake_track_id
+from actions import TOGGLE_LIKE, SAVE_MAIN, SAVE_OTHER, UNDO_SAVE, save_action
+from tracing import StartupProfiler, TOTAL, QUEUED
+from quicksaver import QuickSaver
+from http_session import build_session, RETRIES
+from sim_io import SIM
+from session_export import NO_TRACK
+import tracing
+import config_handler as cnfg_handler
+import utils as utl
+import tempfile
+import argparse
+import random
+import json
+import time
+import sys
+import os
+
+MAIN_PLAYLIST = "fakemainplaylist"
+OTHER_PLAYLIST = "fakeotherplaylist"
+GPIO_PINS = {
+    "led_success": 17,
+    "led_alert": 27,
+    "led_error": 22,
+    "button_toggle_like": 5,
+    "button_save_main": 6,
+    "button_save_other": 13,
+    "button_undo_save": 19
+}
+PRESS_MIX = {SAVE_MAIN: 40, SAVE_OTHER: 20, TOGGLE_LIKE: 25, UNDO_SAVE: 15}  # Relative weight of each action
+NOTHING_PLAYING = 0.1  # Fraction of presses made while nothing is playing
+DUPLICATE = 0.15       # Fraction of presses made while a track from the main playlist is playing
+EXTRA_PINS_START = 100  # Pins of the buttons of the extra playlists
+NEW_TRACKS_START = 10_000_000  # Tracks played during the run are numbered from here (clear of the loaded ones)
+
+
+def parse_option(option: str) -> tuple[str, object]:
+    """ Parses a KEY=VALUE option, reading the value as JSON when it can (numbers, true/false, null). """
+    key, value = option.split('=', 1)
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def extra_playlist_id(n: int) -> str:
+    """ Gets the fake API ID of the nth playlist besides main and other. """
+    return f'fakegenre{n}playlist'
+
+
+def write_config(options: dict, extra_playlists: int = 0) -> list[str]:
+    """ Writes a config for the fake API's playlists and the simulated buttons and LEDs to the working directory,
+        with the given number of playlists besides main and other (genre<n>_playlist, on their own buttons).
+        Returns the save actions of the extra playlists. """
+    config = json.loads(json.dumps(cnfg_handler.EMPTY_CONFIG))
+    config['playlists'] = {'main_playlist': MAIN_PLAYLIST, 'other_playlist': OTHER_PLAYLIST}
+    config['gpio_pins'] = dict(GPIO_PINS)
+    for n in range(extra_playlists):
+        config['playlists'][f'genre{n}_playlist'] = extra_playlist_id(n)
+        config['gpio_pins'][f'button_save_genre{n}'] = EXTRA_PINS_START + n
+    config['options']['io_backend'] = SIM
+    config['options'].update(options)
+    utl.write_json(config, cnfg_handler.CONFIG_FILE, indent=4)
+    return [save_action(f'genre{n}_playlist') for n in range(extra_playlists)]
+
+
+def app_session(options: dict):
+    """ Builds the HTTP session for the fake API's Spotipy client the way the app builds its own for the given options
+        (rate limited requests are left to the request scheduler, and failed ones to the call guard, when they're enabled). """
+    return build_session(retries=0 if options.get('circuit_breaker') is True else RETRIES,
+                         retry_rate_limited=options.get('request_scheduler') is not True)
+
+
+def press_script(presses: int, main_tracks: list[str], rand: random.Random,
+                 extra_actions: list[str] = ()) -> list[tuple[str, str]]:
+    """ Builds the (action, playing track ID) of every scripted press (the extra save actions weigh as much as SAVE_OTHER). """
+    press_mix = dict(PRESS_MIX, **{action: PRESS_MIX[SAVE_OTHER] for action in extra_actions})
+    actions = rand.choices(list(press_mix), weights=list(press_mix.values()), k=presses)
+    script = []
+    for n, action in enumerate(actions):
+        roll = rand.random()
+        if roll < NOTHING_PLAYING:
+            track_id = None
+        elif roll < NOTHING_PLAYING + DUPLICATE:
+            track_id = rand.choice(main_tracks)
+        else:
+            track_id = fake_track_id(NEW_TRACKS_START + n)
+        script.append((action, track_id))
+    return script
+
+
+def press_buttons(quicksaver, api: FakeSpotifyAPI, script: list[tuple[str, str]]):
+    """ Plays the press script on the simulated buttons, one press after the other. With the playback poller
+        enabled, it's polled after every track change (like it would be while the track plays), so a press
+        never reads the previous press's track (or "nothing playing") from its cache. """
+    playback_poller = quicksaver.controller.playback_poller
+    for action, track_id in script:
+        if api.now_playing != track_id:
+            api.now_playing = track_id
+            if playback_poller is not None:
+                playback_poller.poll()
+        quicksaver.button_source.press(action)
+
+
+def count_outcomes(quicksaver) -> dict:
+    """ Counts the outcome of every press the app reports (e.g. how many found nothing playing) in the returned dict. """
+    outcomes = {}
+    export_outcome = quicksaver.export_outcome
+
+    def counting_export_outcome(action: str, outcome: str, *args):
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        export_outcome(action, outcome, *args)
+
+    quicksaver.export_outcome = counting_export_outcome
+    return outcomes
+
+
+def print_trace_stats(trace_stats: dict):
+    """ Prints the press latency percentiles of every action, with the p50 of each stage. """
+    for action, action_stats in sorted(trace_stats.items()):
+        stages = action_stats['stages']
+        total = stages[TOTAL]
+        print(f'  {action:<12} n={action_stats["count"]:<5} p50 {total["p50"]:8.1f} ms   '
+              f'p90 {total["p90"]:8.1f} ms   p99 {total["p99"]:8.1f} ms')
+        for stage, stage_stats in stages.items():
+            if stage not in (TOTAL, QUEUED):
+                print(f'      {stage:<26} p50 {stage_stats["p50"]:8.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--presses', type=int, default=40)
+    parser.add_argument('--main-size', type=int, default=1000, help='tracks in the main playlist')
+    parser.add_argument('--other-size', type=int, default=300, help='tracks in the other playlist')
+    parser.add_argument('--liked-size', type=int, default=2000, help='tracks in the liked songs')
+    parser.add_argument('--latency', type=float, default=0.03, help='simulated request round trip in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01, help='extra random delay of up to this many seconds')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='fraction of requests answered with a 429')
+    parser.add_argument('--extra-playlists', type=int, default=0, help='playlists besides main and other')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--profile-startup', action='store_true', help='report how long each startup step took')
+    parser.add_argument('--option', action='append', default=[], metavar='KEY=VALUE',
+                        help='config option to set for the run (can be repeated)')
+    args = parser.parse_args()
+
+    rand = random.Random(args.seed)
+    random.seed(args.seed)  # Fake API jitter and 429s
+    options = dict(parse_option(option) for option in args.option)
+
+    # Run in a scratch directory so the config, log, and indexes don't touch the real ones
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir, \
+            FakeSpotifyAPI(args.latency, args.jitter, rate_limit=args.rate_limit) as api:
+        os.chdir(work_dir)
+        try:
+            main_tracks = api.add_playlist(MAIN_PLAYLIST, args.main_size)
+            api.add_playlist(OTHER_PLAYLIST, args.other_size, first_track=args.main_size)
+            api.add_saved_tracks(args.liked_size, first_track=args.main_size + args.other_size)
+            for n in range(args.extra_playlists):
+                api.add_playlist(extra_playlist_id(n), args.other_size, first_track=args.main_size + n * args.other_size)
+            extra_actions = write_config(options, args.extra_playlists)
+
+            # Startup: from constructing the app to the ready lights
+            start = time.perf_counter()
+            profiler = StartupProfiler(enabled=args.profile_startup, started_at=start)
+            quicksaver = QuickSaver(spotify_api=api.client(app_session(options)), profiler=profiler)
+            quicksaver.start_quicksaver(wait=False)
+            startup = time.perf_counter() - start
+            startup_requests = api.request_count
+
+            # Scripted presses, until every one of them was handled
+            script = press_script(args.presses, main_tracks, rand, extra_actions)
+            outcomes = count_outcomes(quicksaver)
+            start = time.perf_counter()
+            press_buttons(quicksaver, api, script)
+            if quicksaver.input_pipeline is not None:
+                quicksaver.input_pipeline.stop()
+            elapsed = time.perf_counter() - start
+
+            trace_stats = tracing.tracer.stats()
+            led_stats = quicksaver.led_sink.stats()
+            quicksaver.stop_quicksaver(exit_app=False)
+        finally:
+            os.chdir(original_dir)
+
+    print(f'startup      {startup:8.3f} s   ({startup_requests} requests)')
+    print(f'presses      {args.presses:8d}     in {elapsed:.3f} s = {args.presses / elapsed:.2f} presses/s')
+    print(f'requests     {api.request_count - startup_requests:8d}     ({api.throttled_count} answered with 429)')
+    print(f'LED feedback {led_stats["feedback_time"]:8.3f} s   (recorded, not waited for)')
+    print('press latency (button edge to action done):')
+    print_trace_stats(trace_stats)
+
+    # Exactly the presses scripted with nothing playing must end as "nothing playing" (undo doesn't need a track),
+    # otherwise the presses didn't act on the scripted tracks (e.g. read a stale track from the poller's cache).
+    # Queued presses run after the script moved on to later tracks, so then only more of them is a failure.
+    nothing_playing = sum(1 for action, track_id in script if track_id is None and action != UNDO_SAVE)
+    found_nothing = outcomes.get(NO_TRACK, 0)
+    if found_nothing > nothing_playing or (found_nothing < nothing_playing and options.get('input_pipeline') is not True):
+        sys.exit(f'FAILED: {found_nothing} presses found nothing playing, {nothing_playing} were scripted that way')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+""" Measures the presses made while a big playlist loads against a rate limited fake API (a rolling window
+of requests, like Spotify's), without and with the request scheduler.
+
+Without the scheduler the loader's pages and the presses compete for the same requests, and whatever gets a
+429 sleeps out the Retry-After inside the HTTP session. With it, the requests are paced to the server's limit
+and the presses go ahead of the pages. Reports the load time, the press latency, the failed presses, and the
+429 responses.
+
+Usage: python -m benchmarks.bench_rate_limit [--size N] [--limit N] [--window SECONDS] [--interval SECONDS]
+"""
+from benchmarks.fake_spotify_api import FakeSpotifyAPI, fake_track_id
+from quicksave_controller import QuickSaveController
+from http_session import build_session
+import statistics
+import logging
+import threading
+import argparse
+import random
+import time
+
+BIG_PLAYLIST = "bigplaylist"
+MAIN_PLAYLIST = "mainplaylist"
+
+
+def run(scheduled: bool, args) -> dict:
+    """ Presses save and undo in turns while the big playlist loads, and returns the measurements. """
+    random.seed(args.seed)  # Fake API jitter
+    with FakeSpotifyAPI(args.latency, args.jitter, max_requests=args.limit, window=args.window) as api:
+        api.add_playlist(BIG_PLAYLIST, args.size)
+        api.add_playlist(MAIN_PLAYLIST, 10, first_track=args.size)
+
+        # The session retries the rate limited requests itself unless the scheduler does
+        options = {'playlist_index': False, 'token_refresher': False, 'parallel_loading': True,
+                   'loader_workers': args.workers, 'request_scheduler': scheduled, 'request_rate': args.rate,
+                   'request_burst': args.burst}
+        sp = api.client(build_session(retry_rate_limited=not scheduled))
+        controller = QuickSaveController(None, None, None, options, spotify_api=sp)
+
+        # Load the playlists in the background
+        loaded_at = []
+        start = time.perf_counter()
+
+        def load():
+            controller.set_playlists([MAIN_PLAYLIST, BIG_PLAYLIST])
+            loaded_at.append(time.perf_counter())
+        loader = threading.Thread(target=load, name='Loader')
+        loader.start()
+
+        # Press save and undo in turns until the playlists are loaded
+        latencies, failed, track = [], [], args.size + 10
+        while (loader.is_alive() or len(latencies) + len(failed) < args.min_presses) and \
+                time.perf_counter() - start < args.max_seconds:
+            time.sleep(args.interval)
+            press_start = time.perf_counter()
+            try:
+                if (len(latencies) + len(failed)) % 2 == 0:
+                    api.now_playing = fake_track_id(track)
+                    track += 1
+                    controller.quick_save(MAIN_PLAYLIST)
+                else:
+                    controller.undo_last_save()
+                latencies.append(time.perf_counter() - press_start)
+            except Exception as err:
+                failed.append(repr(err))
+        loader.join()
+
+        scheduler_stats = controller.client.scheduler.stats() if scheduled is True else None
+        controller.stop_background_tasks()
+        return {'load': loaded_at[0] - start, 'latencies': latencies, 'failed': failed,
+                'throttled': api.throttled_count, 'requests': api.request_count, 'scheduler': scheduler_stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=5000, help='tracks in the big playlist')
+    parser.add_argument('--limit', type=int, default=20, help='requests the fake API allows per window')
+    parser.add_argument('--window', type=float, default=1.0, help='seconds of the rolling window')
+    parser.add_argument('--rate', type=float, default=15.0, help='request scheduler rate (requests per second)')
+    parser.add_argument('--burst', type=int, default=10, help='request scheduler burst (requests sent back to back)')
+    parser.add_argument('--workers', type=int, default=4, help='parallel loader worker count')
+    parser.add_argument('--interval', type=float, default=0.25, help='seconds between presses')
+    parser.add_argument('--min-presses', type=int, default=10)
+    parser.add_argument('--max-seconds', type=float, default=120.0)
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated request round trip in seconds')
+    parser.add_argument('--jitter', type=float, default=0.005, help='extra random delay of up to this many seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    logging.getLogger('spotipy').setLevel(logging.CRITICAL)  # Spotipy logs every 429 response
+
+    print(f'{args.size} tracks loading, API limit {args.limit} requests per {args.window:g}s, a press every {args.interval:g}s')
+    print(f'{"scheduler":<10} {"load":>7} {"presses":>8} {"p50":>9} {"p95":>9} {"max":>9} {"failed":>7} {"429s":>6} {"requests":>9}')
+    for scheduled in (False, True):
+        results = run(scheduled, args)
+        latencies = sorted(results['latencies'])
+        p50 = statistics.median(latencies) * 1000 if len(latencies) > 0 else float('nan')
+        p95 = statistics.quantiles(latencies, n=20, method='inclusive')[-1] * 1000 if len(latencies) > 1 else p50
+        worst = latencies[-1] * 1000 if len(latencies) > 0 else float('nan')
+        label = 'on' if scheduled is True else 'off'
+        print(f'{label:<10} {results["load"]:6.2f}s {len(latencies) + len(results["failed"]):8d} {p50:6.0f} ms '
+              f'{p95:6.0f} ms {worst:6.0f} ms {len(results["failed"]):7d} {results["throttled"]:6d} {results["requests"]:9d}')
+        if len(results['failed']) > 0:
+            print(f'           first failure: {results["failed"][0]}')
+        if results['scheduler'] is not None:
+            print('           ' + ', '.join(f'{key}={value}' for key, value in results['scheduler'].items()))
+
+
+if __name__ == "__main__":
+    main()
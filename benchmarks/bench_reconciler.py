@@ -0,0 +1,80 @@
+""" Measures what keeping the playlist indexes in line with the edits made in the Spotify app costs.
+
+Edits the fake API's playlists behind the controller's back (like the Spotify app would), mixed with QuickSaver's
+own saves, and reconciles after each step. Reports how each playlist was synced, the requests and bytes it took
+(polls included), what downloading the changed playlists again would have taken instead (the way they're loaded
+at startup), and whether the indexes match the playlists.
+
+Usage: python -m benchmarks.bench_reconciler [--size N] [--latency SECONDS]
+"""
+from benchmarks.fake_spotify_api import FakeSpotifyAPI, fake_track_id
+from quicksave_controller import QuickSaveController
+from playlist_reconciler import UNCHANGED
+import argparse
+
+BIG_PLAYLIST = "bigplaylist"
+MAIN_PLAYLIST = "mainplaylist"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=5000, help='tracks in the big playlist')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated request round trip in seconds')
+    args = parser.parse_args()
+
+    with FakeSpotifyAPI(args.latency) as api:
+        api.add_playlist(BIG_PLAYLIST, args.size)
+        api.add_playlist(MAIN_PLAYLIST, 100, first_track=args.size)
+        options = {'playlist_index': False, 'token_refresher': False, 'playlist_reconciler': True}
+        controller = QuickSaveController(None, None, None, options, spotify_api=api.client())
+        controller.set_playlists([MAIN_PLAYLIST, BIG_PLAYLIST])
+        reconciler = controller.reconciler
+        new_track = args.size + 1000
+
+        def new_tracks(count: int) -> list[str]:
+            nonlocal new_track
+            new_track += count
+            return [fake_track_id(n) for n in range(new_track - count, new_track)]
+
+        def save(playlist_id: str):
+            api.now_playing = new_tracks(1)[0]
+            controller.quick_save(playlist_id)
+
+        # Each step edits the playlists (through the fake API, or by pressing save) before reconciling
+        steps = [
+            ('nothing changed', lambda: None),
+            ('app adds 3 tracks', lambda: api.edit_playlist(BIG_PLAYLIST, add=new_tracks(3))),
+            ('save, then app adds 2', lambda: (save(MAIN_PLAYLIST), api.edit_playlist(MAIN_PLAYLIST, add=new_tracks(2)))),
+            ('app adds 2, then save', lambda: (api.edit_playlist(MAIN_PLAYLIST, add=new_tracks(2)), save(MAIN_PLAYLIST))),
+            ('app adds 150 tracks', lambda: api.edit_playlist(BIG_PLAYLIST, add=new_tracks(150))),
+            ('app removes a track', lambda: api.edit_playlist(BIG_PLAYLIST, remove=api.playlists[BIG_PLAYLIST][:1])),
+            ('app adds 500 tracks', lambda: api.edit_playlist(MAIN_PLAYLIST, add=new_tracks(500))),
+            ('nothing changed', lambda: None),
+        ]
+
+        print(f'{args.size} + 100 tracks in the playlists')
+        print(f'{"step":<24} {"outcomes":<22} {"requests":>9} {"bytes":>9}   {"download again":>14} {"bytes":>9}  in sync')
+        for name, edit in steps:
+            edit()
+            requests_before, bytes_before = api.request_count, api.bytes_sent
+            outcomes = reconciler.reconcile_all()
+            requests, sent = api.request_count - requests_before, api.bytes_sent - bytes_before
+
+            # What downloading every changed playlist again would have taken instead
+            requests_before, bytes_before = api.request_count, api.bytes_sent
+            for playlist_id, outcome in outcomes.items():
+                if outcome != UNCHANGED:
+                    controller.download_playlist_tracks(playlist_id)
+            full_requests, full_sent = api.request_count - requests_before, api.bytes_sent - bytes_before
+
+            in_sync = all(controller.get_local_track_list(playlist_id) == set(api.playlists[playlist_id])
+                          for playlist_id in controller.playlist_ids)
+            print(f'{name:<24} {"/".join(outcomes.values()):<22} {requests:9d} {sent:9d}   '
+                  f'{full_requests:14d} {full_sent:9d}  {"yes" if in_sync else "NO"}')
+
+        print('         ' + ', '.join(f'{key}={value}' for key, value in reconciler.stats().items()))
+        controller.stop_background_tasks()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+""" Soak tests the whole QuickSaver app on the simulated buttons and LEDs against the local fake API.
+
+Replays a press trace (synthetic: steady, burst, double, or soak; or a file recorded with the
+record_presses option) while a simulated player changes the playing track, and samples the memory
+use along the way. Reports the press throughput and latency percentiles, and whether the memory
+kept growing. Meant to run headless for as long as needed (e.g. `--duration 14400` on a CI box).
+
+Usage: python -m benchmarks.bench_soak [--duration SECONDS] [--pattern steady|burst|double|soak] [--rate N]
+                                       [--trace FILE] [--speed N] [--track-length SECONDS] [--tracks N]
+                                       [--latency SECONDS] [--rate-limit FRACTION] [--option KEY=VALUE ...]
+"""
+from benchmarks.fake_spotify_api import FakeSpotifyAPI, fake_track_id
+from benchmarks.bench_quicksaver import MAIN_PLAYLIST, OTHER_PLAYLIST, write_config, parse_option, print_trace_stats, \
+    app_session
+from sim_io import PressTraceReplayer, load_press_trace, steady_trace, burst_trace, double_press_trace, soak_trace
+from quicksaver import QuickSaver
+import tempfile
+import argparse
+import threading
+import random
+import tracing
+import time
+import gc
+import os
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+BURST_SIZE = 8  # Presses per burst of the burst pattern
+
+
+def rss_mb() -> float:
+    """ Gets the resident memory of this process in MB. """
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * PAGE_SIZE / 1e6
+
+
+def build_trace(args) -> list[tuple[float, str]]:
+    """ Builds the press trace to replay from the arguments. """
+    if args.trace is not None:
+        return load_press_trace(args.trace)
+    count = int(args.duration * args.rate)
+    if args.pattern == 'steady':
+        return steady_trace(count, args.rate, seed=args.seed)
+    if args.pattern == 'burst':
+        gap = BURST_SIZE / args.rate  # Keeps the average rate
+        return burst_trace(max(count // BURST_SIZE, 1), BURST_SIZE, gap=gap, seed=args.seed)
+    if args.pattern == 'double':
+        return double_press_trace(max(count // 2, 1), args.rate / 2, seed=args.seed)
+    return soak_trace(args.duration, args.rate, seed=args.seed)
+
+
+def play_tracks(api: FakeSpotifyAPI, track_ids: list[str], track_length: float, stop_event: threading.Event):
+    """ Changes the playing track every track_length seconds (with a pause now and then), until stopped. """
+    rand = random.Random(0)
+    while not stop_event.is_set():
+        api.now_playing = None if rand.random() < 0.05 else rand.choice(track_ids)
+        stop_event.wait(track_length)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=60, help='seconds of synthetic presses')
+    parser.add_argument('--pattern', choices=['steady', 'burst', 'double', 'soak'], default='soak')
+    parser.add_argument('--rate', type=float, default=2.0, help='average presses per second')
+    parser.add_argument('--trace', help='press trace file to replay instead of a synthetic pattern')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay the trace this many times faster')
+    parser.add_argument('--track-length', type=float, default=3.0, help='seconds each track plays for')
+    parser.add_argument('--tracks', type=int, default=500, help='number of different tracks played')
+    parser.add_argument('--playlist-size', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.03, help='simulated request round trip in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='fraction of requests answered with a 429')
+    parser.add_argument('--sample-interval', type=float, default=10.0, help='seconds between memory samples')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--option', action='append', default=[], metavar='KEY=VALUE',
+                        help='config option to set for the run (can be repeated)')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    trace = build_trace(args)
+    options = dict(parse_option(option) for option in args.option)
+
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir, \
+            FakeSpotifyAPI(args.latency, args.jitter, rate_limit=args.rate_limit) as api:
+        os.chdir(work_dir)
+        try:
+            api.add_playlist(MAIN_PLAYLIST, args.playlist_size)
+            api.add_playlist(OTHER_PLAYLIST, args.playlist_size // 4, first_track=args.playlist_size)
+            track_ids = [fake_track_id(n) for n in range(args.playlist_size // 2, args.playlist_size // 2 + args.tracks)]
+            write_config(options)
+
+            quicksaver = QuickSaver(spotify_api=api.client(app_session(options)))
+            quicksaver.start_quicksaver(wait=False)
+
+            # Play tracks and replay the presses, sampling the memory until the trace is done
+            stop_event = threading.Event()
+            threading.Thread(target=play_tracks, args=(api, track_ids, args.track_length, stop_event),
+                             daemon=True).start()
+            replayer = PressTraceReplayer(quicksaver.button_source, trace, args.speed)
+            gc.collect()
+            samples = [(0.0, rss_mb())]
+            start = time.perf_counter()
+            replayer.start()
+            while replayer.wait(args.sample_interval) is False:
+                samples.append((time.perf_counter() - start, rss_mb()))
+            samples.append((time.perf_counter() - start, rss_mb()))
+            if quicksaver.input_pipeline is not None:
+                quicksaver.input_pipeline.stop()
+            elapsed = time.perf_counter() - start
+            stop_event.set()
+
+            trace_stats = tracing.tracer.stats()
+            led_stats = quicksaver.led_sink.stats()
+            quicksaver.stop_quicksaver(exit_app=False)
+        finally:
+            os.chdir(original_dir)
+
+    # Compare the memory of the second half of the run with the first (after warming up)
+    half = len(samples) // 2
+    first_half_peak = max(rss for _, rss in samples[:max(half, 1)])
+    second_half_peak = max(rss for _, rss in samples[half:])
+
+    print(f'presses      {replayer.pressed:8d}     in {elapsed:.1f} s = {replayer.pressed / elapsed:.2f} presses/s '
+          f'(trace asked for {len(trace) / (trace[-1][0] / args.speed):.2f}/s, {replayer.late:.1f} s late in total)')
+    print(f'requests     {api.request_count:8d}     ({api.throttled_count} answered with 429)')
+    print(f'LED feedback {led_stats["feedback_time"]:8.1f} s   ({led_stats["led_events"]} LED events, recorded)')
+    print(f'memory       start {samples[0][1]:.1f} MB, peak {max(rss for _, rss in samples):.1f} MB, '
+          f'end {samples[-1][1]:.1f} MB, growth over the second half {second_half_peak - first_half_peak:+.1f} MB')
+    print('press latency (button edge to action done):')
+    print_trace_stats(trace_stats)
+
+
+if __name__ == "__main__":
+    main()
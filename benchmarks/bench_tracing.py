@@ -0,0 +1,57 @@
+""" Measures the overhead tracing adds to a press.
+
+Times a traced press with the same number of spans a quick save records (edge, trace,
+currently playing, duplicate check, library and playlist writes, notify)
+against the same press with tracing disabled, with no work inside the spans.
+
+Usage: python -m benchmarks.bench_tracing [--presses N]
+"""
+from actions import SAVE_MAIN
+from tracing import Tracer
+import argparse
+import time
+
+STAGES = ('currently_playing', 'api.currently_playing', 'dupe_check', 'library_write', 'api.saved_tracks_add',
+          'playlist_write', 'api.playlist_add', 'notify')
+
+
+def press(tracer: Tracer):
+    """ Records one empty quick save press. """
+    with tracer.trace(SAVE_MAIN, tracer.edge()):
+        for stage in STAGES:
+            with tracer.span(stage):
+                pass
+
+
+def time_presses(tracer: Tracer, presses: int) -> float:
+    """ Returns the average time of an empty press in microseconds. """
+    start = time.perf_counter()
+    for _ in range(presses):
+        press(tracer)
+    return (time.perf_counter() - start) / presses * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--presses', type=int, default=100000)
+    args = parser.parse_args()
+
+    enabled = Tracer()
+    disabled = Tracer()
+    disabled.enabled = False
+
+    enabled_us = time_presses(enabled, args.presses)
+    disabled_us = time_presses(disabled, args.presses)
+
+    start = time.perf_counter()
+    enabled.stats()
+    stats_ms = (time.perf_counter() - start) * 1000
+
+    print(f'traced press    {enabled_us:6.2f} us')
+    print(f'untraced press  {disabled_us:6.2f} us')
+    print(f'overhead        {enabled_us - disabled_us:6.2f} us per press ({len(STAGES)} spans)')
+    print(f'stats dump      {stats_ms:6.2f} ms')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+""" Compares the memory and lookup speed of a set of track ID strings with the compact TrackIndex, and with a
+playlist's tracks in the membership index (dict of ID strings, and compact).
+
+For each size, builds each of them from freshly generated IDs (as if they were just downloaded) and reports the memory
+they hold on to (measured with tracemalloc), the time to build them from a list of IDs, the time of a membership
+test (half hits, half misses), and the time of an add and remove (what a save and undo do to the local track list).
+
+Usage: python -m benchmarks.bench_track_index [--sizes N,N,...] [--lookups N] [--edits N]
+"""
+from playlist_membership import PlaylistMembership
+from track_index import TrackIndex
+import utils as utl
+import tracemalloc
+import argparse
+import random
+import time
+import gc
+
+
+def random_track_ids(count: int, rand: random.Random):
+    """ Yields the given number of random (128-bit) track IDs. """
+    for _ in range(count):
+        yield utl.int_to_track_id(rand.getrandbits(128))
+
+
+def measure_memory(factory, count: int, seed: int) -> int:
+    """ Builds a track list from freshly generated IDs (as if they were just downloaded) and returns the bytes it holds on to. """
+    gc.collect()
+    tracemalloc.start()
+    track_list = factory(random_track_ids(count, random.Random(seed)))
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del track_list
+    return memory
+
+
+def membership_tracks(compact: bool):
+    """ Returns a factory that loads the given track IDs as a playlist of a new membership index and returns its view. """
+    def factory(track_ids) -> object:
+        membership = PlaylistMembership(compact)
+        membership.load(1, track_ids)
+        return membership.view(1)
+    return factory
+
+
+def time_per_call(func, args: list) -> float:
+    """ Times calling func on each of the given arguments and returns the average time per call. """
+    start = time.perf_counter()
+    for arg in args:
+        func(arg)
+    return (time.perf_counter() - start) / len(args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='comma separated numbers of track IDs')
+    parser.add_argument('--lookups', type=int, default=100_000)
+    parser.add_argument('--edits', type=int, default=1000, help='adds (and removes) timed per size')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f'{"size":>9}  {"type":<10} {"memory":>10} {"per track":>10} {"build":>8} {"lookup":>9} {"add":>9} {"remove":>9}')
+    for size in (int(size) for size in args.sizes.split(',')):
+        # Look up the first IDs of the list (hits) and IDs that aren't in it (misses)
+        rand = random.Random(args.seed + 1)
+        hits = list(random_track_ids(args.lookups // 2, random.Random(args.seed)))[:size]
+        misses = list(random_track_ids(args.lookups - len(hits), rand))
+        lookups = hits + misses
+        rand.shuffle(lookups)
+        new_ids = list(random_track_ids(args.edits, rand))
+
+        track_ids = list(random_track_ids(size, random.Random(args.seed)))
+        factories = (('set', set), ('TrackIndex', TrackIndex),
+                     ('shared', membership_tracks(False)), ('compact', membership_tracks(True)))
+        for label, factory in factories:
+            memory = measure_memory(factory, size, args.seed)
+            start = time.perf_counter()
+            track_list = factory(track_ids)
+            build = time.perf_counter() - start
+            assert all(track_id in track_list for track_id in hits)
+            lookup = time_per_call(track_list.__contains__, lookups)
+            add = time_per_call(track_list.add, new_ids)
+            remove = time_per_call(track_list.remove, new_ids)
+            print(f'{size:9d}  {label:<10} {memory / 1e6:7.2f} MB {memory / size:8.1f} B {build:7.2f}s '
+                  f'{lookup * 1e6:6.2f} us {add * 1e6:6.2f} us {remove * 1e6:6.2f} us')
+            del track_list
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+""" Checks that replaying the offline journal never undoes a newer press.
+
+Saves a track while the fake API is unreachable (so the save is journaled), undoes the save once the network
+is back, then replays the journal. The undo must win: the track ends up in neither the library nor the playlist,
+on Spotify and in the local records. Exits with an error if the replay brought the save back.
+
+Usage: python -m benchmarks.check_journal_order [--stall SECONDS]
+"""
+from benchmarks.fake_spotify_api import FakeSpotifyAPI, fake_track_id
+from benchmarks.bench_quicksaver import app_session
+from quicksave_controller import QuickSaveController
+import tempfile
+import argparse
+import logging
+import sys
+import os
+
+PLAYLIST = "mainplaylist"
+READ_TIMEOUT = 0.3  # Seconds the writes wait for the stalled API before counting it as unreachable
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stall', type=float, default=1.0, help='seconds every response is held back while offline')
+    args = parser.parse_args()
+
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir, FakeSpotifyAPI() as api:
+        os.chdir(work_dir)
+        try:
+            api.add_playlist(PLAYLIST, 100)
+            options = {'playlist_index': False, 'token_refresher': False, 'offline_journal': True,
+                       'playback_poller': True}
+            spotify_api = api.client(app_session(options))
+            spotify_api.requests_timeout = READ_TIMEOUT
+            controller = QuickSaveController(None, logging.getLogger('check_journal_order'), None, options,
+                                             spotify_api=spotify_api)
+            controller.set_playlists([PLAYLIST])
+            track_id = fake_track_id(1000)
+
+            # Save while offline: the poller still knows what's playing, the writes are journaled
+            api.now_playing = track_id
+            controller.playback_poller.poll()
+            api.stall = args.stall
+            controller.quick_save(PLAYLIST)
+            journaled = len(controller.journal)
+
+            # Undo once the network is back, then replay the journal
+            api.stall = 0.0
+            controller.undo_last_save()
+            controller.journal.replay()
+
+            in_library = track_id in api.saved_tracks
+            in_playlist = track_id in api.playlists[PLAYLIST]
+            in_local = track_id in controller.get_local_track_list(PLAYLIST)
+            controller.stop_background_tasks()
+        finally:
+            os.chdir(original_dir)
+
+    print(f'journaled writes   {journaled}')
+    print(f'after the replay   library={in_library}, playlist={in_playlist}, local records={in_local}')
+    if journaled == 0 or in_library or in_playlist or in_local:
+        sys.exit('FAILED: the replay did not keep the undo')
+    print('OK: the undo was kept')
+
+
+if __name__ == "__main__":
+    main()
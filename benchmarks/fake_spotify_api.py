@@ -0,0 +1,385 @@
+""" Local stand-in for the parts of the Spotify Web API that QuickSaver uses. """
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from collections import deque
+import subprocess
+import tempfile
+import threading
+import os.path
+import ssl
+import random
+import json
+import math
+import time
+import re
+import spotipy
+
+BASE62 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+USER_ID = "fakeuser"
+ADDED_AT = "2024-01-01T00:00:00Z"  # When the tracks of the playlists made by add_playlist were added
+
+
+def fake_track_id(n: int) -> str:
+    """ Returns a deterministic 22 character base62 track ID for the given number. """
+    digits = []
+    n = n * 2654435761 + 10 ** 30  # Spread the IDs out so they look like real ones
+    while n > 0:
+        n, rem = divmod(n, 62)
+        digits.append(BASE62[rem])
+    return ''.join(reversed(digits)).rjust(22, '0')[-22:]
+
+
+class FakeSpotifyAPI:
+    """ Threaded local HTTP server that imitates the Spotify Web API, with configurable latency. """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, connect_latency: float = 0.0, tls: bool = False,
+                 rate_limit: float = 0.0, retry_after: int = 1, max_requests: int = 0, window: float = 30.0):
+        self.latency = latency  # Base delay added to every response (seconds)
+        self.jitter = jitter    # Extra random delay of up to this many seconds
+        self.rate_limit = rate_limit    # Fraction of requests answered with 429 Too Many Requests
+        self.retry_after = retry_after  # Seconds sent in the Retry-After header of a 429
+        self.max_requests = max_requests  # Requests allowed per rolling window, like Spotify's own limit (0 for no limit)
+        self.window = window              # Seconds of the rolling window
+        self._window_requests = deque()   # Times of the requests let through during the current window
+        self.connect_latency = connect_latency  # Delay added to every new connection (TCP + TLS round trips)
+        self.stall = 0.0  # Extra delay of every response, set while running to simulate a degraded network (seconds)
+        self.tls = tls          # Serve HTTPS with a throwaway self-signed certificate
+        self.cert_file = None   # Path of the certificate clients need to trust when serving HTTPS
+        self.connections = 0
+        self.now_playing = None  # Track ID returned by the currently playing endpoint
+        self.playlists = {}     # Playlist ID -> list of track IDs
+        self.snapshots = {}     # Playlist ID -> snapshot ID (changes on every edit)
+        self.added_times = {}   # Playlist ID -> when each of its tracks was added (ISO 8601, in playlist order)
+        self.saved_tracks = []  # Track IDs in the user's library (newest first)
+        self.request_count = 0
+        self.throttled_count = 0  # Number of requests answered with a 429
+        self.bytes_sent = 0  # Bytes of JSON sent in the response bodies
+        self.endpoint_counts = {}  # "METHOD /path" (IDs replaced with {id}) -> number of requests
+        self._lock = threading.Lock()
+        self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def prefix(self) -> str:
+        """ The API prefix to point a Spotipy client at this server. """
+        scheme = 'https' if self.tls is True else 'http'
+        return f'{scheme}://127.0.0.1:{self._server.server_address[1]}/v1/'
+
+    def start(self):
+        """ Starts serving requests on a free local port in a background thread. """
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _make_handler(self))
+        self._server.daemon_threads = True
+        if self.tls is True:
+            self._cert_dir = tempfile.TemporaryDirectory()
+            self.cert_file, key_file = _make_self_signed_cert(self._cert_dir.name)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.cert_file, key_file)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        """ Stops the server. """
+        self._server.shutdown()
+        self._server.server_close()
+        if self.tls is True:
+            self._cert_dir.cleanup()
+
+    def client(self, requests_session=True) -> spotipy.Spotify:
+        """ Creates a Spotipy client that sends its requests to this server (through the given session if provided). """
+        sp = spotipy.Spotify(auth='fake-access-token', requests_session=requests_session)
+        sp.prefix = self.prefix
+        return sp
+
+    def add_playlist(self, playlist_id: str, size: int, first_track: int = 0) -> list[str]:
+        """ Creates a playlist with the given number of tracks and returns its track IDs. """
+        self.playlists[playlist_id] = [fake_track_id(n) for n in range(first_track, first_track + size)]
+        self.added_times[playlist_id] = [ADDED_AT] * size
+        self.bump_snapshot(playlist_id)
+        return self.playlists[playlist_id]
+
+    def bump_snapshot(self, playlist_id: str) -> str:
+        """ Gives the playlist a new snapshot ID, like the API does after every edit. """
+        version = int(self.snapshots.get(playlist_id, 'v0').split('v')[-1]) + 1
+        self.snapshots[playlist_id] = f'{playlist_id}v{version}'
+        return self.snapshots[playlist_id]
+
+    def add_saved_tracks(self, size: int, first_track: int = 0) -> list[str]:
+        """ Adds the given number of tracks to the user's library and returns their IDs. """
+        track_ids = [fake_track_id(n) for n in range(first_track, first_track + size)]
+        self.saved_tracks[:0] = reversed(track_ids)
+        return track_ids
+
+    def delay(self):
+        """ Sleeps for the configured latency plus jitter. """
+        with self._lock:
+            self.request_count += 1
+        time.sleep(self.latency + random.uniform(0, self.jitter) + self.stall)
+
+    def count_request(self, method: str, path: str) -> int:
+        """ Counts the request by endpoint and returns the seconds it should tell the client to wait
+            if it's rate limited (None otherwise). """
+        endpoint = method + ' ' + re.sub(r'/(playlists|users)/\w+', r'/\1/{id}', path)
+        now = time.monotonic()
+        with self._lock:
+            self.endpoint_counts[endpoint] = self.endpoint_counts.get(endpoint, 0) + 1
+            if random.random() < self.rate_limit:
+                self.throttled_count += 1
+                return self.retry_after
+
+            # Over the rolling window's limit, wait until the oldest request in it leaves the window
+            if self.max_requests > 0:
+                while len(self._window_requests) > 0 and now - self._window_requests[0] >= self.window:
+                    self._window_requests.popleft()
+                if len(self._window_requests) >= self.max_requests:
+                    self.throttled_count += 1
+                    return math.ceil(self._window_requests[0] + self.window - now)
+                self._window_requests.append(now)
+        return None
+
+    def save_tracks(self, track_ids: list[str]):
+        """ Adds the given tracks to the front of the user's library (skipping the ones already in it). """
+        with self._lock:
+            new_ids = [track_id for track_id in track_ids if track_id not in self.saved_tracks]
+            self.saved_tracks[:0] = reversed(new_ids)
+
+    def unsave_tracks(self, track_ids: list[str]):
+        """ Removes the given tracks from the user's library. """
+        with self._lock:
+            self.saved_tracks = [track_id for track_id in self.saved_tracks if track_id not in track_ids]
+
+    def edit_playlist(self, playlist_id: str, add: list[str] = (), remove: list[str] = ()) -> str:
+        """ Appends and removes the given tracks and returns the playlist's new snapshot ID
+            (also used to edit the playlists like the Spotify app would, while QuickSaver runs). """
+        with self._lock:
+            kept = [(track_id, added_at) for track_id, added_at in zip(self.playlists[playlist_id],
+                                                                       self.added_times[playlist_id])
+                    if track_id not in remove]
+            now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+            self.playlists[playlist_id] = [track_id for track_id, _ in kept] + list(add)
+            self.added_times[playlist_id] = [added_at for _, added_at in kept] + [now] * len(add)
+            return self.bump_snapshot(playlist_id)
+
+    def create_playlist(self, name: str) -> str:
+        """ Creates an empty playlist and returns its ID. """
+        with self._lock:
+            playlist_id = f'fakeplaylist{len(self.playlists):010d}'
+        self.add_playlist(playlist_id, 0)
+        return playlist_id
+
+    def saved_tracks_page(self, query: dict) -> dict:
+        """ Builds a page of the user's saved tracks like the API does, honouring offset and limit. """
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 20))
+        items = [_full_item(track_id) for track_id in self.saved_tracks[offset:offset + limit]]
+        next_url = None
+        if offset + limit < len(self.saved_tracks):
+            next_url = f'{self.prefix}me/tracks?offset={offset + limit}&limit={limit}'
+        return {'items': items, 'total': len(self.saved_tracks), 'next': next_url, 'offset': offset, 'limit': limit}
+
+    def playlist_tracks_page(self, playlist_id: str, query: dict) -> dict:
+        """ Builds a page of playlist items like the API does, honouring offset, limit and fields. """
+        tracks = self.playlists[playlist_id]
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 100))
+        fields = query.get('fields')
+
+        # Only return the track IDs (and when they were added, if asked for) when the caller asked for a subset of the fields
+        if fields is not None and 'added_at' in fields:
+            items = [{'added_at': added_at, 'track': {'id': track_id}} for track_id, added_at
+                     in zip(tracks[offset:offset + limit], self.added_times[playlist_id][offset:offset + limit])]
+        elif fields is not None:
+            items = [{'track': {'id': track_id}} for track_id in tracks[offset:offset + limit]]
+        else:
+            items = [_full_item(track_id) for track_id in tracks[offset:offset + limit]]
+
+        next_url = None
+        if offset + limit < len(tracks):
+            next_url = f'{self.prefix}playlists/{playlist_id}/tracks?offset={offset + limit}&limit={limit}'
+            if fields is not None:
+                next_url += '&fields=' + fields
+
+        page = {'items': items, 'total': len(tracks), 'next': next_url, 'offset': offset, 'limit': limit}
+        if fields is not None:
+            page = {key: value for key, value in page.items() if key == 'items' or key in fields}
+        return page
+
+
+def _make_self_signed_cert(directory: str) -> tuple[str, str]:
+    """ Creates a self-signed certificate for 127.0.0.1 with openssl and returns the certificate and key paths. """
+    cert_file, key_file = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-keyout', key_file, '-out', cert_file, '-subj', '/CN=127.0.0.1',
+                    '-addext', 'subjectAltName=IP:127.0.0.1'], check=True, capture_output=True)
+    return cert_file, key_file
+
+
+def _full_item(track_id: str) -> dict:
+    """ Builds a playlist item with roughly the bulk of a real one. """
+    return {
+        'added_at': ADDED_AT,
+        'track': {
+            'id': track_id,
+            'name': 'Track ' + track_id,
+            'uri': 'spotify:track:' + track_id,
+            'duration_ms': 200000,
+            'available_markets': ['US', 'CA', 'GB', 'FR', 'DE', 'JP'] * 10,
+            'album': {'id': track_id[::-1], 'name': 'Album', 'images': [{'url': 'https://i.scdn.co/image/' + track_id}] * 3},
+            'artists': [{'id': track_id[:11] * 2, 'name': 'Artist'}]
+        }
+    }
+
+
+def _ids_from_uris(uris) -> list[str]:
+    """ Gets the track IDs from the given track URIs (a list, or a comma separated string). """
+    if isinstance(uris, str):
+        uris = uris.split(',')
+    return [uri.split(':')[-1] for uri in uris]
+
+
+def _make_handler(api: FakeSpotifyAPI):
+    """ Creates the request handler class bound to the given fake API. """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep connections alive like the real API
+        disable_nagle_algorithm = True  # Headers and body are separate writes, don't let them wait on ACKs
+
+        def log_message(self, format, *args):
+            pass  # Keep benchmark output clean
+
+        def setup(self):
+            # Runs once per connection, so new connections pay for the simulated handshake
+            super().setup()
+            with api._lock:
+                api.connections += 1
+            time.sleep(api.connect_latency)
+
+        def do_HEAD(self):
+            api.delay()
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def send_empty(self, status: int, headers: dict = None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def read_request(self, method: str) -> tuple:
+            """ Waits out the latency and parses the request into its path, query, and JSON body,
+                or answers it with a 429 and returns None if it's rate limited. """
+            api.delay()
+            url = urlparse(self.path)
+            path = url.path.rstrip('/')
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length)) if length > 0 else None
+            retry_after = api.count_request(method, path)
+            if retry_after is not None:
+                self.send_empty(429, {'Retry-After': str(retry_after)})
+                return None
+            return path, {key: values[0] for key, values in parse_qs(url.query).items()}, body
+
+        def send_json(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            with api._lock:
+                api.bytes_sent += len(data)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # The client gave up waiting (timed out while the responses are stalled)
+
+        def send_not_found(self):
+            self.send_json(404, {'error': {'status': 404, 'message': 'Not found'}})
+
+        def do_GET(self):
+            request = self.read_request('GET')
+            if request is None:
+                return
+            path, query, _ = request
+
+            if path == '/v1/me':
+                return self.send_json(200, {'id': USER_ID})
+
+            if path == '/v1/me/player/currently-playing':
+                if api.now_playing is None:
+                    return self.send_empty(204)
+                return self.send_json(200, {'is_playing': True, 'progress_ms': 1000,
+                                            'item': {'id': api.now_playing, 'duration_ms': 200000}})
+
+            if path == '/v1/me/tracks':
+                return self.send_json(200, api.saved_tracks_page(query))
+
+            if path == '/v1/me/library/contains':
+                saved = set(api.saved_tracks)
+                return self.send_json(200, [track_id in saved for track_id in _ids_from_uris(query['uris'])])
+
+            match = re.fullmatch(r'/v1/playlists/(\w+)', path)
+            if match and match.group(1) in api.playlists:
+                playlist_id = match.group(1)
+                return self.send_json(200, {'id': playlist_id, 'snapshot_id': api.snapshots[playlist_id],
+                                            'owner': {'id': USER_ID}, 'tracks': {'total': len(api.playlists[playlist_id])}})
+
+            match = re.fullmatch(r'/v1/playlists/(\w+)/(?:tracks|items)', path)
+            if match and match.group(1) in api.playlists:
+                return self.send_json(200, api.playlist_tracks_page(match.group(1), query))
+
+            self.send_not_found()
+
+        def do_PUT(self):
+            request = self.read_request('PUT')
+            if request is None:
+                return
+            path, query, _ = request
+
+            if path == '/v1/me/library':
+                api.save_tracks(_ids_from_uris(query['uris']))
+                return self.send_empty(200)
+
+            self.send_not_found()
+
+        def do_POST(self):
+            request = self.read_request('POST')
+            if request is None:
+                return
+            path, _, body = request
+
+            match = re.fullmatch(r'/v1/playlists/(\w+)/(?:tracks|items)', path)
+            if match and match.group(1) in api.playlists:
+                snapshot_id = api.edit_playlist(match.group(1), add=_ids_from_uris(body))
+                return self.send_json(201, {'snapshot_id': snapshot_id})
+
+            match = re.fullmatch(r'/v1/users/(\w+)/playlists', path)
+            if match:
+                return self.send_json(201, {'id': api.create_playlist(body['name']), 'name': body['name']})
+
+            self.send_not_found()
+
+        def do_DELETE(self):
+            request = self.read_request('DELETE')
+            if request is None:
+                return
+            path, query, body = request
+
+            if path == '/v1/me/library':
+                api.unsave_tracks(_ids_from_uris(query['uris']))
+                return self.send_empty(200)
+
+            match = re.fullmatch(r'/v1/playlists/(\w+)/(?:tracks|items)', path)
+            if match and match.group(1) in api.playlists:
+                track_ids = _ids_from_uris([item['uri'] for item in body['items']])
+                return self.send_json(200, {'snapshot_id': api.edit_playlist(match.group(1), remove=track_ids)})
+
+            self.send_not_found()
+
+    return Handler
@@ -0,0 +1,170 @@
+""" Stress tests the controller with thousands of interleaved presses (saves to several playlists, undos and
+like toggles) fired from many threads at once, against an in-memory fake Spotify client with a per-call delay.
+
+After each run it checks that every playlist holds no duplicates and matches its local track list, and reports
+the throughput and the most API calls that were in flight at once. The `global` mode handles one press at a
+time (as if every press took a single global lock) to show what the per-playlist locking gains.
+
+Usage: python -m benchmarks.stress_controller [--presses N] [--threads N] [--playlists N] [--latency SECONDS]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from quicksave_controller import QuickSaveController
+from benchmarks.fake_spotify_api import fake_track_id
+import argparse
+import random
+import threading
+import time
+
+MODES = ("global", "per-playlist", "per-playlist + concurrent writes")
+SAVE_SHARE = 0.7  # Share of the presses that are saves (the rest are split between undos and like toggles)
+UNDO_SHARE = 0.15
+
+
+class FakeSpotipy:
+    """ In-memory stand-in for the spotipy.Spotify calls the controller makes, each taking the given delay. """
+
+    def __init__(self, playlist_ids: list[str], track_pool: list[str], latency: float, seed: int):
+        self.latency = latency
+        self.track_pool = track_pool
+        self.playlists = {playlist_id: [] for playlist_id in playlist_ids}  # Playlist ID -> its track IDs in order
+        self.saved_tracks = set()
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0  # Most calls handled at the same time
+        self._rand = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self):
+        """ Counts the call and waits out the simulated round trip (outside of the lock, like a real request). """
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self._lock:
+            self.in_flight -= 1
+
+    def me(self) -> dict:
+        return {'id': 'fakeuser'}
+
+    def current_user_playing_track(self) -> dict:
+        self._call()
+        with self._lock:
+            return {'item': {'id': self._rand.choice(self.track_pool)}}
+
+    def current_user_saved_tracks_add(self, track_ids: list[str]):
+        self._call()
+        with self._lock:
+            self.saved_tracks.update(track_ids)
+
+    def current_user_saved_tracks_delete(self, track_ids: list[str]):
+        self._call()
+        with self._lock:
+            self.saved_tracks.difference_update(track_ids)
+
+    def current_user_saved_tracks_contains(self, track_ids: list[str]) -> list[bool]:
+        self._call()
+        with self._lock:
+            return [track_id in self.saved_tracks for track_id in track_ids]
+
+    def playlist_add_items(self, playlist_id: str, track_ids: list[str]) -> dict:
+        self._call()
+        with self._lock:
+            self.playlists[playlist_id].extend(track_ids)
+            return {'snapshot_id': str(self.calls)}
+
+    def playlist_remove_all_occurrences_of_items(self, playlist_id: str, track_ids: list[str]) -> dict:
+        self._call()
+        with self._lock:
+            self.playlists[playlist_id] = [track_id for track_id in self.playlists[playlist_id] if track_id not in track_ids]
+            return {'snapshot_id': str(self.calls)}
+
+    def playlist_tracks(self, playlist_id: str) -> dict:
+        return {'items': [], 'next': None}
+
+
+def run(mode: str, args) -> dict:
+    """ Fires the presses at a fresh controller in the given mode, checks the results, and returns the measurements. """
+    playlist_ids = [f'stressplaylist{n}' for n in range(args.playlists)]
+    track_pool = [fake_track_id(n) for n in range(args.tracks)]
+    api = FakeSpotipy(playlist_ids, track_pool, args.latency, args.seed)
+
+    options = {'playlist_index': False, 'token_refresher': False, 'concurrent_writes': mode == MODES[2]}
+    controller = QuickSaveController(None, None, None, options, spotify_api=api)
+    controller.set_playlists(playlist_ids)
+
+    # Each press is a save to a random playlist, an undo, or a like toggle
+    rand = random.Random(args.seed)
+    presses = []
+    for _ in range(args.presses):
+        roll = rand.random()
+        if roll < SAVE_SHARE:
+            presses.append((controller.quick_save, rand.choice(playlist_ids)))
+        elif roll < SAVE_SHARE + UNDO_SHARE:
+            presses.append((controller.undo_last_save, None))
+        else:
+            presses.append((controller.toggle_like, None))
+
+    global_lock = threading.Lock()
+    errors = []
+
+    def press(action):
+        func, playlist_id = action
+        try:
+            if mode == MODES[0]:
+                with global_lock:
+                    func() if playlist_id is None else func(playlist_id)
+            else:
+                func() if playlist_id is None else func(playlist_id)
+        except Exception as err:
+            errors.append(repr(err))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(press, presses))
+    elapsed = time.perf_counter() - start
+    controller.stop_background_tasks()
+
+    # Every playlist must match its local track list, without a track saved twice
+    duplicates = sum(len(tracks) - len(set(tracks)) for tracks in api.playlists.values())
+    mismatched = [playlist_id for playlist_id in playlist_ids
+                  if controller.get_local_track_list(playlist_id) != set(api.playlists[playlist_id])]
+
+    return {'seconds': elapsed, 'errors': errors, 'duplicates': duplicates, 'mismatched': mismatched,
+            'calls': api.calls, 'max_in_flight': api.max_in_flight,
+            'tracks': sum(len(tracks) for tracks in api.playlists.values())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--presses', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=16, help='presses fired at the same time')
+    parser.add_argument('--playlists', type=int, default=8)
+    parser.add_argument('--tracks', type=int, default=200, help='different tracks that can be playing (few means many duplicates)')
+    parser.add_argument('--latency', type=float, default=0.002, help='simulated API round trip in seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f'{args.presses} presses from {args.threads} threads, {args.playlists} playlists, {args.tracks} tracks')
+    print(f'{"mode":<34} {"time":>8} {"presses/s":>10} {"API calls":>10} {"max in flight":>14} {"saved":>6}  result')
+    failed = False
+    for mode in MODES:
+        results = run(mode, args)
+        problems = []
+        if len(results['errors']) > 0:
+            problems.append(f'{len(results["errors"])} errors (first: {results["errors"][0]})')
+        if results['duplicates'] > 0:
+            problems.append(f'{results["duplicates"]} duplicates')
+        if len(results['mismatched']) > 0:
+            problems.append(f'{len(results["mismatched"])} playlists out of sync')
+        failed = failed or len(problems) > 0
+
+        print(f'{mode:<34} {results["seconds"]:7.2f}s {args.presses / results["seconds"]:10.0f} {results["calls"]:10d} '
+              f'{results["max_in_flight"]:14d} {results["tracks"]:6d}  {", ".join(problems) or "ok"}')
+
+    if failed is True:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+""" Bounds how long the API calls can take when the network is degraded.
+
+Each call gets a timeout budget for its endpoint (tight for the calls a press waits on), reads that
+fail to reach Spotify are retried after a jittered backoff (writes aren't, they may have gone through),
+and a press sets a deadline the calls it makes have to fit in. After repeated failures a circuit breaker
+trips, and every call fails right away (without touching the network) until a trial call gets through.
+"""
+from contextlib import contextmanager
+from http_session import call_timeout
+import requests
+import threading
+import random
+import time
+
+# Circuit breaker states
+CLOSED = "closed"        # Calls go through
+OPEN = "open"            # Calls fail right away
+HALF_OPEN = "half_open"  # A single trial call goes through to check whether Spotify can be reached again
+
+FAILURES = 5  # Failed calls in a row that trip the breaker
+RESET_TIMEOUT = 30.0  # Seconds the breaker stays open before a trial call
+READ_RETRIES = 2  # Retries of a read that couldn't reach Spotify
+RETRY_BACKOFF = 0.2  # Max seconds before the first retry (doubles with every retry, the wait is picked at random below it)
+PRESS_DEADLINE = 3.0  # Seconds the calls of a press have to finish in
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """ Raised instead of making a call while the circuit breaker is open (counts as a network error). """
+
+
+class CallTimeoutError(requests.exceptions.Timeout):
+    """ Raised instead of making a call when the deadline of the press already passed. """
+
+
+class CircuitBreaker:
+    """ Trips after the given number of failed calls in a row, then fails the calls right away until
+        the reset timeout passes and a trial call gets through. """
+
+    def __init__(self, failures: int = FAILURES, reset_timeout: float = RESET_TIMEOUT):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failed_in_a_row = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+        # Counters for the breaker stats
+        self.trips = 0
+        self.rejected = 0  # Calls failed right away while the breaker was open
+
+    def before_call(self):
+        """ Raises a CircuitOpenError if the call can't go through (the breaker is open, or a trial call is running). """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == CLOSED or (self.state == HALF_OPEN and self._trial_running is False):
+                self._trial_running = self.state == HALF_OPEN
+                return
+            self.rejected += 1
+        raise CircuitOpenError('Spotify could not be reached recently, the call was not made')
+
+    def on_success(self):
+        """ Closes the breaker after a call reached Spotify. """
+        with self._lock:
+            self.state = CLOSED
+            self.failed_in_a_row = 0
+            self._trial_running = False
+
+    def on_failure(self):
+        """ Counts a call that couldn't reach Spotify and trips the breaker if it failed too often (or on a failed trial). """
+        with self._lock:
+            self.failed_in_a_row += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failed_in_a_row >= self.failures):
+                if self.state == CLOSED:
+                    self.trips += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+    def stats(self) -> dict:
+        """ Returns the breaker state and counters. """
+        with self._lock:
+            return {'state': self.state, 'trips': self.trips, 'rejected': self.rejected}
+
+
+class CallGuard:
+    """ Runs the API calls with the timeout budget of their endpoint, within the deadline of the current press
+        (see deadline), retrying the reads that couldn't reach Spotify, behind a circuit breaker. """
+
+    def __init__(self, is_failure, timeouts: dict, default_timeout: tuple, read_calls, breaker: CircuitBreaker,
+                 read_retries: int = READ_RETRIES):
+        self.is_failure = is_failure  # Checks whether an error means Spotify couldn't be reached
+        self.timeouts = timeouts  # Call name -> (connect, read) timeout in seconds
+        self.default_timeout = default_timeout
+        self.read_calls = frozenset(read_calls)  # Names of the calls that are safe to retry
+        self.breaker = breaker
+        self.read_retries = read_retries
+        self._local = threading.local()  # Deadline of the press handled on each thread
+
+        # Counters for the guard stats
+        self.calls = 0
+        self.failed = 0
+        self.retried = 0
+        self.deadline_exceeded = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def deadline(self, seconds: float):
+        """ Makes the calls in the with block (on this thread) fit in the given seconds. """
+        previous = getattr(self._local, 'deadline', None)
+        self._local.deadline = time.monotonic() + seconds
+        try:
+            yield
+        finally:
+            self._local.deadline = previous
+
+    def deadline_at(self) -> float:
+        """ Gets the monotonic time of the deadline of this thread's press (None without a deadline). """
+        return getattr(self._local, 'deadline', None)
+
+    def _remaining(self) -> float:
+        """ Gets the seconds left until the deadline of this thread's press (None without a deadline). """
+        deadline = getattr(self._local, 'deadline', None)
+        return deadline - time.monotonic() if deadline is not None else None
+
+    def call(self, name: str, func):
+        """ Makes the call of the given name by calling func, retrying it if it's a read that couldn't reach Spotify. """
+        timeout = self.timeouts.get(name, self.default_timeout)
+        retries = self.read_retries if name in self.read_calls else 0
+        with self._lock:
+            self.calls += 1
+
+        for attempt in range(retries + 1):
+            # Fit the call's timeouts in what's left of the press's deadline (checked before the breaker,
+            # so a call that never reaches the network can't take the trial of a half open breaker)
+            remaining = self._remaining()
+            if remaining is not None and remaining <= 0:
+                with self._lock:
+                    self.deadline_exceeded += 1
+                raise CallTimeoutError(f'The press ran out of time before <{name}> could be called')
+            self.breaker.before_call()
+            budget = timeout if remaining is None else (min(timeout[0], remaining), min(timeout[1], remaining))
+
+            try:
+                with call_timeout(budget):
+                    result = func()
+            except Exception as err:
+                if not self.is_failure(err):
+                    self.breaker.on_success()  # Spotify answered, it just didn't like the request
+                    raise
+                self.breaker.on_failure()
+                with self._lock:
+                    self.failed += 1
+
+                # Wait a random part of the backoff before retrying, if there's time left for it
+                backoff = random.uniform(0, RETRY_BACKOFF * 2 ** attempt)
+                remaining = self._remaining()
+                if attempt == retries or (remaining is not None and remaining <= backoff):
+                    raise
+                with self._lock:
+                    self.retried += 1
+                time.sleep(backoff)
+                continue
+
+            self.breaker.on_success()
+            return result
+
+    def stats(self) -> dict:
+        """ Returns the call counters and the breaker stats. """
+        with self._lock:
+            stats = {'calls': self.calls, 'failed': self.failed, 'retried': self.retried,
+                     'deadline_exceeded': self.deadline_exceeded}
+        stats.update(('breaker_' + key, value) for key, value in self.breaker.stats().items())
+        return stats
@@ -1,6 +1,8 @@
 # 2024 George Doujaiji
 
 import utils as utl
+import threading
+import os
 
 CONFIG_FILE = "config.json"
 EMPTY_CONFIG = {
@@ -19,13 +21,84 @@ EMPTY_CONFIG = {
         "button_save_main": 0,
         "button_save_other": 0,
         "button_undo_save": 0
+    },
+    "options": {
+        "parallel_loading": False,
+        "loader_workers": 4,
+        "playlist_index": True,
+        "index_save_delay": 5.0,
+        "playback_poller": False,
+        "poll_interval_playing": 1.0,
+        "poll_interval_idle": 10.0,
+        "playback_cache_ttl": 2.0,
+        "liked_mirror": False,
+        "liked_mirror_sync_interval": 300,
+        "input_pipeline": False,
+        "input_queue_size": 8,
+        "repeat_press_policy": "coalesce",
+        "repeat_press_window": 1.0,
+        "concurrent_writes": False,
+        "write_workers": 4,
+        "write_behind": False,
+        "write_behind_delay": 2.0,
+        "offline_journal": False,
+        "journal_filename": "offline_journal.bin",
+        "journal_retry_interval": 30.0,
+        "token_refresher": True,
+        "token_refresh_lead": 300,
+        "http_pool_size": 8,
+        "http_connect_timeout": 3.05,
+        "http_read_timeout": 5,
+        "keep_warm": False,
+        "keep_warm_interval": 20,
+        "tracing": True,
+        "trace_filename": "trace_stats.json",
+        "trace_socket": None,
+        "io_backend": "gpio",
+        "record_presses": None,
+        "async_logging": False,
+        "log_max_bytes": 1000000,
+        "log_backup_count": 5,
+        "log_flush_interval": 1.0,
+        "session_export": False,
+        "session_export_dir": "session_exports",
+        "fast_start": False,
+        "startup_wait": 60.0,
+        "compact_track_index": False,
+        "stream_playlist_pages": False,
+        "input_workers": 1,
+        "request_scheduler": False,
+        "request_rate": 10.0,
+        "request_burst": 20,
+        "circuit_breaker": False,
+        "press_deadline": 3.0,
+        "breaker_failures": 5,
+        "breaker_reset_timeout": 30.0,
+        "led_animator": True,
+        "led_feedback_policy": "queue",
+        "playlist_reconciler": False,
+        "reconcile_interval": 60
     }
 }
 
 
+# Cached copy of the config file, re-read only when the file changes (the lock also serializes writes)
+_config_lock = threading.RLock()
+_cached_config = None
+_cached_stat = None  # (mtime, inode, size) of the config file when it was cached
+
+
+def _file_stat() -> tuple:
+    """ Gets the (mtime, inode, size) of the config file, which changes whenever the file is replaced or edited. """
+    try:
+        stat = os.stat(CONFIG_FILE)
+    except FileNotFoundError:
+        raise FileNotFoundError(CONFIG_FILE)
+    return stat.st_mtime_ns, stat.st_ino, stat.st_size
+
 def create_empty_config():
     """ Writes a template config to the config file. """
-    utl.write_json(EMPTY_CONFIG, CONFIG_FILE)
+    set_config(EMPTY_CONFIG)
 
 def init_config():
     """ Creates an empty config file if it doesn't already exist
@@ -36,19 +109,26 @@ def init_config():
     return False
 
 def set_config(config: dict):
-    """ Writes the given configuration dict to the config file. """
-    utl.write_json(config, CONFIG_FILE, indent=4)
+    """ Atomically writes the given configuration dict to the config file. """
+    global _cached_config
+    with _config_lock:
+        utl.write_json_atomic(config, CONFIG_FILE, indent=4)
+        _cached_config = None  # Read back on the next access (the given dict may still be modified by the caller)
 
 def get_config() -> dict:
-    """ Reads the config file and returns the configuration dict. """
-    utl.file_exists_error(CONFIG_FILE)
-    return utl.read_json(CONFIG_FILE)
+    """ Returns the configuration dict, only reading the config file again if it changed since it was last read.
+        The dict is shared with the cache, so it must not be modified (copy it first). """
+    global _cached_config, _cached_stat
+    with _config_lock:
+        stat = _file_stat()
+        if _cached_config is None or stat != _cached_stat:
+            _cached_config, _cached_stat = utl.read_json(CONFIG_FILE), stat
+        return _cached_config
 
 def get_config_value(key: str, config: dict = None) -> dict:
     """ Retrieves and returns the value associated with the given key from the config file,
         or retrieves the value from the already loaded config if provided. """
     if config is None:
-        utl.file_exists_error(CONFIG_FILE)
         config = get_config()
 
     if key not in config:
@@ -59,10 +139,10 @@ def get_config_value(key: str, config: dict = None) -> dict:
 def set_config_value(key: str, new_value):
     """ Stores or updates the given value for
         the specified key in the config file. """
-    utl.file_exists_error(CONFIG_FILE)
-    config = get_config()
-    config[key] = new_value
-    set_config(config)
+    with _config_lock:
+        config = dict(get_config())
+        config[key] = new_value
+        set_config(config)
 
 def get_spotify_creds(loaded_config: dict = None) -> dict:
     """ Retrieves and returns the spotify creds. """
@@ -84,8 +164,20 @@ def get_wlan_details(loaded_config: dict = None) -> dict:
     """ Retrieves and returns the wlan network details. """
     return get_config_value('wlan', loaded_config)
 
+def get_options(loaded_config: dict = None) -> dict:
+    """ Retrieves and returns the optional settings (empty if the config doesn't have any). """
+    try:
+        return get_config_value('options', loaded_config)
+    except KeyError:
+        return {}
+
+def get_option(key: str, default=None, loaded_config: dict = None):
+    """ Retrieves and returns the given optional setting, or the default if it isn't set. """
+    return get_options(loaded_config).get(key, default)
+
 def set_playlist_id(plist: str, plist_id: str):
     """ Updates the specified playlist ID. """
-    plist_ids = get_playlist_ids()
-    plist_ids[plist] = plist_id
-    set_config_value('playlists', plist_ids)
+    with _config_lock:
+        plist_ids = dict(get_playlist_ids())
+        plist_ids[plist] = plist_id
+        set_config_value('playlists', plist_ids)
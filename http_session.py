@@ -0,0 +1,108 @@
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from contextlib import contextmanager
+import requests
+import threading
+
+POOL_SIZE = 8  # Max number of connections kept open to each host (covers the concurrent calls)
+CONNECT_TIMEOUT = 3.05  # Seconds to wait for a connection to be established
+READ_TIMEOUT = 5  # Seconds to wait for the server to send a response
+RETRIES = 3  # Retries of rate limited (429) and server error responses, same as Spotipy's default
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+SERVER_ERROR_CODES = (500, 502, 503, 504)  # Retried when the rate limit (429) is handled by the request scheduler
+KEEP_WARM_INTERVAL = 20  # Seconds between keep-warm pings (shorter than the server's idle timeout)
+API_ROOT = "https://api.spotify.com/v1/"
+
+_call_timeouts = threading.local()  # Timeout of the call being made on each thread (see call_timeout)
+
+
+@contextmanager
+def call_timeout(timeout: tuple):
+    """ Makes the requests sent on this thread in the with block use the given (connect, read) timeout
+        instead of the one they were given (e.g. Spotipy's requests_timeout). """
+    previous = getattr(_call_timeouts, 'timeout', None)
+    _call_timeouts.timeout = timeout
+    try:
+        yield
+    finally:
+        _call_timeouts.timeout = previous
+
+
+class CallTimeoutAdapter(HTTPAdapter):
+    """ HTTP adapter that sends the requests with the timeout of the current call if one is set (see call_timeout). """
+
+    def send(self, request, timeout=None, **kwargs):
+        override = getattr(_call_timeouts, 'timeout', None)
+        return super().send(request, timeout=override if override is not None else timeout, **kwargs)
+
+
+def build_session(pool_size: int = POOL_SIZE, retries: int = RETRIES, retry_rate_limited: bool = True) -> requests.Session:
+    """ Builds a requests session with a connection pool sized for concurrent calls
+        and the same retry behaviour Spotipy gives its own sessions (without retrying
+        the rate limited responses if retry_rate_limited is False, so the caller can,
+        and without retrying anything if retries is 0). """
+    session = requests.Session()
+    retry = 0 if retries == 0 else Retry(
+        total=retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        status=retries,
+        backoff_factor=0.3,
+        status_forcelist=RETRY_STATUS_CODES if retry_rate_limited is True else SERVER_ERROR_CODES,
+        respect_retry_after_header=retry_rate_limited
+    )
+    adapter = CallTimeoutAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def ping(session: requests.Session, url: str = API_ROOT, timeout: tuple = (CONNECT_TIMEOUT, READ_TIMEOUT)):
+    """ Sends an unauthenticated HEAD request, which opens (or keeps open) a pooled connection
+        to the API without counting against the quota. """
+    session.head(url, timeout=timeout)
+
+
+class KeepWarm:
+    """ Background pinger that keeps a pooled connection open to the API while playback is active,
+        so a press after a quiet period doesn't pay for a new TCP and TLS handshake. """
+
+    def __init__(self, session: requests.Session, logger, is_active_func, interval: float = KEEP_WARM_INTERVAL,
+                 url: str = API_ROOT):
+        self.session = session
+        self.logger = logger
+        self.is_active = is_active_func  # Returns whether the connection is worth keeping warm right now
+        self.interval = interval
+        self.url = url
+        self.pings = 0
+        self.ping_errors = 0
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """ Starts pinging in the background. """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='KeepWarm', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stops pinging and waits for the background thread to exit. """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """ Pings every interval while the connection is worth keeping warm, until stopped. """
+        while not self._stop_event.wait(self.interval):
+            if self.is_active() is False:
+                continue
+            try:
+                ping(self.session, self.url)
+                self.pings += 1
+            except requests.exceptions.RequestException as err:
+                self.ping_errors += 1
+                self.logger.error('Keep-warm ping failed: ' + str(err))
+
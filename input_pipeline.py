@@ -0,0 +1,205 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from collections import namedtuple
+import threading
+import queue
+import time
+
+# Policies for a button pressed again while its last press is still recent
+COALESCE = "coalesce"  # Drop the repeat press silently, the earlier press stands for both
+REJECT = "reject"      # Drop the repeat press and flash a warning
+ALLOW = "allow"        # Handle every press
+
+QUEUE_SIZE = 8  # Max number of presses waiting to be handled
+REPEAT_WINDOW = 1.0  # Seconds after a press during which the same button counts as a repeat
+WORKERS = 1  # Number of presses handled at the same time
+
+# A button press waiting to be handled, with the monotonic time it was received
+# and the time of its button edge (perf_counter, for tracing, None if it isn't traced)
+ButtonPress = namedtuple('ButtonPress', ['action', 'pressed_at', 'edge'])
+
+
+class InputPipeline:
+    """ Queues button presses and handles them in order on a dedicated thread,
+        so the GPIO callback thread returns immediately.
+
+        With more than one worker, the parallel actions (saves to the different playlists) are handed to
+        a pool and run at the same time, while presses of the same button still run in order. Any other
+        action (e.g. an undo) waits for the presses before it to finish, and holds up the ones after it. """
+
+    def __init__(self, process_func, notifier, logger, queue_size: int = QUEUE_SIZE,
+                 repeat_policy: str = COALESCE, repeat_window: float = REPEAT_WINDOW,
+                 workers: int = WORKERS, parallel_actions=()):
+        if repeat_policy not in (COALESCE, REJECT, ALLOW):
+            raise ValueError('Unknown repeat press policy: ' + repeat_policy)
+
+        self.process = process_func  # Handles a single action (QuickSaver.process_input)
+        self.notifier = notifier
+        self.logger = logger
+        self.repeat_policy = repeat_policy
+        self.repeat_window = repeat_window
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._last_accepted = {}  # Action -> time of its last accepted press
+        self._thread = None
+
+        # Handle the parallel actions on a pool when there's more than one worker
+        self.parallel_actions = frozenset(parallel_actions)
+        self._pool = None
+        if workers > 1:
+            self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='InputWorker')
+        self._running = {}  # Parallel action -> its last press handed to the pool (as a future)
+
+        # Counters for the pipeline metrics
+        self.accepted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.processed = 0
+        self.max_depth = 0
+        self.in_flight = 0
+        self.max_in_flight = 0  # Most presses handled at the same time
+        self.total_wait = 0.0  # Sum of the time presses spent queued before being handled
+
+    def start(self):
+        """ Starts handling queued presses on the executor thread. """
+        self._thread = threading.Thread(target=self._run, name='InputPipeline', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Handles the presses that are already queued, then stops the executor thread. """
+        if self._thread is None:
+            return
+        self._queue.put(None)  # Sentinel that tells the executor to stop
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+        self._thread = None
+
+    def submit(self, action: str, edge: float = None):
+        """ Timestamps and queues the given button press (called from the GPIO callback thread). """
+        press = ButtonPress(action, time.monotonic(), edge)
+
+        with self._lock:
+            accepted = self._accept(press)
+
+        # Warn outside of the lock so a slow notifier can't hold up other presses
+        if accepted is False:
+            self.notifier.trigger_press_rejected_warning()
+
+    def _accept(self, press: ButtonPress) -> bool:
+        """ Queues the given press unless the repeat policy or a full queue drops it, and returns
+            False if it was rejected (must be called while holding the lock). """
+
+        # Apply the repeat policy if the same button was pressed moments ago
+        last_pressed_at = self._last_accepted.get(press.action)
+        is_repeat = last_pressed_at is not None and press.pressed_at - last_pressed_at < self.repeat_window
+        if is_repeat and self.repeat_policy == COALESCE:
+            self.coalesced += 1
+            return True
+        if is_repeat and self.repeat_policy == REJECT:
+            self.rejected += 1
+            return False
+
+        # Reject the press if too many are already waiting
+        try:
+            self._queue.put_nowait(press)
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+        self._last_accepted[press.action] = press.pressed_at
+        self.accepted += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def _run(self):
+        """ Handles queued presses in order until the stop sentinel is received. """
+        while True:
+            press = self._queue.get()
+            if press is None:
+                break
+
+            # Hand the parallel actions to the pool (after the last press of the same button)
+            if self._pool is not None and press.action in self.parallel_actions:
+                previous = self._running.get(press.action)
+                self._running[press.action] = self._pool.submit(self._handle_after, press, previous)
+                continue
+
+            # Otherwise wait for the presses before it, then handle it on the executor thread
+            self._wait_for_running()
+            self._handle(press)
+
+        self._wait_for_running()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+    def _wait_for_running(self):
+        """ Waits for the presses handed to the pool to finish. """
+        if len(self._running) > 0:
+            wait(self._running.values())
+            self._running.clear()
+
+    def _handle_after(self, press: ButtonPress, previous):
+        """ Handles the given press once the previous press of the same button (if any) is handled. """
+        if previous is not None:
+            wait([previous])
+        self._handle(press)
+
+    def _handle(self, press: ButtonPress):
+        """ Handles a single press and updates the counters. """
+        with self._lock:
+            self.total_wait += time.monotonic() - press.pressed_at
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        # Keep the executor alive if an action fails
+        try:
+            self.process(press.action, press.edge)
+        except Exception as err:
+            self.logger.error(f'Unexpected error while handling <{press.action}>: ' + str(err))
+
+        with self._lock:
+            self.in_flight -= 1
+            self.processed += 1
+
+    def depth(self) -> int:
+        """ Gets the number of presses currently waiting to be handled. """
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        """ Returns the queue depth and press counters. """
+        with self._lock:
+            return {
+                'depth': self._queue.qsize(),
+                'max_depth': self.max_depth,
+                'accepted': self.accepted,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected,
+                'processed': self.processed,
+                'max_in_flight': self.max_in_flight,
+                'avg_wait': self.total_wait / self.processed if self.processed > 0 else None
+            }
+
+
+class AsyncNotifier:
+    """ Wraps a notifier so its LED triggers play on their own thread (in order)
+        instead of blocking the thread that handles the presses. """
+
+    def __init__(self, notifier):
+        self.notifier = notifier
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Notifier')
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.notifier, name)
+
+        # Only the LED triggers are played in the background
+        if not name.startswith('trigger_'):
+            return attribute
+
+        def trigger(*args, **kwargs):
+            self._executor.submit(attribute, *args, **kwargs)
+        return trigger
+
+    def clean_up_leds(self):
+        """ Waits for the queued LED feedback to finish, then cleans up the LEDs. """
+        self._executor.shutdown(wait=True)
+        self.notifier.clean_up_leds()
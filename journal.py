@@ -0,0 +1,244 @@
+""" Durable append-only journal of the writes that couldn't reach Spotify (e.g. while the Wi-Fi is down).
+
+Every record is a fixed 57 bytes, so appending is a single small write and a torn record at the end
+(from a power cut mid-append) is easy to spot and ignore:
+    <timestamp: float64> <operation: uint8> <track_id: 22 bytes> <playlist_id: 22 bytes> <crc32: uint32>
+"""
+from write_behind import ADD, REMOVE, LIBRARY, LIBRARY_BATCH_LIMIT, PLAYLIST_BATCH_LIMIT
+from spotify_client import is_network_error
+import threading
+import struct
+import zlib
+import time
+import os
+
+JOURNAL_FILENAME = "offline_journal.bin"
+RETRY_INTERVAL = 30.0  # Seconds between attempts to replay the journal while Spotify can't be reached
+RETRY_STATUS_CODES = (401, 429)  # Rejections that pass (expired auth, rate limit), so the writes are kept for the next replay
+
+RECORD = struct.Struct('<dB22s22s')  # Record without its checksum
+CHECKSUM = struct.Struct('<I')
+RECORD_SIZE = RECORD.size + CHECKSUM.size
+OPERATION_CODES = {ADD: 1, REMOVE: 2}
+OPERATIONS = {code: operation for operation, code in OPERATION_CODES.items()}
+
+
+class OfflineJournal:
+    """ Journal of the writes that couldn't be sent to Spotify, which are replayed in batches once it's reachable again. """
+
+    def __init__(self, client, logger, filename: str = JOURNAL_FILENAME,
+                 retry_interval: float = RETRY_INTERVAL, on_playlist_replayed=None):
+        self.client = client
+        self.logger = logger
+        self.filename = filename
+        self.retry_interval = retry_interval
+        self.on_playlist_replayed = on_playlist_replayed  # Called with (playlist_id, snapshot_id) after a replay
+
+        self._lock = threading.Lock()  # Guards the journal file
+        self._replay_lock = threading.Lock()  # Only one replay at a time
+        self._fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        # Counters for the stats
+        self.appended = 0
+        self.replayed = 0
+        self.collapsed = 0
+        self.deduplicated = 0
+
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def append(self, operation: str, track_id: str, playlist_id: str = LIBRARY):
+        """ Durably appends the given write to the journal (fsync'd before returning). """
+        record = RECORD.pack(time.time(), OPERATION_CODES[operation],
+                             track_id.encode('ascii'), (playlist_id or '').encode('ascii'))
+        record += CHECKSUM.pack(zlib.crc32(record))
+
+        with self._lock:
+            os.write(self._fd, record)
+            os.fsync(self._fd)
+            self.appended += 1
+
+        self._wake_event.set()
+
+    def read_records(self, start: int = 0) -> tuple[list[tuple], int]:
+        """ Reads the valid records from the given byte offset, and returns them as
+            (timestamp, operation, track_id, playlist_id) tuples with the offset the reading stopped at. """
+        with open(self.filename, 'rb') as journal_file:
+            journal_file.seek(start)
+            data = journal_file.read()
+
+        records = []
+        end = len(data) - len(data) % RECORD_SIZE  # Ignore a torn record at the end
+        for offset in range(0, end, RECORD_SIZE):
+            record = data[offset:offset + RECORD.size]
+            (checksum,) = CHECKSUM.unpack_from(data, offset + RECORD.size)
+            if checksum != zlib.crc32(record):
+                continue  # Corrupted record
+            timestamp, code, track_id, playlist_id = RECORD.unpack(record)
+            records.append((timestamp, OPERATIONS[code], track_id.decode('ascii').rstrip('\0'),
+                            playlist_id.decode('ascii').rstrip('\0') or LIBRARY))
+
+        return records, start + end
+
+    def __len__(self) -> int:
+        """ Gets the number of records in the journal (still works once the journal is closed). """
+        return os.stat(self.filename).st_size // RECORD_SIZE
+
+    def collapse(self, records: list[tuple]) -> dict:
+        """ Collapses the given records into the net writes to send, as {(target, track_id): operation}.
+            A write followed by its reverse (e.g. a save and its undo) cancels out. """
+        writes = {}
+        for _, operation, track_id, target in records:
+            key = (target, track_id)
+            if key in writes and writes[key] != operation:
+                del writes[key]
+                self.collapsed += 2
+            elif key in writes:
+                self.collapsed += 1
+            else:
+                writes[key] = operation
+        return writes
+
+    def replay(self, skip_write=None) -> bool:
+        """ Sends the journaled writes to Spotify in batches and removes them from the journal.
+            Writes that skip_write(operation, track_id, target) returns True for are dropped as duplicates.
+            Returns whether the whole journal was replayed (False if Spotify still can't be reached). """
+        with self._replay_lock:
+            records, replay_end = self.read_records()
+            writes = self.collapse(records)
+
+            # Drop the writes that are already reflected on Spotify
+            if skip_write is not None:
+                for (target, track_id), operation in list(writes.items()):
+                    if skip_write(operation, track_id, target) is True:
+                        del writes[(target, track_id)]
+                        self.deduplicated += 1
+
+            # Send the writes grouped by target and operation
+            remaining = dict(writes)
+            snapshot_ids = {}  # Playlist ID -> its snapshot ID after the last replayed write
+            completed = True
+            for target, operation, track_ids in self._batches(writes):
+                try:
+                    snapshot_id = self._write(target, operation, track_ids)
+                except Exception as err:
+                    # Keep the writes for the next replay if Spotify still can't be reached (or can't take them yet)
+                    if is_network_error(err) or getattr(err, 'http_status', None) in RETRY_STATUS_CODES:
+                        completed = False
+                        break
+                    # Otherwise Spotify rejected them, so retrying won't help
+                    self.logger.error(f'Dropped {len(track_ids)} journaled <{operation}> writes rejected by Spotify: ' + str(err))
+                    for track_id in track_ids:
+                        del remaining[(target, track_id)]
+                    continue
+
+                for track_id in track_ids:
+                    del remaining[(target, track_id)]
+                self.replayed += len(track_ids)
+                if target is not LIBRARY:
+                    snapshot_ids[target] = snapshot_id
+
+            self._rewrite(remaining, replay_end)
+
+        # Only report the new snapshots once the replayed writes are out of the journal
+        if self.on_playlist_replayed is not None:
+            for playlist_id, snapshot_id in snapshot_ids.items():
+                self.on_playlist_replayed(playlist_id, snapshot_id)
+
+        return completed
+
+    def _batches(self, writes: dict):
+        """ Yields the given writes as (target, operation, track_ids) batches within the API limits. """
+        grouped = {}
+        for (target, track_id), operation in writes.items():
+            grouped.setdefault((target, operation), []).append(track_id)
+
+        for (target, operation), track_ids in grouped.items():
+            batch_limit = LIBRARY_BATCH_LIMIT if target is LIBRARY else PLAYLIST_BATCH_LIMIT
+            for i in range(0, len(track_ids), batch_limit):
+                yield target, operation, track_ids[i:i + batch_limit]
+
+    def _write(self, target: str, operation: str, track_ids: list[str]) -> str:
+        """ Sends the given writes with the matching client call (returns the new snapshot ID for playlists). """
+        if target is LIBRARY and operation == ADD:
+            return self.client.add_saved_tracks_batch(track_ids)
+        if target is LIBRARY:
+            return self.client.remove_saved_tracks_batch(track_ids)
+        if operation == ADD:
+            return self.client.add_tracks_to_playlist(track_ids, target)
+        return self.client.remove_tracks_from_playlist(track_ids, target)
+
+    def _rewrite(self, remaining: dict, replay_end: int):
+        """ Atomically replaces the journal with the writes that weren't replayed,
+            followed by any records appended while the replay was running. """
+        with self._lock:
+            with open(self.filename, 'rb') as journal_file:
+                journal_file.seek(replay_end)
+                appended_tail = journal_file.read()
+
+            now = time.time()
+            data = b''
+            for (target, track_id), operation in remaining.items():
+                record = RECORD.pack(now, OPERATION_CODES[operation], track_id.encode('ascii'),
+                                     (target or '').encode('ascii'))
+                data += record + CHECKSUM.pack(zlib.crc32(record))
+            data += appended_tail
+
+            temp_filename = self.filename + '.tmp'
+            with open(temp_filename, 'wb') as temp_file:
+                temp_file.write(data)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_filename, self.filename)
+
+            # Reopen the journal since the old file descriptor points to the replaced file
+            os.close(self._fd)
+            self._fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def start_replay_loop(self):
+        """ Starts replaying the journal in the background whenever it has records. """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='OfflineJournal', daemon=True)
+        self._thread.start()
+
+    def stop_replay_loop(self):
+        """ Stops the background replay and waits for it to exit. """
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """ Replays the journal when records are appended, retrying every retry interval while offline. """
+        if len(self) > 0:
+            self._wake_event.set()
+
+        while not self._stop_event.is_set():
+            self._wake_event.wait()
+            self._wake_event.clear()
+            if self._stop_event.is_set():
+                break
+
+            # Wait a bit before retrying when Spotify still can't be reached
+            try:
+                if self.replay() is False:
+                    self._stop_event.wait(self.retry_interval)
+                    self._wake_event.set()
+            except Exception as err:
+                self.logger.error('Offline journal replay failed: ' + str(err))
+
+    def close(self):
+        """ Closes the journal file. """
+        os.close(self._fd)
+
+    def stats(self) -> dict:
+        """ Returns the number of pending records along with the replay counters. """
+        return {
+            'pending': len(self),
+            'appended': self.appended,
+            'replayed': self.replayed,
+            'collapsed': self.collapsed,
+            'deduplicated': self.deduplicated
+        }
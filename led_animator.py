@@ -0,0 +1,169 @@
+""" Plays the LED feedback on a single background thread, so the LED triggers return right away.
+
+An animation is a timeline: a list of frames, each one the LEDs that are lit and the seconds they stay lit
+(the other LEDs are off). Timelines are built with flash, blink, and wave, and can be added together.
+A new animation either waits for the ones before it (queue), or cuts the playing one short and replaces
+everything that was waiting (preempt).
+"""
+from collections import deque
+import threading
+import time
+
+# Policies for the press feedback when an animation is already playing
+QUEUE = "queue"      # Play it once the animations before it finished
+PREEMPT = "preempt"  # Cut the playing animation short and play it right away
+
+BLINK_OFF_TIME = 1.0  # Seconds an LED stays off between blinks (gpiozero's default, which the blinks have always used)
+GAP = 0.1  # Seconds every LED is off between two animations (so two flashes of the same LED can be told apart)
+MAX_QUEUED = 3  # Max animations waiting to play (the oldest is dropped, the latest feedback matters most)
+DRAIN_TIMEOUT = 5.0  # Max seconds stopping waits for the queued animations to finish playing
+
+
+def flash(leds: list, duration: float) -> list[tuple]:
+    """ Builds the timeline of the given LEDs lit together for the given seconds. """
+    return [(tuple(leds), duration)]
+
+
+def blink(leds: list, count: int, on_time: float, off_time: float = BLINK_OFF_TIME) -> list[tuple]:
+    """ Builds the timeline of the given LEDs blinking together the given number of times. """
+    timeline = []
+    for n in range(count):
+        if n > 0:
+            timeline.append(((), off_time))
+        timeline.append((tuple(leds), on_time))
+    return timeline
+
+
+def wave(leds: list, step: float) -> list[tuple]:
+    """ Builds the timeline of the given LEDs lit one after the other, for the given seconds each. """
+    return [((led,), step) for led in leds]
+
+
+def switch(lit: set, leds: tuple) -> set:
+    """ Turns off the lit LEDs that aren't in the given LEDs and turns on the rest, then returns the lit LEDs. """
+    for led in lit.difference(leds):
+        led.off()
+    for led in set(leds).difference(lit):
+        led.on()
+    return set(leds)
+
+
+class LEDAnimator:
+    """ Plays the animations (timelines) handed to it one after the other on its own thread. """
+
+    def __init__(self, max_queued: int = MAX_QUEUED, gap: float = GAP):
+        self.max_queued = max_queued
+        self.gap = gap
+        self._queue = deque()  # (timeline, monotonic time it was handed over)
+        self._cond = threading.Condition()
+        self._playing = False
+        self._preempted = False  # Set to cut the playing animation short
+        self._stopping = False
+        self._thread = None
+
+        # Counters for the animator stats
+        self.played = 0
+        self.cut_short = 0  # Animations preempted while playing
+        self.dropped = 0    # Animations that never played (replaced by a preempting one, or the queue was full)
+        self.total_delay = 0.0  # Seconds the played animations waited to start playing
+        self.max_delay = 0.0
+
+    def start(self):
+        """ Starts the thread that plays the animations. """
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='LEDAnimator', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = DRAIN_TIMEOUT):
+        """ Lets the queued animations play (up to timeout seconds), then stops the thread. """
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._playing is False and len(self._queue) == 0, timeout)
+
+            # Cut the rest short if they took too long
+            self.dropped += len(self._queue)
+            self._queue.clear()
+            self._preempted = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._thread = None
+
+    def play(self, timeline: list[tuple], preempt: bool = False):
+        """ Hands the animation over to be played (returns right away). When preempt is True, the playing
+            animation is cut short and the waiting ones are dropped, otherwise it waits for them. """
+        with self._cond:
+            if self._stopping is True:
+                return
+            if preempt is True:
+                self.dropped += len(self._queue)
+                self._queue.clear()
+                self._preempted = self._playing
+            elif len(self._queue) >= self.max_queued:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append((timeline, time.monotonic()))
+            self._cond.notify_all()
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """ Waits for every animation to finish playing (up to timeout seconds) and returns whether they did. """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._playing is False and len(self._queue) == 0, timeout)
+
+    def _run(self):
+        """ Plays the animations as they're handed over, until stopped. """
+        while True:
+            with self._cond:
+                self._playing = False
+                self._cond.notify_all()  # Wakes up wait_idle and stop
+                self._cond.wait_for(lambda: len(self._queue) > 0 or self._stopping is True)
+                if len(self._queue) == 0:
+                    return
+                timeline, handed_at = self._queue.popleft()
+                self._playing = True
+                self._preempted = False
+                delay = time.monotonic() - handed_at
+                self.played += 1
+                self.total_delay += delay
+                self.max_delay = max(self.max_delay, delay)
+
+            if self._play(timeline) is False:
+                with self._cond:
+                    self.cut_short += 1
+
+    def _play(self, timeline: list[tuple]) -> bool:
+        """ Shows every frame of the timeline for its seconds, followed by the gap (with every LED off),
+            and returns whether it played to the end (False if it was cut short). """
+        lit = set()
+        finished = True
+        for leds, seconds in timeline + [((), self.gap)]:
+            lit = switch(lit, leds)
+            if self._hold(seconds) is False:
+                finished = False
+                break
+        switch(lit, ())
+        return finished
+
+    def _hold(self, seconds: float) -> bool:
+        """ Waits the given seconds and returns whether it did (False if the animation was cut short). """
+        until = time.monotonic() + seconds
+        with self._cond:
+            while self._preempted is False:
+                remaining = until - time.monotonic()
+                if remaining <= 0:
+                    return True
+                self._cond.wait(remaining)
+        return False
+
+    def stats(self) -> dict:
+        """ Returns the played, cut short, and dropped counters, and how long the animations waited to start playing. """
+        with self._cond:
+            return {
+                'played': self.played,
+                'cut_short': self.cut_short,
+                'dropped': self.dropped,
+                'avg_delay': round(self.total_delay / self.played, 3) if self.played > 0 else None,
+                'max_delay': round(self.max_delay, 3)
+            }
@@ -0,0 +1,151 @@
+import utils as utl
+import threading
+
+SYNC_INTERVAL = 300  # Seconds between incremental syncs of the mirror with Spotify
+
+
+class LikedSongsMirror:
+    """ In-memory mirror of the user's liked songs (saved tracks), so checking whether
+        a track is liked doesn't need a request to Spotify. """
+
+    def __init__(self, client, logger, sync_interval: float = SYNC_INTERVAL):
+        self.client = client
+        self.logger = logger
+        self.sync_interval = sync_interval
+
+        # Track IDs are stored as the integers they encode, which take a lot less memory than strings
+        self._lock = threading.Lock()
+        self._track_keys = set()
+        self._changes = None  # Key -> whether it was liked, for the likes/unlikes made while Spotify is being read
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _key(track_id: str):
+        """ Gets the compact key of the given track ID (falls back to the ID itself if it isn't base62). """
+        try:
+            return utl.track_id_to_int(track_id)
+        except ValueError:
+            return track_id
+
+    def __contains__(self, track_id: str) -> bool:
+        return self._key(track_id) in self._track_keys
+
+    def __len__(self) -> int:
+        return len(self._track_keys)
+
+    def add(self, track_id: str):
+        """ Records that the given track was liked. """
+        key = self._key(track_id)
+        with self._lock:
+            self._track_keys.add(key)
+            if self._changes is not None:
+                self._changes[key] = True
+
+    def discard(self, track_id: str):
+        """ Records that the given track was unliked. """
+        key = self._key(track_id)
+        with self._lock:
+            self._track_keys.discard(key)
+            if self._changes is not None:
+                self._changes[key] = False
+
+    def _start_recording(self):
+        """ Starts recording the likes/unlikes made from now on, so they can be applied again
+            on top of what's read from Spotify (which may have been read before them). """
+        with self._lock:
+            self._changes = {}
+
+    def _apply_recorded(self, track_keys: set):
+        """ Applies the likes/unlikes recorded since _start_recording to the given keys and stops recording
+            (must be called while holding the lock). """
+        for key, is_liked in self._changes.items():
+            if is_liked is True:
+                track_keys.add(key)
+            else:
+                track_keys.discard(key)
+        self._changes = None
+
+    def build(self):
+        """ Builds the mirror from scratch by paging through all of the user's saved tracks. """
+        track_keys = set()
+        offset = 0
+        self._start_recording()
+
+        try:
+            while True:
+                track_ids, _ = self.client.get_saved_tracks_page(offset)
+                track_keys.update(self._key(track_id) for track_id in track_ids)
+                if len(track_ids) == 0:
+                    break
+                offset += len(track_ids)
+        except Exception:
+            with self._lock:
+                self._changes = None
+            raise
+
+        # Swap in the new keys with the likes/unlikes made while paging on top
+        with self._lock:
+            self._apply_recorded(track_keys)
+            self._track_keys = track_keys
+
+    def sync(self) -> int:
+        """ Incrementally syncs the mirror by reading the saved tracks newest first until reaching
+            a track it already knows, and returns the number of tracks that were added. """
+        new_keys = set()
+        offset = 0
+        total = None
+        self._start_recording()
+
+        try:
+            while True:
+                track_ids, total = self.client.get_saved_tracks_page(offset)
+                if len(track_ids) == 0:
+                    break
+
+                # Stop at the first track the mirror already knows, everything after it is older
+                known_index = next((i for i, track_id in enumerate(track_ids) if track_id in self), None)
+                if known_index is not None:
+                    new_keys.update(self._key(track_id) for track_id in track_ids[:known_index])
+                    break
+
+                new_keys.update(self._key(track_id) for track_id in track_ids)
+                offset += len(track_ids)
+        except Exception:
+            with self._lock:
+                self._changes = None
+            raise
+
+        # The likes/unlikes made while paging win over what was read before them
+        with self._lock:
+            self._apply_recorded(new_keys)
+            self._track_keys.update(new_keys)
+            in_sync = len(self._track_keys) == total
+
+        # Tracks unliked from another device can only be caught by a full rebuild
+        if total is not None and in_sync is False:
+            self.build()
+
+        return len(new_keys)
+
+    def start_sync_loop(self):
+        """ Starts syncing the mirror in the background every sync interval. """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='LikedSongsMirror', daemon=True)
+        self._thread.start()
+
+    def stop_sync_loop(self):
+        """ Stops the background sync and waits for it to exit. """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """ Syncs the mirror every sync interval until stopped. """
+        while not self._stop_event.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception as err:
+                self.logger.error('Liked songs mirror sync failed: ' + str(err))
@@ -1,20 +1,55 @@
+import threading
+import queue
 import time
 import sys
+import os
 
 INFO = "INFO"
 WARNING = "WARNING"
 ERROR = "ERROR"
 
+MAX_BYTES = 1_000_000  # Size the log file can reach before it's rotated (0 never rotates)
+BACKUP_COUNT = 5  # Number of rotated (compressed) log files kept
+FLUSH_INTERVAL = 1.0  # Max seconds a record waits in the async writer before it's flushed to the file
+FLUSH_SIZE = 64  # Number of records that get flushed at once by the async writer
+QUEUE_SIZE = 10_000  # Max records waiting for the async writer (new ones are dropped beyond that)
+STOP = object()  # Queued by close() to tell the async writer to stop
+
 
 class Logger:
 
     SPACES = {INFO: 4, WARNING: 1, ERROR: 3}
 
     # NOTE: keep `to_console` false when running on Pi. When running on computer, manually pass `to_console=True`
-    def __init__(self, filename):
+    def __init__(self, filename, async_writes: bool = False, max_bytes: int = MAX_BYTES,
+                 backup_count: int = BACKUP_COUNT, flush_interval: float = FLUSH_INTERVAL, flush_size: int = FLUSH_SIZE):
         self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
         self.console_available = self.check_console()
         self.file = open(self.filename, 'a+')  # Keep the file open
+        self._file_lock = threading.Lock()  # Writes and rotations of the file
+        self._compressor = None  # Thread compressing the last rotated file in sync mode
+
+        # Timestamp of the current second, only reformatted when the second changes
+        self._timestamp_second = None
+        self._timestamp = None
+
+        # Counters reported by stats()
+        self.records = 0
+        self.batches = 0
+        self.rotations = 0
+        self.dropped = 0
+
+        # Optionally hand the file writes to a background thread, so logging never waits on the SD card
+        self._queue = None
+        self._writer = None
+        if async_writes is True:
+            self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+            self._writer = threading.Thread(target=self._write_batches, name='LogWriter', daemon=True)
+            self._writer.start()
 
     def check_console(self):
         """ Checks whether standard output is an interactive file stream (terminal). """
@@ -22,30 +57,95 @@ class Logger:
 
     def _log(self, level: str, msg: str, to_file: bool = True, to_console: bool = False):
 
-        # Get the local date and time and manually format it
-        local_time = time.localtime()
-        timestamp = "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(
-            local_time[0],  # year
-            local_time[1],  # month
-            local_time[2],  # day
-            local_time[3],  # hour
-            local_time[4],  # minute
-            local_time[5]   # second
-        )
-        log_entry = f"{timestamp} [{level}]{self._spacing(level)}{msg}\n"
-
-        # Write to file if required and flush
+        log_entry = f"{self._current_timestamp()} [{level}]{self._spacing(level)}{msg}\n"
+
+        # Write to file if required (queued for the writer thread in async mode)
         if to_file is True:
-            self.file.write(log_entry)
-            self.file.flush()
+            if self._queue is not None:
+                try:
+                    self._queue.put_nowait(log_entry)
+                except queue.Full:
+                    self.dropped += 1
+            else:
+                self._write_file([log_entry])
 
         # Print to console if interactive file stream is available
         if to_console is True and self.console_available is True:
             print(log_entry, end='')
 
+    def _current_timestamp(self) -> str:
+        """ Gets the local date and time, formatting it only once per second. """
+        second = int(time.time())
+        if second != self._timestamp_second:
+            self._timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+            self._timestamp_second = second
+        return self._timestamp
+
     def _spacing(self, level: str):
         return self.SPACES[level] * ' '
 
+    def _write_file(self, log_entries: list[str]):
+        """ Writes and flushes the given entries to the file, then rotates the file if it grew too big. """
+        with self._file_lock:
+            self.file.write(''.join(log_entries))
+            self.file.flush()
+            self.records += len(log_entries)
+            self.batches += 1
+            if self.max_bytes > 0 and self.file.tell() >= self.max_bytes:
+                self._rotate()
+
+    def _write_batches(self):
+        """ Writes the queued entries in batches, when enough of them are queued or the oldest one
+            waited for the flush interval, until the logger is closed. """
+        batch, batch_started, stopping = [], None, False
+        while stopping is False:
+            timeout = None if batch_started is None else max(batch_started + self.flush_interval - time.monotonic(), 0)
+            try:
+                log_entry = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                log_entry = None  # Flush interval is up
+
+            stopping = log_entry is STOP
+            if log_entry is not None and stopping is False:
+                batch.append(log_entry)
+                if batch_started is None:
+                    batch_started = time.monotonic()
+
+            # Flush once the batch is full, the interval is up, or the logger is closing
+            if len(batch) > 0 and (log_entry is None or stopping is True or len(batch) >= self.flush_size):
+                self._write_file(batch)
+                batch, batch_started = [], None
+
+    def _rotate(self):
+        """ Moves the current file aside and starts a new one, then compresses the old one into the first backup
+            (on the writer thread in async mode, otherwise on a background thread so the caller never waits on gzip). """
+        self.file.close()
+        if self._compressor is not None:
+            self._compressor.join()  # Still compressing the previous file (only if it rotated again right away)
+            self._compressor = None
+        os.replace(self.filename, f'{self.filename}.old')
+        self.file = open(self.filename, 'w+')
+        self.rotations += 1
+
+        if self._writer is not None:
+            self._compress_backup()
+        else:
+            self._compressor = threading.Thread(target=self._compress_backup, name='LogCompressor', daemon=True)
+            self._compressor.start()
+
+    def _compress_backup(self):
+        """ Compresses the file moved aside by the last rotation into the first backup (shifting the older ones). """
+        for backup in range(self.backup_count - 1, 0, -1):
+            older = f'{self.filename}.{backup}.gz'
+            if os.path.exists(older):
+                os.replace(older, f'{self.filename}.{backup + 1}.gz')
+        if self.backup_count > 0:
+            import gzip  # Only needed once the log is rotated, keeps it off the startup path
+            with open(f'{self.filename}.old', 'rb') as log_file, gzip.open(f'{self.filename}.1.gz.tmp', 'wb') as backup_file:
+                backup_file.writelines(log_file)
+            os.replace(f'{self.filename}.1.gz.tmp', f'{self.filename}.1.gz')
+        os.remove(f'{self.filename}.old')
+
     def info(self, msg: str):
         """ Log the given info message to console if available. """
         self._log(INFO, msg, to_file=False, to_console=True)
@@ -58,7 +158,26 @@ class Logger:
         """ Log the given error message to file, and console if available. """
         self._log(ERROR, msg, to_file=True, to_console=True)
 
+    def stats(self) -> dict:
+        """ Returns the number of records and batches written, rotations, and dropped records. """
+        return {
+            'records': self.records,
+            'batches': self.batches,
+            'rotations': self.rotations,
+            'dropped': self.dropped,
+            'queued': self._queue.qsize() if self._queue is not None else 0
+        }
+
     def close(self):
+        # Let the writer thread drain the queued entries first
+        if self._writer is not None:
+            self._queue.put(STOP)
+            self._writer.join()
+            self._writer = None
+        if self._compressor is not None:
+            self._compressor.join()
+            self._compressor = None
+
         # Ensure the file is properly closed
         if self.file:
             self.file.close()
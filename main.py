@@ -1,9 +1,18 @@
+import time
+STARTED_AT = time.perf_counter()  # Before the (slow) imports below, for the startup profile
+import sys
+from tracing import StartupProfiler
 from quicksaver import QuickSaver
+IMPORTED_AT = time.perf_counter()
 
 
 def main():
+    # Optionally report how long each step of the startup took (python main.py --profile-startup)
+    profiler = StartupProfiler(enabled='--profile-startup' in sys.argv[1:], started_at=STARTED_AT)
+    profiler.record('imports', STARTED_AT, IMPORTED_AT)
+
     # Initialize and run QuickSaver
-    quicksaver = QuickSaver()
+    quicksaver = QuickSaver(profiler=profiler)
     quicksaver.start_quicksaver()
 
 
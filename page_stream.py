@@ -0,0 +1,96 @@
+""" Incremental parser for the pages of items the Spotify API returns, e.g.
+    {"items": [{...}, {...}], "next": "<url>", "total": 1234}
+
+The body is read in chunks as it arrives and the items are decoded (and handed over) one at a time,
+so a whole page is never built as a dict. The other top-level fields are kept in `fields` once the
+page was read.
+"""
+import codecs
+import json
+import re
+
+CHUNK_SIZE = 16 * 1024  # Bytes read from the response at a time
+WHITESPACE = re.compile(r'\s*')
+_decoder = json.JSONDecoder()
+
+
+class PageStream:
+    """ Iterates over the items of a page read from the given chunks of bytes (e.g. response.iter_content()). """
+
+    def __init__(self, chunks, items_key: str = 'items'):
+        self.items_key = items_key
+        self.fields = {}  # The other top-level fields of the page, filled in as they're read
+        self.bytes_read = 0
+
+        self._chunks = iter(chunks)
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._exhausted = False
+
+    def _fill(self) -> bool:
+        """ Reads the next chunk into the buffer (dropping what was parsed already), returns False once there's no more. """
+        if self._exhausted is True:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._exhausted = True
+            self._buffer = self._buffer[self._pos:] + self._text_decoder.decode(b'', final=True)
+        else:
+            self.bytes_read += len(chunk)
+            self._buffer = self._buffer[self._pos:] + self._text_decoder.decode(chunk)
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """ Skips whitespace and gets the next character (without consuming it). """
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if self._fill() is False:
+                raise ValueError('Page ended unexpectedly')
+
+    def _expect(self, char: str):
+        """ Consumes the given character, raises a ValueError if it's something else. """
+        if self._peek() != char:
+            raise ValueError(f'Expected {char!r} at {self._pos} of the page, got {self._buffer[self._pos]!r}')
+        self._pos += 1
+
+    def _decode(self):
+        """ Decodes the next JSON value, reading more of the page until the value is complete. """
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+                # A number (or literal) right at the end of the buffer might continue in the next chunk
+                if end < len(self._buffer) or self._exhausted is True:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._exhausted is True:
+                    raise
+            self._fill()
+
+    def __iter__(self):
+        """ Yields the items of the page one by one, reading the other fields as they come. """
+        self._expect('{')
+        while self._peek() != '}':
+            if self._peek() == ',':
+                self._pos += 1
+            key = self._decode()
+            self._expect(':')
+
+            # Any other field is decoded whole (they're small, e.g. the next page's URL)
+            if key != self.items_key or self._peek() != '[':
+                self.fields[key] = self._decode()
+                continue
+
+            # Decode the items one at a time
+            self._expect('[')
+            while self._peek() != ']':
+                if self._peek() == ',':
+                    self._pos += 1
+                yield self._decode()
+            self._pos += 1
+        self._pos += 1
@@ -0,0 +1,130 @@
+from request_scheduler import INTERACTIVE, BACKGROUND
+import threading
+import time
+
+FAST_INTERVAL = 1.0  # Seconds between polls while a track is playing
+SLOW_INTERVAL = 10.0  # Seconds between polls while playback is paused or idle
+CACHE_TTL = 2.0  # Seconds a polled track ID can be trusted before a press has to ask Spotify again
+
+
+class PlaybackPoller:
+    """ Background poller that keeps the currently playing track ID cached,
+        so button presses don't have to wait on the API to find out what's playing. """
+
+    def __init__(self, client, logger, fast_interval: float = FAST_INTERVAL,
+                 slow_interval: float = SLOW_INTERVAL, ttl: float = CACHE_TTL):
+        self.client = client
+        self.logger = logger
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.ttl = ttl
+
+        # Cached playback state, only accessed while holding the lock
+        self._lock = threading.Lock()
+        self.track_id = None
+        self.is_playing = False
+        self.fetched_at = None     # Monotonic time of the last successful poll
+        self.track_ends_at = None  # Monotonic time the cached track is expected to end
+
+        # Counters used to tune the intervals against the API quota
+        self.hits = 0
+        self.misses = 0
+        self.polls = 0
+        self.poll_errors = 0
+        self.total_hit_staleness = 0.0  # Sum of the cache age at every hit
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """ Starts polling in a background thread. """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='PlaybackPoller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stops polling and waits for the background thread to exit. """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """ Polls the playback state until stopped, adapting the interval to the playback. """
+        while not self._stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as err:
+                with self._lock:
+                    self.poll_errors += 1
+                self.logger.error('Playback poll failed: ' + str(err))
+            self._stop_event.wait(self.next_interval())
+
+    def next_interval(self) -> float:
+        """ Gets how long to wait before the next poll based on the cached playback state. """
+        with self._lock:
+            if self.is_playing is False:
+                return self.slow_interval
+
+            # Poll right after the current track ends if that's sooner than the fast interval
+            until_track_end = self.track_ends_at - time.monotonic()
+            return max(min(self.fast_interval, until_track_end + 0.1), 0.1)
+
+    def poll(self, priority: int = BACKGROUND) -> str:
+        """ Gets the playback state from Spotify (with the given request priority), caches it,
+            and returns the currently playing track ID. """
+        track_id, is_playing, remaining = self.client.currently_playing_state(priority)
+        now = time.monotonic()
+
+        with self._lock:
+            self.polls += 1
+            self.track_id = track_id
+            self.is_playing = is_playing
+            self.fetched_at = now
+            self.track_ends_at = now + remaining if is_playing is True else None
+
+        return track_id
+
+    def current_track_id(self) -> str:
+        """ Gets the currently playing track ID from the cache if it's fresh, otherwise from Spotify
+            (ahead of the background requests, since a press is waiting on it). A cached "nothing playing"
+            is always checked live, since the press may be right after playback started. """
+        now = time.monotonic()
+
+        with self._lock:
+            if self.track_id is not None and self._is_fresh(now):
+                self.hits += 1
+                self.total_hit_staleness += now - self.fetched_at
+                return self.track_id
+            self.misses += 1
+
+        return self.poll(INTERACTIVE)
+
+    def last_known_track_id(self) -> str:
+        """ Gets the last polled track if it should still be playing regardless of the cache TTL
+            (used while Spotify can't be reached), otherwise None. """
+        with self._lock:
+            if self.is_playing is True and time.monotonic() < self.track_ends_at:
+                return self.track_id
+            return None
+
+    def _is_fresh(self, now: float) -> bool:
+        """ Checks whether the cached track can be trusted (must be called while holding the lock). """
+        if self.fetched_at is None or now - self.fetched_at > self.ttl:
+            return False
+        # The cached track can't still be playing if it was expected to have ended
+        return self.track_ends_at is None or now < self.track_ends_at
+
+    def stats(self) -> dict:
+        """ Returns the cache hit rate and staleness along with the poll counters. """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else None,
+                'avg_hit_staleness': self.total_hit_staleness / self.hits if self.hits > 0 else None,
+                'staleness': time.monotonic() - self.fetched_at if self.fetched_at is not None else None,
+                'polls': self.polls,
+                'poll_errors': self.poll_errors
+            }
@@ -0,0 +1,150 @@
+""" On-disk index of each playlist's track IDs, keyed by the playlist's snapshot ID.
+
+File format: a header line followed by the playlist's track IDs, sorted and newline-separated.
+    QSPI1 <crc32 of body> <track count> <snapshot_id>\\n<track_id>\\n<track_id>...
+The checksum lets a truncated or corrupted file be detected and treated as missing.
+"""
+import threading
+import zlib
+import os
+
+INDEX_DIR = "playlist_index"  # Directory holding one index file per playlist
+MAGIC = b"QSPI1"  # Identifies (and versions) the index file format
+SAVE_DELAY = 5.0  # Seconds the indexes are held after a change so a burst of presses is written once
+
+
+def index_path(playlist_id: str) -> str:
+    """ Returns the path of the index file for the given playlist. """
+    return os.path.join(INDEX_DIR, playlist_id + '.idx')
+
+def load_index(playlist_id: str) -> tuple[str, set[str]]:
+    """ Loads the given playlist's index and returns its snapshot ID and track IDs,
+        or None if there's no index or it can't be trusted. """
+    try:
+        with open(index_path(playlist_id), 'rb') as index_file:
+            data = index_file.read()
+    except FileNotFoundError:
+        return None
+
+    # Split the header from the body and validate it
+    header, _, body = data.partition(b'\n')
+    parts = header.split(b' ', 3)
+    if len(parts) != 4 or parts[0] != MAGIC:
+        return None
+    _, checksum, count, snapshot_id = parts
+    try:
+        if int(checksum) != zlib.crc32(body):
+            return None
+
+        track_ids = set(body.decode('ascii').split('\n')) if body else set()
+        if len(track_ids) != int(count):
+            return None
+
+        return snapshot_id.decode('ascii'), track_ids
+    except (ValueError, UnicodeDecodeError):
+        return None  # Corrupted header
+
+def save_index(playlist_id: str, snapshot_id: str, track_ids) -> None:
+    """ Atomically writes the index of the given playlist (a power cut leaves either the old or the new file). """
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    body = '\n'.join(sorted(track_ids)).encode('ascii')
+    header = b' '.join([MAGIC, str(zlib.crc32(body)).encode(), str(len(track_ids)).encode(), snapshot_id.encode('ascii')])
+
+    # Write the new index to a temporary file and make sure it's on disk
+    path = index_path(playlist_id)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as temp_file:
+        temp_file.write(header + b'\n' + body)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+
+    # Swap it in place of the old index, then persist the rename itself
+    os.replace(temp_path, path)
+    dir_fd = os.open(INDEX_DIR, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def remove_index(playlist_id: str) -> None:
+    """ Removes the index of the given playlist if there's one (so the next startup downloads the playlist). """
+    try:
+        os.remove(index_path(playlist_id))
+    except FileNotFoundError:
+        pass
+
+
+class IndexWriter:
+    """ Writes the indexes of the playlists that changed in the background, a save delay after the first
+        change (so a press never waits on the disk), and once more when stopped. """
+
+    def __init__(self, logger, read_func, save_delay: float = SAVE_DELAY):
+        self.logger = logger
+        # Called with a playlist ID, returns the (snapshot ID, track IDs) to write, with the snapshot ID None
+        # if the index can't be trusted anymore (it's removed), or None if it shouldn't be written right now
+        self.read = read_func
+        self.save_delay = save_delay
+
+        self._lock = threading.Lock()
+        self._pending = set()  # IDs of the playlists whose index changed since it was last written
+        self.written = 0
+        self.removed = 0
+
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """ Starts the background thread that writes the changed indexes. """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='IndexWriter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Writes the changed indexes one last time and stops the background thread. """
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        else:
+            self.flush()  # Never started, so nothing wrote the changes yet
+
+    def schedule(self, playlist_id: str):
+        """ Marks the index of the given playlist as changed, so it's written with the next batch. """
+        with self._lock:
+            self._pending.add(playlist_id)
+        self._wake_event.set()
+
+    def _run(self):
+        """ Writes the changed indexes a save delay after the first change arrives, until stopped. """
+        while not self._stop_event.is_set():
+            self._wake_event.wait()
+
+            # Wait out the save delay so more changes can join the batch (stopping writes right away)
+            self._stop_event.wait(self.save_delay)
+            self._wake_event.clear()
+            self.flush()
+
+        # Write whatever changed while stopping
+        self.flush()
+
+    def flush(self):
+        """ Writes (or removes) the index of every playlist that changed. """
+        with self._lock:
+            pending, self._pending = self._pending, set()
+
+        for playlist_id in pending:
+            try:
+                index = self.read(playlist_id)
+                if index is None:
+                    continue
+                snapshot_id, track_ids = index
+                if snapshot_id is None:
+                    remove_index(playlist_id)
+                    self.removed += 1
+                else:
+                    save_index(playlist_id, snapshot_id, track_ids)
+                    self.written += 1
+            except Exception as err:
+                self.logger.error(f'Writing the index of playlist <{playlist_id}> failed: ' + str(err))
@@ -0,0 +1,142 @@
+""" Shared index of which of the user's playlists each track is in.
+
+Every playlist gets a bit, and each track is stored once with the mask of the playlists it's in,
+so the memory grows with the number of different tracks rather than with the number of playlists,
+and finding every playlist a track is in is a single lookup. Each playlist's tracks can still be
+used like a set through a PlaylistTracks view.
+"""
+from track_index import TrackMaskIndex
+import utils as utl
+import itertools
+import threading
+
+MAX_PLAYLISTS = 64  # Bits in a mask
+
+
+class PlaylistMembership:
+    """ Maps each track ID to the mask of the playlists it's in, as a dict of ID strings,
+        or as a compact TrackMaskIndex (a fraction of the memory, for very large playlists). """
+
+    def __init__(self, compact: bool = False):
+        self._masks = TrackMaskIndex() if compact is True else {}
+        self._counts = {}  # Bit -> number of tracks in the playlist
+        self._lock = threading.Lock()  # Edits of the masks (playlists may be loaded at the same time)
+
+    def mask(self, track_id: str) -> int:
+        """ Gets the mask of the playlists the given track is in (0 if it's in none). """
+        with self._lock:
+            return self._masks.get(track_id, 0)
+
+    def add(self, track_id: str, bit: int) -> bool:
+        """ Adds the given track to the playlist of the given bit, returns whether it wasn't in it yet. """
+        with self._lock:
+            mask = self._masks.get(track_id, 0)
+            if mask & bit != 0:
+                return False
+            self._masks[track_id] = mask | bit
+            self._counts[bit] = self._counts.get(bit, 0) + 1
+            return True
+
+    def discard(self, track_id: str, bit: int) -> bool:
+        """ Removes the given track from the playlist of the given bit, returns whether it was in it. """
+        with self._lock:
+            mask = self._masks.get(track_id, 0)
+            if mask & bit == 0:
+                return False
+            if mask == bit:
+                del self._masks[track_id]
+            else:
+                self._masks[track_id] = mask & ~bit
+            self._counts[bit] -= 1
+            return True
+
+    def load(self, bit: int, track_ids):
+        """ Replaces the tracks of the playlist of the given bit with the given track IDs (e.g. freshly downloaded). """
+        with self._lock:
+            self._clear_bit(bit)
+            if isinstance(self._masks, TrackMaskIndex):
+                self._counts[bit] = self._masks.add_bit(track_ids, bit)
+                return
+
+            # Fill the masks as the IDs come in (e.g. streamed), the bit tells the duplicates apart
+            count = 0
+            for track_id in track_ids:
+                mask = self._masks.get(track_id, 0)
+                if mask & bit == 0:
+                    self._masks[track_id] = mask | bit
+                    count += 1
+            self._counts[bit] = count
+
+    def _clear_bit(self, bit: int):
+        """ Removes every track from the playlist of the given bit. """
+        if self._counts.get(bit, 0) == 0:
+            return
+        if isinstance(self._masks, TrackMaskIndex):
+            self._masks.clear_bit(bit)
+        else:
+            for track_id, mask in list(self._masks.items()):
+                if mask == bit:
+                    del self._masks[track_id]
+                elif mask & bit != 0:
+                    self._masks[track_id] = mask & ~bit
+        self._counts[bit] = 0
+
+    def count(self, bit: int) -> int:
+        """ Gets the number of tracks in the playlist of the given bit. """
+        return self._counts.get(bit, 0)
+
+    def tracks(self, bit: int):
+        """ Gets the tracks of the playlist of the given bit as a generator, over a copy of only that playlist's
+            tracks (goes through every track in the index to find them, the compact IDs are decoded as it's iterated). """
+        with self._lock:
+            if isinstance(self._masks, TrackMaskIndex):
+                high_keys, low_keys, others = self._masks.with_bit(bit)
+            else:
+                return iter([track_id for track_id, mask in self._masks.items() if mask & bit != 0])
+        return itertools.chain((utl.int_to_track_id(high << 64 | low) for high, low in zip(high_keys, low_keys)), others)
+
+    def __len__(self) -> int:
+        """ Gets the number of different tracks across all the playlists. """
+        return len(self._masks)
+
+    def view(self, bit: int) -> 'PlaylistTracks':
+        """ Gets a set-like view of the tracks of the playlist of the given bit. """
+        return PlaylistTracks(self, bit)
+
+
+class PlaylistTracks:
+    """ Set-like view of one playlist's tracks in the shared index (what the controller's local track lists are). """
+
+    __slots__ = ('membership', 'bit')
+
+    def __init__(self, membership: PlaylistMembership, bit: int):
+        self.membership = membership
+        self.bit = bit
+
+    def __contains__(self, track_id: str) -> bool:
+        return self.membership.mask(track_id) & self.bit != 0
+
+    def __len__(self) -> int:
+        return self.membership.count(self.bit)
+
+    def __iter__(self):
+        return self.membership.tracks(self.bit)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (PlaylistTracks, set, frozenset)):
+            return len(self) == len(other) and all(track_id in self for track_id in other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'PlaylistTracks({len(self)} tracks)'
+
+    def add(self, track_id: str):
+        self.membership.add(track_id, self.bit)
+
+    def discard(self, track_id: str):
+        self.membership.discard(track_id, self.bit)
+
+    def remove(self, track_id: str):
+        """ Removes the given track, raises a KeyError if it isn't in the playlist. """
+        if self.membership.discard(track_id, self.bit) is False:
+            raise KeyError(track_id)
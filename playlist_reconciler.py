@@ -0,0 +1,264 @@
+""" Keeps the local playlist indexes in line with the edits made outside of QuickSaver (e.g. in the Spotify app).
+
+Every interval, each playlist's snapshot ID and item count are polled (a single small request). When the snapshot
+changed, the items added since the last sync are read from the end of the playlist, since new items are appended
+and so come in the order they were added, back to the first one older than the newest item synced before. If the
+item count then adds up, only the new tracks are added to the index. Otherwise tracks were removed or moved (or too
+many were added to read them from the end), and the playlist is downloaded again to rebuild its index.
+"""
+from spotify_client import PAGE_LIMIT
+import threading
+
+RECONCILE_INTERVAL = 60  # Seconds between polls of the playlists' snapshot IDs
+TAIL_PAGES = 3  # Max pages read from the end of a changed playlist before rebuilding its index instead
+FIRST_TAIL_PAGE = 20  # Items in the first of those pages (most changes are a few added tracks), the rest are full pages
+
+# Outcomes of reconciling a playlist
+UNCHANGED = "unchanged"  # The snapshot ID didn't change
+TAIL = "tail"            # The new tracks were read from the end of the playlist
+REBUILT = "rebuilt"      # The playlist was downloaded again
+SKIPPED = "skipped"      # Our own writes were on their way, tried again at the next poll
+
+
+def newest_items(items: list[tuple[str, str]], newest: tuple = (None, frozenset())) -> tuple[str, frozenset]:
+    """ Gets when the newest of the given (track ID, added at) items were added and their track IDs,
+        going on from the given (added at, track IDs) of the newest items before them. """
+    newest_added, track_ids = newest[0], set(newest[1])
+    for track_id, added_at in items:
+        if newest_added is None or added_at > newest_added:
+            newest_added, track_ids = added_at, {track_id}
+        elif added_at == newest_added:
+            track_ids.add(track_id)
+    return newest_added, frozenset(track_ids)
+
+
+class PlaylistReconciler:
+    """ Polls the snapshot IDs of the controller's playlists in the background, and brings
+        the membership index (and the on-disk index) up to date with the playlists that changed. """
+
+    def __init__(self, controller, logger, interval: float = RECONCILE_INTERVAL, tail_pages: int = TAIL_PAGES):
+        self.controller = controller
+        self.client = controller.client
+        self.logger = logger
+        self.interval = interval
+        self.tail_pages = tail_pages
+
+        # Playlist ID -> when its newest synced items were added (ISO 8601 strings sort by time) and their track IDs
+        # (items are only timed to the second, so the ones added in the same second are told apart by their IDs)
+        self.newest_synced = {}
+        self.uncounted = {}     # Playlist ID -> items the index doesn't hold (local files, a track in it twice)
+
+        # Counters for the polling and bandwidth cost
+        self.polls = 0
+        self.changes = 0
+        self.tail_syncs = 0
+        self.rebuilds = 0
+        self.skipped = 0
+        self.sync_requests = 0  # Page requests made on top of the polls (mostly to sync the playlists that changed)
+        self.items_read = 0     # Playlist items those pages held
+        self.added = 0
+        self.removed = 0
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """ Starts reconciling the playlists in the background every interval. """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='PlaylistReconciler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stops reconciling and waits for the background thread to exit. """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """ Reconciles the playlists every interval until stopped. """
+        while not self._stop_event.wait(self.interval):
+            self.reconcile_all()
+
+    def on_playlist_loaded(self, playlist_id: str, total: int):
+        """ Records how many of the freshly loaded playlist's items its index doesn't hold (from the given item count). """
+        with self.controller.playlist_locks[playlist_id]:
+            self.uncounted[playlist_id] = total - len(self.controller.get_local_track_list(playlist_id))
+
+    def reconcile_all(self) -> dict:
+        """ Reconciles every playlist and returns the outcome for each one (None if it failed). """
+        outcomes = {}
+        for playlist_id in self.controller.playlist_ids:
+            try:
+                outcomes[playlist_id] = self.reconcile(playlist_id)
+            except Exception as err:
+                outcomes[playlist_id] = None
+                self.logger.error(f'Reconciling playlist <{playlist_id}> failed: {err}')
+        return outcomes
+
+    def reconcile(self, playlist_id: str) -> str:
+        """ Polls the given playlist's snapshot ID and brings its index up to date if it changed. """
+        known_snapshot = self.controller.plist_snapshots.get(playlist_id)
+        snapshot_id, total = self.client.get_playlist_state(playlist_id)
+        self.polls += 1
+
+        # Still in sync, so every item the index doesn't hold isn't a track it can hold
+        drifted = False
+        if snapshot_id == known_snapshot:
+            with self.controller.playlist_locks[playlist_id]:
+                if self.controller.plist_snapshots.get(playlist_id) == known_snapshot:
+                    uncounted = total - len(self.controller.get_local_track_list(playlist_id))
+                    drifted = self.uncounted.setdefault(playlist_id, uncounted) != uncounted
+
+            # Find out when the newest item was added the first time, so the next change is read from there
+            if drifted is False and playlist_id not in self.newest_synced and total > 0:
+                items, _ = self.client.get_playlist_items_page(playlist_id, total - 1, 1)
+                self.sync_requests += 1
+                self.items_read += len(items)
+                if len(items) > 0:
+                    self.newest_synced[playlist_id] = newest_items(items)
+            if drifted is False:
+                return UNCHANGED
+            # Otherwise the snapshot one of our own writes got back also holds edits made in the app
+            with self.controller.playlist_locks[playlist_id]:
+                if self.controller.plist_snapshots.get(playlist_id) == known_snapshot:
+                    self.controller.mark_index_dirty(playlist_id)
+
+        # Our own writes change the snapshot once they're sent, which records the new one
+        if self.controller.has_pending_writes(playlist_id):
+            self.skipped += 1
+            return SKIPPED
+        self.changes += 1
+
+        # Read the new items from the end of the playlist, and use them if the item count adds up
+        tail = self.read_tail(playlist_id, total)
+        if tail is not None:
+            outcome = self.apply_tail(playlist_id, known_snapshot, snapshot_id, total, *tail)
+            if outcome is not None:
+                return outcome
+
+        return self.rebuild(playlist_id, known_snapshot, snapshot_id)
+
+    def read_tail(self, playlist_id: str, total: int) -> tuple[list[tuple[str, str]], tuple]:
+        """ Reads the items added since the last sync from the end of the playlist and returns them (in playlist
+            order) with the newest items (see newest_items), or None if they don't fit in the tail pages. Without
+            a previous sync, reads back to the first track the index already holds. """
+        synced = self.newest_synced.get(playlist_id)
+        newest_synced, synced_ids = synced if synced is not None else (None, frozenset())
+        playlist_tracks = self.controller.get_local_track_list(playlist_id)
+        tail, end = [], total
+
+        for page in range(self.tail_pages):
+            if end <= 0:
+                break
+            offset = max(0, end - (FIRST_TAIL_PAGE if page == 0 else PAGE_LIMIT))
+            items, _ = self.client.get_playlist_items_page(playlist_id, offset, end - offset)
+            self.sync_requests += 1
+            self.items_read += len(items)
+            end = offset
+
+            for track_id, added_at in reversed(items):
+                # Stop at the first item that was synced before (the rest of the playlist is older)
+                if newest_synced is None:
+                    is_synced = track_id in playlist_tracks
+                elif added_at == newest_synced:
+                    is_synced = track_id in synced_ids
+                else:
+                    is_synced = added_at < newest_synced
+                if is_synced is True:
+                    tail.reverse()
+                    return tail, newest_items(tail + [(track_id, added_at)], (newest_synced, synced_ids))
+                tail.append((track_id, added_at))
+
+        # Everything in the playlist is new if it was read to the start, otherwise there's too much to read
+        if end > 0:
+            return None
+        tail.reverse()
+        return tail, newest_items(tail, (newest_synced, synced_ids))
+
+    def apply_tail(self, playlist_id: str, known_snapshot: str, snapshot_id: str, total: int,
+                   tail: list[tuple[str, str]], newest: tuple) -> str:
+        """ Adds the new tracks of the tail to the index if the item count adds up (TAIL), skips them if our own
+            writes changed the playlist in the meantime (SKIPPED), otherwise returns None (it needs a rebuild). """
+        with self.controller.playlist_locks[playlist_id]:
+            if self._is_stale(playlist_id, known_snapshot):
+                self.skipped += 1
+                return SKIPPED
+            if playlist_id not in self.uncounted:
+                return None
+
+            # The tracks the index already holds were our own saves (or added again, which the count catches)
+            playlist_tracks = self.controller.get_local_track_list(playlist_id)
+            new_track_ids, uncounted = set(), self.uncounted[playlist_id]
+            for track_id, _ in tail:
+                if track_id is None or track_id in new_track_ids:
+                    uncounted += 1
+                elif track_id not in playlist_tracks:
+                    new_track_ids.add(track_id)
+            if len(playlist_tracks) + len(new_track_ids) + uncounted != total:
+                return None
+
+            for track_id in new_track_ids:
+                playlist_tracks.add(track_id)
+            self.uncounted[playlist_id] = uncounted
+            self._synced(playlist_id, snapshot_id, newest)
+
+        self.tail_syncs += 1
+        self.added += len(new_track_ids)
+        return TAIL
+
+    def rebuild(self, playlist_id: str, known_snapshot: str, snapshot_id: str) -> str:
+        """ Downloads the whole playlist and replaces its tracks in the index (REBUILT), unless our own
+            writes changed the playlist in the meantime (SKIPPED). """
+        items, offset, total = [], 0, None
+        while total is None or offset < total:
+            page, total = self.client.get_playlist_items_page(playlist_id, offset)
+            self.sync_requests += 1
+            self.items_read += len(page)
+            items.extend(page)
+            offset += PAGE_LIMIT
+            if len(page) == 0:
+                break
+        track_ids = {track_id for track_id, _ in items if track_id is not None}
+        newest = newest_items(items)
+
+        with self.controller.playlist_locks[playlist_id]:
+            if self._is_stale(playlist_id, known_snapshot):
+                self.skipped += 1
+                return SKIPPED
+            playlist_tracks = self.controller.get_local_track_list(playlist_id)
+            added = sum(1 for track_id in track_ids if track_id not in playlist_tracks)
+            removed = len(playlist_tracks) + added - len(track_ids)
+            self.controller.membership.load(playlist_tracks.bit, track_ids)
+            self.uncounted[playlist_id] = len(items) - len(track_ids)
+            self._synced(playlist_id, snapshot_id, newest)
+
+        self.rebuilds += 1
+        self.added += added
+        self.removed += removed
+        return REBUILT
+
+    def _is_stale(self, playlist_id: str, known_snapshot: str) -> bool:
+        """ Checks whether our own writes changed the playlist since it was polled (must hold the playlist's lock). """
+        return self.controller.plist_snapshots.get(playlist_id) != known_snapshot or \
+            self.controller.has_pending_writes(playlist_id)
+
+    def _synced(self, playlist_id: str, snapshot_id: str, newest: tuple):
+        """ Records that the index is up to date with the given snapshot and newest items (must hold the playlist's lock). """
+        if newest[0] is not None:
+            self.newest_synced[playlist_id] = newest
+        self.controller.sync_playlist_index(playlist_id, snapshot_id)
+
+    def stats(self) -> dict:
+        """ Returns the poll, sync, and request counters (the polling and bandwidth cost) and the tracks synced. """
+        return {
+            'polls': self.polls,
+            'changes': self.changes,
+            'tail_syncs': self.tail_syncs,
+            'rebuilds': self.rebuilds,
+            'skipped': self.skipped,
+            'sync_requests': self.sync_requests,
+            'items_read': self.items_read,
+            'added': self.added,
+            'removed': self.removed
+        }
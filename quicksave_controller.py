@@ -1,30 +1,263 @@
-from spotify_client import SpotifyClient
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from spotify_client import SpotifyClient, LOADER_WORKERS, REFRESH_LEAD, KEEP_WARM_INTERVAL, is_network_error
+from write_behind import WriteBehindQueue, FLUSH_DELAY, ADD, REMOVE, LIBRARY as LIBRARY_TARGET
+from playlist_membership import PlaylistMembership, PlaylistTracks, MAX_PLAYLISTS
+import playlist_index
+import tracing
 
 # Constants
 IS_DUPE = "IS_DUPLICATE"  # Status code for duplicate track
 CONFIG = "config.json"
+WRITE_WORKERS = 4  # Number of writes that can be sent to Spotify at the same time
+KEEP_WARM_WINDOW = 600  # Seconds after a press the API connection is kept warm (when there's no playback poller)
+LIBRARY = "library"    # Names of the writes that make up a save/undo (used when reporting partial writes)
+PLAYLIST = "playlist"
+
+
+class PartialWriteError(Exception):
+    """ Raised when only some of the concurrent writes of an action succeeded. """
+
+    def __init__(self, track_id: str, succeeded: list[str], failed: dict, rolled_back: list[str]):
+        self.track_id = track_id
+        self.succeeded = succeeded      # Names of the writes that succeeded
+        self.failed = failed            # Names of the writes that failed -> the error they raised
+        self.rolled_back = rolled_back  # Names of the succeeded writes that were rolled back
+        errors = ', '.join(f'{name}: {err}' for name, err in failed.items())
+        super().__init__(f'Partial write for track <{track_id}>, succeeded {succeeded}, '
+                         f'rolled back {rolled_back}, failed ({errors})')
 
 
 class QuickSaveController:
     """ Controller that handles the main quick saving functionality of the app (backend). """
 
-    def __init__(self, notifier, logger, teardown_func):
+    def __init__(self, notifier, logger, teardown_func, options: dict = None, spotify_api=None):
+
+        # Optional settings from the config (see config_handler.EMPTY_CONFIG for the defaults),
+        # the modules of the optional features are only imported when they're enabled (faster startup)
+        options = options if options is not None else {}
 
         # Initialize the SpotifyClient
-        self.client = SpotifyClient(notifier, logger, teardown_func)
+        self.client = SpotifyClient(notifier, logger, teardown_func, spotify_api, options)
+        self.parallel_loading = options.get('parallel_loading', False)
+        self.loader_workers = options.get('loader_workers', LOADER_WORKERS)
+        self.use_playlist_index = options.get('playlist_index', True)
+        self.stream_pages = options.get('stream_playlist_pages', False)
+        self.use_token_refresher = options.get('token_refresher', True)
+        self.token_refresh_lead = options.get('token_refresh_lead', REFRESH_LEAD)
+        self.use_keep_warm = options.get('keep_warm', False)
+        self.keep_warm_interval = options.get('keep_warm_interval', KEEP_WARM_INTERVAL)
+        self.last_activity = time.monotonic()  # Time of the last press that needed Spotify
+
+        # Holds the last known snapshot ID of each playlist (kept in sync with the on-disk index)
+        self.plist_snapshots = {}
+        # IDs of the playlists whose local track list may not match their last known snapshot anymore
+        # (the snapshot IDs our own writes get back are then not trusted until the playlist is synced again)
+        self.dirty_indexes = set()
+
+        # Writes the on-disk indexes in the background after the presses changed them
+        self.index_writer = None
+        if self.use_playlist_index is True:
+            self.index_writer = playlist_index.IndexWriter(logger, self.read_playlist_index,
+                                                           options.get('index_save_delay', playlist_index.SAVE_DELAY))
+
+        # Which of the playlists each track is in, shared by all of them (see set_playlists)
+        self.membership = PlaylistMembership(options.get('compact_track_index', False))
+        self.playlist_ids = []
+        self.playlist_bits = {}  # Playlist ID -> its bit in the membership masks
+        self.playlist_locks = {}  # Playlist ID -> lock held while a save/undo edits it (other playlists aren't held up)
+        self.like_lock = threading.Lock()  # Makes the check and the write of a like toggle a single step
+
+        # Optionally keep the currently playing track cached by polling in the background
+        self.playback_poller = None
+        if options.get('playback_poller', False) is True:
+            from playback_poller import PlaybackPoller, FAST_INTERVAL, SLOW_INTERVAL, CACHE_TTL
+            self.playback_poller = PlaybackPoller(self.client, logger,
+                                                  options.get('poll_interval_playing', FAST_INTERVAL),
+                                                  options.get('poll_interval_idle', SLOW_INTERVAL),
+                                                  options.get('playback_cache_ttl', CACHE_TTL))
+
+        # Optionally mirror the user's liked songs locally (avoids checking with Spotify on every toggle)
+        self.liked_mirror = None
+        if options.get('liked_mirror', False) is True:
+            from liked_mirror import LikedSongsMirror, SYNC_INTERVAL
+            self.liked_mirror = LikedSongsMirror(self.client, logger,
+                                                 options.get('liked_mirror_sync_interval', SYNC_INTERVAL))
+
+        # Optionally journal the writes that can't reach Spotify (e.g. Wi-Fi is down) and replay them later
+        self.journal = None
+        if options.get('offline_journal', False) is True:
+            from journal import OfflineJournal, JOURNAL_FILENAME, RETRY_INTERVAL
+            self.journal = OfflineJournal(self.client, logger, options.get('journal_filename', JOURNAL_FILENAME),
+                                          options.get('journal_retry_interval', RETRY_INTERVAL),
+                                          self.on_playlist_flushed)
+
+        # Optionally acknowledge writes locally and send them to Spotify in batches on a short timer
+        self.write_behind = None
+        if options.get('write_behind', False) is True:
+            self.write_behind = WriteBehindQueue(self.client, logger, options.get('write_behind_delay', FLUSH_DELAY),
+                                                 self.on_playlist_flushed, self.journal, self.on_write_dropped)
+
+        # Optionally keep the playlists' indexes in line with the edits made in the Spotify app
+        self.reconciler = None
+        if options.get('playlist_reconciler', False) is True:
+            from playlist_reconciler import PlaylistReconciler, RECONCILE_INTERVAL
+            self.reconciler = PlaylistReconciler(self, logger, options.get('reconcile_interval', RECONCILE_INTERVAL))
+
+        # Otherwise optionally send the independent writes of a save/undo to Spotify at the same time
+        self.write_pool = None
+        if options.get('concurrent_writes', False) is True and self.write_behind is None:
+            self.write_pool = ThreadPoolExecutor(max_workers=options.get('write_workers', WRITE_WORKERS),
+                                                 thread_name_prefix='Writer')
 
         # Holds the last saved track and its playlist in a tuple (track_id, playlist_id)
         self.last_save = None
+        self.last_save_lock = threading.Lock()  # Presses can run at the same time (e.g. each button on its own thread)
+
+    def set_playlists(self, playlist_ids: list[str], concurrent: bool = False):
+        """ Sets the IDs of the playlists that can be saved to (each gets a bit in the shared membership index)
+            and loads their contents into the index (avoids adding duplicates). """
+        self.playlist_ids = list(dict.fromkeys(playlist_ids))  # Two buttons may save to the same playlist
+        if len(self.playlist_ids) > MAX_PLAYLISTS:
+            raise ValueError(f'QuickSaver can save to at most {MAX_PLAYLISTS} playlists')
+        self.playlist_bits = {playlist_id: 1 << bit for bit, playlist_id in enumerate(self.playlist_ids)}
+        self.playlist_locks = {playlist_id: threading.Lock() for playlist_id in self.playlist_ids}
+
+        # Load the playlists at the same time when parallel loading is enabled (or it's asked for, e.g. fast start)
+        if (self.parallel_loading is True or concurrent is True) and len(self.playlist_ids) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(self.playlist_ids), self.loader_workers)) as pool:
+                list(pool.map(self.load_playlist_tracks, self.playlist_ids))
+        else:
+            for playlist_id in self.playlist_ids:
+                self.load_playlist_tracks(playlist_id)
 
-    def set_playlist_info(self, main_playlist_id: str, other_playlist_id: str,):
-        """ Sets the playlists IDs and creates local records of the playlist contents (avoids adding duplicates). """
-        self.main_playlist_id = main_playlist_id
-        self.other_playlist_id = other_playlist_id
-        self.main_plist_tracks = set(self.client.get_playlist_tracks(main_playlist_id))
-        self.other_plist_tracks = set(self.client.get_playlist_tracks(other_playlist_id))
+    def load_playlist_tracks(self, playlist_id: str) -> PlaylistTracks:
+        """ Loads the tracks of the given playlist into the membership index, from the on-disk index
+            if it's still up to date with the playlist's snapshot, otherwise from Spotify. """
+        playlist_tracks = self.get_local_track_list(playlist_id)
 
-    def start_access_token_refresh_loop(self):
-        self.client.start_access_token_refresh_loop()
+        # The reconciler also needs to know which snapshot the tracks are from, and how many items the playlist has
+        snapshot_id, total = None, None
+        if self.reconciler is not None:
+            snapshot_id, total = self.client.get_playlist_state(playlist_id)
+        elif self.use_playlist_index is True:
+            snapshot_id = self.client.get_playlist_snapshot_id(playlist_id)
+
+        if self.use_playlist_index is False:
+            self.membership.load(playlist_tracks.bit, self.download_playlist_tracks(playlist_id))
+        else:
+            # Use the cached index if the playlist hasn't changed since it was written
+            cached_index = playlist_index.load_index(playlist_id) if snapshot_id is not None else None
+            if cached_index is not None and cached_index[0] == snapshot_id:
+                self.membership.load(playlist_tracks.bit, cached_index[1])
+            # Otherwise download the playlist, and have the index refreshed by the index writer (in the background,
+            # so the startup doesn't wait on the disk), unless the snapshot is unknown (it could never be matched)
+            else:
+                self.membership.load(playlist_tracks.bit, self.download_playlist_tracks(playlist_id))
+                if snapshot_id is not None:
+                    self.index_writer.schedule(playlist_id)
+
+        if snapshot_id is not None:
+            self.plist_snapshots[playlist_id] = snapshot_id
+            self.dirty_indexes.discard(playlist_id)
+        if total is not None:
+            self.reconciler.on_playlist_loaded(playlist_id, total)
+        return playlist_tracks
+
+    def download_playlist_tracks(self, playlist_id: str):
+        """ Downloads the tracks of the given playlist (as a list, or as a generator when streaming the pages). """
+        if self.parallel_loading is True:
+            return self.client.get_playlist_tracks_parallel(playlist_id, self.loader_workers)
+        if self.stream_pages is True:
+            return self.client.stream_playlist_tracks(playlist_id)
+        return self.client.get_playlist_tracks(playlist_id)
+
+    def build_liked_mirror(self):
+        """ Builds the local mirror of the user's liked songs if it's enabled. """
+        if self.liked_mirror is not None:
+            self.liked_mirror.build()
+
+    def start_background_tasks(self):
+        """ Starts the enabled background tasks (access token refresher, keep-warm pings, playback poller,
+            liked songs sync, write-behind flushing, offline journal replay, playlist reconciler). """
+        if self.use_token_refresher is True:
+            self.client.start_access_token_refresh_loop(self.token_refresh_lead)
+        if self.use_keep_warm is True:
+            self.client.start_keep_warm(self.is_connection_worth_warming, self.keep_warm_interval)
+        if self.playback_poller is not None:
+            self.playback_poller.start()
+        if self.liked_mirror is not None:
+            self.liked_mirror.start_sync_loop()
+        if self.write_behind is not None:
+            self.write_behind.start()
+        if self.journal is not None:
+            self.journal.start_replay_loop()
+        if self.reconciler is not None:
+            self.reconciler.start()
+        if self.index_writer is not None:
+            self.index_writer.start()
+
+    def stop_background_tasks(self):
+        """ Stops the enabled background tasks. """
+        self.client.stop_access_token_refresh_loop()
+        self.client.stop_keep_warm()
+        if self.playback_poller is not None:
+            self.playback_poller.stop()
+        if self.liked_mirror is not None:
+            self.liked_mirror.stop_sync_loop()
+        if self.reconciler is not None:
+            self.reconciler.stop()
+        if self.write_behind is not None:
+            self.write_behind.stop()  # Flushes the pending writes first
+        if self.write_pool is not None:
+            self.write_pool.shutdown(wait=True)
+        if self.journal is not None:
+            self.journal.stop_replay_loop()
+            self.journal.close()
+        if self.index_writer is not None:
+            self.index_writer.stop()  # Writes the indexes the flushed writes changed
+
+    def is_connection_worth_warming(self) -> bool:
+        """ Checks whether the API connection should be kept warm: while the playback poller sees
+            a track playing, or without the poller, for a while after the last press. """
+        if self.playback_poller is not None:
+            return self.playback_poller.is_playing
+        return time.monotonic() - self.last_activity < KEEP_WARM_WINDOW
+
+    def currently_playing_track(self) -> str:
+        """ Gets the currently playing track ID, from the playback poller's cache when it's enabled. """
+        self.last_activity = time.monotonic()
+        with tracing.span('currently_playing'):
+            try:
+                if self.playback_poller is not None:
+                    return self.playback_poller.current_track_id()
+                return self.client.currently_playing_track()
+
+            except Exception as err:
+                # While offline, use the last track the poller saw if it should still be playing
+                if self.journal is None or self.playback_poller is None or not is_network_error(err):
+                    raise
+                track_id = self.playback_poller.last_known_track_id()
+                if track_id is None:
+                    raise
+                return track_id
+
+    def replay_offline_journal(self):
+        """ Replays the writes left in the offline journal (from before a restart), skipping the ones
+            the freshly loaded playlists and liked songs show are already on Spotify. """
+        if self.journal is not None and len(self.journal) > 0:
+            self.journal.replay(self.is_write_on_spotify)
+
+    def is_write_on_spotify(self, operation: str, track_id: str, target: str) -> bool:
+        """ Checks whether the given write is already reflected in the local records
+            (only reliable before any new writes, since those update the records right away). """
+        is_add = operation == ADD
+        if target is LIBRARY_TARGET:
+            return self.liked_mirror is not None and (track_id in self.liked_mirror) == is_add
+        if target not in self.playlist_bits:
+            return False
+        return (track_id in self.get_local_track_list(target)) == is_add
 
     def validate_user_playlist(self, plist_id: str) -> bool:
         """ Validates that the given playlist ID exists on Spotify and is owned by the user. """
@@ -50,20 +283,32 @@ class QuickSaveController:
             tuple[str, bool]: Returns the ID of the currently playing track, and whether it's saved now.
         """
 
-        track_id = self.client.currently_playing_track()
+        track_id = self.currently_playing_track()
 
         # Terminate the function if no track is currently playing
         if track_id is None:
             return None
 
-        # Check if the track is saved to the library
-        is_saved = self.client.contains_saved_tracks(track_id)
-
-        # Toggle the track's "liked" status
-        if is_saved:
-            self.client.remove_saved_tracks(track_id)
-        else:
-            self.client.add_saved_tracks(track_id)
+        # Check and toggle as one step, so two toggles at the same time can't both like (or unlike) the track
+        with self.like_lock:
+            # Check if the track is saved to the library (locally if the liked songs are mirrored,
+            # or if a toggle before this one is still waiting in the write-behind queue)
+            with tracing.span('like_check'):
+                pending = None
+                if self.write_behind is not None:
+                    pending = self.write_behind.pending_operation(LIBRARY_TARGET, track_id)
+                if self.liked_mirror is not None:
+                    is_saved = track_id in self.liked_mirror
+                elif pending is not None:
+                    is_saved = pending == ADD
+                else:
+                    is_saved = self.client.contains_saved_tracks(track_id)
+
+            # Toggle the track's "liked" status
+            if is_saved:
+                self.unsave_from_library(track_id)
+            else:
+                self.save_to_library(track_id)
 
         # Negate is_saved status from before toggling to the status after toggling
         return track_id, not is_saved
@@ -72,48 +317,309 @@ class QuickSaveController:
         """ Quick saves currently playing track to given playlist and user library, and stores details in last save. """
 
         # Get the currently playing track
-        track_id = self.client.currently_playing_track()
+        track_id = self.currently_playing_track()
 
         # Terminate the function if no track is currently playing
         if track_id is None:
             return None
 
         # Record the saved track and its corresponding playlist in last_save
-        self.last_save = (track_id, playlist_id)
+        # (an undo pressed in the meantime waits for the save to finish through the playlist's lock)
+        self.set_last_save((track_id, playlist_id))
+
+        # Hold the playlist for the check and the writes, saves to other playlists go ahead at the same time
+        with self.playlist_locks[playlist_id]:
+            # Get the reference to the respective playlist's local track list
+            with tracing.span('dupe_check'):
+                playlist_tracks = self.get_local_track_list(playlist_id)
+                is_dupe = track_id in playlist_tracks
+
+            # Save the track to the library (likes song) and terminate the function
+            # if the track is already in the playlist (duplicate track)
+            if is_dupe:
+                self.save_to_library(track_id)
+                return track_id, IS_DUPE
+
+            # Save the track to the library and add it to the Spotify playlist (at the same time if enabled)
+            if self.write_pool is not None:
+                snapshot_id = self.concurrent_quick_save_writes(track_id, playlist_id)
+            else:
+                self.save_to_library(track_id)
+                snapshot_id = self.add_to_playlist(track_id, playlist_id)
+
+            # Add the track to the local track list
+            playlist_tracks.add(track_id)
+            self.update_playlist_index(playlist_id, snapshot_id)
 
-        # Save the track to the library (likes song)
-        self.client.add_saved_tracks(track_id)
-
-        # Get the reference to the respective playlist's local track list
-        playlist_tracks = self.get_local_track_list(playlist_id)
-
-        # Terminate the function if the track is already in the playlist (duplicate track)
-        if track_id in playlist_tracks:
-            return track_id, IS_DUPE
-
-        # Add the track to the Spotify playlist and the local track list
-        self.client.add_track_to_playlist(track_id, playlist_id)
-        playlist_tracks.add(track_id)
+        return track_id, playlist_id
 
-        return self.last_save
+    def concurrent_quick_save_writes(self, track_id: str, playlist_id: str) -> str:
+        """ Saves the track to the library and the playlist concurrently and returns the playlist's new snapshot ID. """
+
+        # Only unlike the track when rolling back if it's known that it wasn't liked before
+        unsave_rollback = None
+        if self.liked_mirror is not None and track_id not in self.liked_mirror:
+            unsave_rollback = lambda: self.unsave_from_library(track_id)
+
+        try:
+            _, snapshot_id = self.run_concurrent_writes(track_id, [
+                (LIBRARY, lambda: self.save_to_library(track_id), unsave_rollback),
+                (PLAYLIST, lambda: self.add_to_playlist(track_id, playlist_id),
+                 lambda: self.remove_from_playlist(track_id, playlist_id))
+            ])
+        except PartialWriteError as err:
+            # Keep the local track list in line with the playlist if the add couldn't be rolled back
+            if PLAYLIST in err.succeeded and PLAYLIST not in err.rolled_back:
+                self.get_local_track_list(playlist_id).add(track_id)
+                self.mark_index_dirty(playlist_id)
+            # Otherwise the track isn't in the playlist, so there's no save to undo
+            else:
+                self.clear_last_save((track_id, playlist_id))
+            raise
+
+        return snapshot_id
 
     def undo_last_save(self) -> tuple[str, str]:
         """ Undoes last quick save by removing the track from the playlist and user library. """
 
+        # Get the last save details and update the last save to None (in one step, so it's only undone once)
+        last_save = self.take_last_save()
+
         # Check if the last save exists before attempting to undo it
-        if self.last_save is None:
+        if last_save is None:
             return None
-
-        # Get the last save details and update the last save to None
-        (track_id, playlist_id), self.last_save = self.last_save, None
-
-        # Remove the track from the user's library, the playlist, and the local track list
-        self.client.remove_saved_tracks(track_id)
-        self.client.remove_track_from_playlist(track_id, playlist_id)
-        self.get_local_track_list(playlist_id).remove(track_id)
+        track_id, playlist_id = last_save
+
+        # Hold the playlist while undoing (waits for the save itself to finish if it's still running)
+        with self.playlist_locks[playlist_id]:
+            # Nothing to undo if the save didn't make it into the playlist (e.g. its write failed)
+            playlist_tracks = self.get_local_track_list(playlist_id)
+            if track_id not in playlist_tracks:
+                return None
+
+            # Remove the track from the user's library and the playlist (at the same time if enabled)
+            if self.write_pool is not None:
+                snapshot_id = self.concurrent_undo_writes(track_id, playlist_id)
+            else:
+                self.unsave_from_library(track_id)
+                snapshot_id = self.remove_from_playlist(track_id, playlist_id)
+
+            # Remove the track from the local track list
+            playlist_tracks.discard(track_id)
+            self.update_playlist_index(playlist_id, snapshot_id)
 
         return track_id, playlist_id
 
-    def get_local_track_list(self, playlist_id: str) -> set[str]:
-        """ Gets the corresponding local track list based on the given playlist ID. """
-        return self.main_plist_tracks if playlist_id is self.main_playlist_id else self.other_plist_tracks
+    def concurrent_undo_writes(self, track_id: str, playlist_id: str) -> str:
+        """ Removes the track from the library and the playlist concurrently and returns the playlist's new snapshot ID. """
+        try:
+            _, snapshot_id = self.run_concurrent_writes(track_id, [
+                (LIBRARY, lambda: self.unsave_from_library(track_id), lambda: self.save_to_library(track_id)),
+                (PLAYLIST, lambda: self.remove_from_playlist(track_id, playlist_id),
+                 lambda: self.add_to_playlist(track_id, playlist_id))
+            ])
+        except PartialWriteError as err:
+            # The track is still in the playlist, so keep it as the last save to allow retrying the undo
+            if PLAYLIST not in err.succeeded or PLAYLIST in err.rolled_back:
+                self.restore_last_save((track_id, playlist_id))
+            # Otherwise keep the local track list in line with the playlist
+            else:
+                self.get_local_track_list(playlist_id).discard(track_id)
+                self.mark_index_dirty(playlist_id)
+            raise
+
+        return snapshot_id
+
+    def set_last_save(self, last_save: tuple[str, str]):
+        """ Records the given (track_id, playlist_id) as the last save. """
+        with self.last_save_lock:
+            self.last_save = last_save
+
+    def take_last_save(self) -> tuple[str, str]:
+        """ Gets the last save and clears it, so only one undo gets it (None if there's nothing to undo). """
+        with self.last_save_lock:
+            last_save, self.last_save = self.last_save, None
+            return last_save
+
+    def clear_last_save(self, last_save: tuple[str, str]):
+        """ Clears the last save if it's still the given one (a save made since then stays the one to undo). """
+        with self.last_save_lock:
+            if self.last_save == last_save:
+                self.last_save = None
+
+    def restore_last_save(self, last_save: tuple[str, str]):
+        """ Puts back the given save to undo, unless another save was made since it was taken. """
+        with self.last_save_lock:
+            if self.last_save is None:
+                self.last_save = last_save
+
+    def run_concurrent_writes(self, track_id: str, writes: list[tuple]) -> list:
+        """ Runs the given (name, write, rollback) writes concurrently and returns their results in order.
+            Re-raises the error if every write failed, otherwise if only some of them failed, it rolls back
+            the ones that succeeded (if they have a rollback) and raises a PartialWriteError. """
+        futures = [self.write_pool.submit(tracing.bind(write)) for _, write, _ in writes]
+
+        # Wait for every write to finish and sort out the ones that failed
+        results, succeeded, failed = [], [], {}
+        for (name, _, rollback), future in zip(writes, futures):
+            try:
+                results.append(future.result())
+                succeeded.append((name, rollback))
+            except Exception as err:
+                results.append(None)
+                failed[name] = err
+
+        if len(failed) == 0:
+            return results
+        if len(succeeded) == 0:
+            raise next(iter(failed.values()))
+
+        # Roll back the writes that succeeded so the action isn't left half done
+        rolled_back = []
+        for name, rollback in succeeded:
+            if rollback is None:
+                continue
+            try:
+                rollback()
+                rolled_back.append(name)
+            except Exception:
+                pass  # Reported through the PartialWriteError (succeeded but not rolled back)
+
+        raise PartialWriteError(track_id, [name for name, _ in succeeded], failed, rolled_back)
+
+    def save_to_library(self, track_id: str):
+        """ Saves the given track to the user's library (or queues it) and the liked songs mirror. """
+        with tracing.span('library_write'):
+            if self.write_behind is not None:
+                self.write_behind.save_to_library(track_id)
+            else:
+                self.send_or_journal(ADD, track_id, LIBRARY_TARGET, lambda: self.client.add_saved_tracks(track_id))
+            if self.liked_mirror is not None:
+                self.liked_mirror.add(track_id)
+
+    def unsave_from_library(self, track_id: str):
+        """ Removes the given track from the user's library (or queues it) and the liked songs mirror. """
+        with tracing.span('library_write'):
+            if self.write_behind is not None:
+                self.write_behind.unsave_from_library(track_id)
+            else:
+                self.send_or_journal(REMOVE, track_id, LIBRARY_TARGET, lambda: self.client.remove_saved_tracks(track_id))
+            if self.liked_mirror is not None:
+                self.liked_mirror.discard(track_id)
+
+    def add_to_playlist(self, track_id: str, playlist_id: str) -> str:
+        """ Adds the given track to the playlist and returns the playlist's new snapshot ID (None if the
+            write was queued or journaled, the snapshot ID is then handled once it's sent). """
+        with tracing.span('playlist_write'):
+            if self.write_behind is not None:
+                self.write_behind.add_to_playlist(track_id, playlist_id)
+                return None
+            return self.send_or_journal(ADD, track_id, playlist_id,
+                                        lambda: self.client.add_track_to_playlist(track_id, playlist_id))
+
+    def remove_from_playlist(self, track_id: str, playlist_id: str) -> str:
+        """ Removes the given track from the playlist and returns the playlist's new snapshot ID (None if the
+            write was queued or journaled, the snapshot ID is then handled once it's sent). """
+        with tracing.span('playlist_write'):
+            if self.write_behind is not None:
+                self.write_behind.remove_from_playlist(track_id, playlist_id)
+                return None
+            return self.send_or_journal(REMOVE, track_id, playlist_id,
+                                        lambda: self.client.remove_track_from_playlist(track_id, playlist_id))
+
+    def send_or_journal(self, operation: str, track_id: str, target: str, write_func):
+        """ Sends the given write to Spotify and returns its result, or journals it
+            and returns None if Spotify can't be reached (when the journal is enabled).
+            While older writes are still journaled, it's journaled behind them, so the replay
+            sends them in order and never undoes a newer press (e.g. an undo of a journaled save). """
+        if self.journal is not None and len(self.journal) > 0:
+            self.journal.append(operation, track_id, target)
+            return None
+        try:
+            return write_func()
+        except Exception as err:
+            if self.journal is None or not is_network_error(err):
+                raise
+            self.journal.append(operation, track_id, target)
+            return None
+
+    def get_local_track_list(self, playlist_id: str) -> PlaylistTracks:
+        """ Gets the corresponding local track list (a set-like view of the membership index) based on the given playlist ID. """
+        return self.membership.view(self.playlist_bits[playlist_id])
+
+    def playlists_containing(self, track_id: str) -> list[str]:
+        """ Gets the IDs of the playlists the given track is in (a single lookup in the membership index). """
+        mask = self.membership.mask(track_id)
+        return [playlist_id for playlist_id, bit in self.playlist_bits.items() if mask & bit != 0]
+
+    def update_playlist_index(self, playlist_id: str, snapshot_id: str):
+        """ Records the snapshot ID one of our own edits got back for the given playlist, and has its local track list
+            persisted in the background, so the next startup can still use the index instead of downloading the playlist.
+            Skipped while writes are pending, otherwise the index would hold tracks that aren't in the playlist yet.
+            The snapshot is only adopted if the local track list matched the previous one, otherwise it may also hold
+            edits made in the app since then, so the index stays dirty (must hold the playlist's lock). """
+        if snapshot_id is None or self.has_pending_writes(playlist_id):
+            return
+        if playlist_id in self.dirty_indexes or playlist_id not in self.plist_snapshots:
+            self.mark_index_dirty(playlist_id)
+            return
+        self.plist_snapshots[playlist_id] = snapshot_id
+        if self.index_writer is not None:
+            self.index_writer.schedule(playlist_id)
+
+    def sync_playlist_index(self, playlist_id: str, snapshot_id: str):
+        """ Records that the local track list of the given playlist was brought up to date with the given snapshot
+            (e.g. by the reconciler), and has it persisted in the background (must hold the playlist's lock). """
+        self.plist_snapshots[playlist_id] = snapshot_id
+        self.dirty_indexes.discard(playlist_id)
+        if self.index_writer is not None:
+            self.index_writer.schedule(playlist_id)
+
+    def mark_index_dirty(self, playlist_id: str):
+        """ Records that the local track list of the given playlist may not match its last known snapshot anymore,
+            which removes its on-disk index (in the background) until it's synced again. """
+        self.dirty_indexes.add(playlist_id)
+        if self.index_writer is not None:
+            self.index_writer.schedule(playlist_id)
+
+    def read_playlist_index(self, playlist_id: str) -> tuple[str, list[str]]:
+        """ Gets the snapshot ID (None if the index is dirty) and the track IDs to write the given playlist's index with,
+            or None if it shouldn't be written while our own writes are pending (called by the index writer). """
+        with self.playlist_locks[playlist_id]:
+            if playlist_id in self.dirty_indexes:
+                return None, None
+            if self.has_pending_writes(playlist_id):
+                return None
+            return self.plist_snapshots.get(playlist_id), list(self.get_local_track_list(playlist_id))
+
+    def on_playlist_flushed(self, playlist_id: str, snapshot_id: str):
+        """ Updates the playlist's index once its queued or journaled writes are sent
+            (skipped for playlists that are no longer in the config). """
+        if playlist_id not in self.playlist_locks:
+            return
+        with self.playlist_locks[playlist_id]:
+            self.update_playlist_index(playlist_id, snapshot_id)
+
+    def on_write_dropped(self, target: str, operation: str, track_id: str):
+        """ Reverts the local state a queued write was acknowledged with once it's dropped (it never reached Spotify),
+            and flashes the error LED since the press didn't take effect after all. """
+        if target is LIBRARY_TARGET and self.liked_mirror is not None:
+            if operation == ADD:
+                self.liked_mirror.discard(track_id)
+            else:
+                self.liked_mirror.add(track_id)
+        elif target is not LIBRARY_TARGET and target in self.playlist_locks:
+            with self.playlist_locks[target]:
+                if operation == ADD:
+                    self.get_local_track_list(target).discard(track_id)
+                else:
+                    self.get_local_track_list(target).add(track_id)
+                self.mark_index_dirty(target)
+        if self.client.notifier is not None:
+            self.client.notifier.trigger_os_error()
+
+    def has_pending_writes(self, playlist_id: str) -> bool:
+        """ Checks whether there are writes for the given playlist that haven't been sent to Spotify yet. """
+        if self.write_behind is not None and self.write_behind.has_pending(playlist_id):
+            return True
+        return self.journal is not None and len(self.journal) > 0
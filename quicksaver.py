@@ -1,39 +1,192 @@
-from quicksave_controller import QuickSaveController, IS_DUPE
+from quicksave_controller import QuickSaveController, PartialWriteError, IS_DUPE
+from spotify_client import is_network_error
+from request_scheduler import is_rate_limited
+from call_guard import PRESS_DEADLINE
 from raspi_listener import RasPiListener
 from raspi_notifier import RasPiNotifier
+from led_animator import QUEUE as LED_QUEUE
+from tracing import TracedNotifier, StartupProfiler, DUMP_FILENAME
+import tracing
 import config_handler as cnfg_handler
-from logger import Logger
+from session_export import SessionExporter, LIKED, UNLIKED, SAVED, DUPLICATE, UNDONE, NO_TRACK, MAX_UNDO, \
+    PARTIAL_WRITE, NETWORK_ERROR, RATE_LIMITED
+from logger import Logger, MAX_BYTES as LOG_MAX_BYTES, BACKUP_COUNT as LOG_BACKUP_COUNT, FLUSH_INTERVAL as LOG_FLUSH_INTERVAL
+from concurrent.futures import ThreadPoolExecutor
 from signal import pause
 from sys import exit
+import threading
 
 # Constants
-from actions import TOGGLE_LIKE, SAVE_MAIN, SAVE_OTHER, UNDO_SAVE, QUIT_APP
-EXPORT_FILENAME = "session_exports"
+from actions import TOGGLE_LIKE, UNDO_SAVE, QUIT_APP, save_action, playlist_key
+EXPORT_FILENAME = "session_exports"  # Directory of the session export files
+STARTUP_WAIT = 60.0  # Max seconds a press waits for the playlists to finish loading after a fast start
+GPIO = "gpio"  # Default io_backend (the physical buttons and LEDs), the simulated one is in sim_io
 
 
 class QuickSaver:
     """ The main central component that connects all the components together that make the app.  """
 
-    def __init__(self):
-
-        config = cnfg_handler.get_config()
+    def __init__(self, spotify_api=None, profiler: StartupProfiler = None):
+        """ Sets up every component, using the given Spotify API client if provided
+            (e.g. pointed at a local fake API for benchmarks), and timing each step
+            with the given startup profiler if provided. """
+        self.profiler = profiler if profiler is not None else StartupProfiler(enabled=False)
+
+        with self.profiler.step('config'):
+            config = cnfg_handler.get_config()
+            options = cnfg_handler.get_options(config)
+
+        # Let the buttons go live right after authenticating, while the playlists load in the background
+        self.fast_start = options.get('fast_start', False)
+        self.startup_wait = options.get('startup_wait', STARTUP_WAIT)
+        self.press_deadline = options.get('press_deadline', PRESS_DEADLINE)  # Used with the circuit breaker
+        self.indexes_ready = threading.Event()  # Set once the playlists (and liked songs) are loaded
+        self.startup_thread = None
+        self.startup_error = None
+
+        # Each playlist in the config gets a save action (SAVE_<NAME> for <name>_playlist, see actions.py)
+        playlist_ids = cnfg_handler.get_playlist_ids(config)
+        self.save_actions = [save_action(config_key) for config_key in playlist_ids]
+        self.playlist_routes = {}   # Save action -> ID of the playlist it saves to (set once validated)
+        self.playlist_actions = {}  # Playlist ID -> save action
+
+        # Use the physical buttons and LEDs, or simulated ones (e.g. to load test the app off the Pi)
+        gpio_pins = cnfg_handler.get_gpio_pin_numbers(config)
+        self.io_backend = options.get('io_backend', GPIO)
+        self.button_source = None
+        self.led_sink = None
+        button_factory, led_factory, sleep_func = None, None, None
+        if self.io_backend != GPIO:
+            from sim_io import SimButtonSource, SimLEDSink, SIM
+            if self.io_backend != SIM:
+                raise ValueError('Unknown io_backend: ' + self.io_backend)
+            self.button_source = SimButtonSource(gpio_pins)
+            self.led_sink = SimLEDSink()
+            button_factory, led_factory, sleep_func = self.button_source.button, self.led_sink.led, self.led_sink.sleep
 
         # Initialize all components of the QuickSaver application
-        self.input_listener = RasPiListener(self.process_input, cnfg_handler.get_gpio_pin_numbers(config))
-        self.notifier = RasPiNotifier(cnfg_handler.get_gpio_pin_numbers(config))
-        self.logger = Logger(cnfg_handler.get_log_filename(config))
-        self.controller = QuickSaveController(self.notifier, self.logger, self.stop_quicksaver)
-
-        # Set the playlist IDs
-        playlist_ids = cnfg_handler.get_playlist_ids(config)
-        self.main_playlist_id = self.valid_playlist_id(playlist_ids['main_playlist'],
-                                                       self.label_from_action(SAVE_MAIN))
-        self.other_playlist_id = self.valid_playlist_id(playlist_ids['other_playlist'],
-                                                       self.label_from_action(SAVE_OTHER))
-        self.controller.set_playlist_info(self.main_playlist_id, self.other_playlist_id)
+        with self.profiler.step('LEDs'):
+            self.notifier = RasPiNotifier(gpio_pins, led_factory, sleep_func, options.get('led_animator', True),
+                                          options.get('led_feedback_policy', LED_QUEUE))
+        with self.profiler.step('logger'):
+            self.logger = Logger(cnfg_handler.get_log_filename(config), options.get('async_logging', False),
+                                 options.get('log_max_bytes', LOG_MAX_BYTES), options.get('log_backup_count', LOG_BACKUP_COUNT),
+                                 options.get('log_flush_interval', LOG_FLUSH_INTERVAL))
+
+        # Optionally export the outcome of every action to a file per session (for listening analytics)
+        self.exporter = None
+        if options.get('session_export', False) is True:
+            self.exporter = SessionExporter(options.get('session_export_dir', EXPORT_FILENAME))
+
+        # Optionally queue button presses and handle them off the GPIO callback thread,
+        # with the LED feedback played on its own thread too (and saves to different playlists at the same time)
+        self.input_pipeline = None
+        button_callback = self.process_input
+        if options.get('input_pipeline', False) is True:
+            from input_pipeline import InputPipeline, AsyncNotifier, QUEUE_SIZE, COALESCE, REPEAT_WINDOW, \
+                WORKERS as INPUT_WORKERS
+            self.notifier = AsyncNotifier(self.notifier)
+            self.input_pipeline = InputPipeline(self.process_input, self.notifier, self.logger,
+                                                options.get('input_queue_size', QUEUE_SIZE),
+                                                options.get('repeat_press_policy', COALESCE),
+                                                options.get('repeat_press_window', REPEAT_WINDOW),
+                                                options.get('input_workers', INPUT_WORKERS), self.save_actions)
+            button_callback = self.input_pipeline.submit
+
+        # Trace how long each stage of every press takes (from the button edge to the LED feedback)
+        tracing.tracer.enabled = options.get('tracing', True)
+        self.trace_filename = options.get('trace_filename', DUMP_FILENAME)
+        self.trace_socket = options.get('trace_socket', None)
+        if tracing.tracer.enabled is True:
+            self.notifier = TracedNotifier(self.notifier, tracing.tracer)
+
+        # Optionally record every press to a trace file (which the simulated buttons can replay)
+        self.press_recorder = None
+        if options.get('record_presses') is not None:
+            from sim_io import PressRecorder
+            self.press_recorder = button_callback = PressRecorder(button_callback, options['record_presses'])
+
+        with self.profiler.step('controller (Spotify auth)'):
+            self.controller = QuickSaveController(self.notifier, self.logger, self.stop_quicksaver, options, spotify_api)
+        with self.profiler.step('buttons'):
+            self.input_listener = RasPiListener(button_callback, gpio_pins, button_factory, self.save_actions)
+        self.profiler.mark('buttons live')
+
+        # Validate and load the playlists (in the background when fast starting, presses wait for them)
+        if self.fast_start is True:
+            self.startup_thread = threading.Thread(target=self.load_indexes_in_background, args=(playlist_ids,),
+                                                   name='StartupLoader', daemon=True)
+            self.startup_thread.start()
+        else:
+            self.load_indexes(playlist_ids)
 
         self.logger.info('Initialized: input listener, controller, notifier, and logger')
 
+    def load_indexes(self, playlist_ids: dict):
+        """ Sets the playlist IDs and loads the local records of the playlists (and the liked songs mirror),
+            then replays the offline journal. When fast starting, the independent steps run at the same time. """
+
+        # Set the playlist IDs (validating them at the same time when fast starting)
+        with self.profiler.step('validate playlists'):
+            def validate(action: str) -> str:
+                return self.valid_playlist_id(playlist_ids[playlist_key(action)], self.label_from_action(action))
+
+            if self.fast_start is True:
+                # (at least one worker, the config may have no playlists)
+                with ThreadPoolExecutor(max_workers=max(1, len(self.save_actions)),
+                                        thread_name_prefix='StartupLoader') as pool:
+                    valid_ids = list(pool.map(validate, self.save_actions))
+            else:
+                valid_ids = [validate(action) for action in self.save_actions]
+            self.playlist_routes = dict(zip(self.save_actions, valid_ids))
+            for action, playlist_id in self.playlist_routes.items():
+                self.playlist_actions.setdefault(playlist_id, action)
+
+        # Load the playlists and the liked songs (at the same time when fast starting)
+        if self.fast_start is True:
+            with ThreadPoolExecutor(max_workers=2, thread_name_prefix='StartupLoader') as pool:
+                futures = [pool.submit(self.load_playlists), pool.submit(self.load_liked_mirror)]
+                for future in futures:
+                    future.result()
+        else:
+            self.load_playlists()
+            self.load_liked_mirror()
+
+        # Replay the journal before any press can change the local records it's checked against
+        with self.profiler.step('offline journal replay'):
+            self.controller.replay_offline_journal()
+        self.indexes_ready.set()
+        self.profiler.mark('playlists ready')
+
+    def load_indexes_in_background(self, playlist_ids: dict):
+        """ Loads the playlists on the startup thread, keeping the error (if any) for start_quicksaver to raise. """
+        try:
+            self.load_indexes(playlist_ids)
+        except Exception as err:
+            self.startup_error = err
+            self.logger.error('Loading the playlists on startup failed: ' + str(err))
+        finally:
+            self.indexes_ready.set()  # Lets the waiting presses fail fast instead of timing out
+
+    def load_playlists(self):
+        """ Loads the local records of the playlists. """
+        with self.profiler.step('load playlists'):
+            self.controller.set_playlists(list(self.playlist_routes.values()), concurrent=self.fast_start)
+
+    def load_liked_mirror(self):
+        """ Loads the liked songs mirror (if it's enabled). """
+        with self.profiler.step('liked songs mirror'):
+            self.controller.build_liked_mirror()
+
+    def wait_for_indexes(self, button_pressed: str) -> bool:
+        """ Waits for the playlists to finish loading (only ever waits right after a fast start),
+            and returns whether they loaded. Flashes the error LED if they didn't. """
+        if self.indexes_ready.wait(self.startup_wait) is True and self.startup_error is None:
+            return True
+        self.log_startup_not_ready(button_pressed)
+        self.notifier.trigger_os_error()
+        return False
+
     def valid_playlist_id(self, plist_id: dict, plist_label: str) -> str:
         """ Checks the given playlist ID and returns a valid playlist ID (creates new playlist if needed). """
 
@@ -54,16 +207,31 @@ class QuickSaver:
 
         return new_plist_id
 
-    def start_quicksaver(self):
-        """ Starts running QuickSaver by starting the Spotify token refresh loop. """
+    def start_quicksaver(self, wait: bool = True):
+        """ Starts running QuickSaver by starting the background tasks, then waits for button presses
+            (unless wait is False, e.g. when presses are scripted by a benchmark). """
+        if self.input_pipeline is not None:
+            self.input_pipeline.start()
+        self.start_trace_dumps()
         self.notifier.trigger_ready_lights()
-        self.logger.info('QuickSaver is ready, starting Spotify access token refresh loop')
+        self.profiler.mark('ready lights')
+
+        # The background tasks need the playlists, so wait for them when fast starting
+        if self.startup_thread is not None:
+            self.startup_thread.join()
+            if self.startup_error is not None:
+                raise self.startup_error
+        with self.profiler.step('background tasks'):
+            self.controller.start_background_tasks()
+        self.logger.info('QuickSaver is ready, Spotify access token refresh loop started')
+
+        if self.profiler.enabled is True:
+            print(self.profiler.report(), flush=True)
 
-        # NOTE: switch between the following lines to wait using signal.pause() vs sleep()
-        # self.controller.start_access_token_refresh_loop()
-        pause()  # Wait for signals from button
+        if wait is True:
+            pause()  # Wait for signals from button
 
-    def stop_quicksaver(self):
+    def stop_quicksaver(self, exit_app: bool = True):
         # NOTE: we can't really trigger this or run it when unplugging, but we'll still keep the code here
         # maybe we can figure out how to trigger this by holding multiple buttons down
 
@@ -71,14 +239,32 @@ class QuickSaver:
         # self.input_listener.stop_listener()
 
         # TODO: figure out what cleanup needs to be done
-        # TODO: stop SpotifyClient token refreshing loop
 
         # add LEDs signal quicksaver stopping
 
+        if self.input_pipeline is not None:
+            self.input_pipeline.stop()
+            self.log_input_pipeline_stats()
+        self.controller.stop_background_tasks()
+        self.log_token_refresher_stats()
+        self.log_playback_poller_stats()
+        self.log_write_behind_stats()
+        self.log_offline_journal_stats()
+        self.log_request_scheduler_stats()
+        self.log_call_guard_stats()
+        self.log_playlist_reconciler_stats()
+        self.stop_trace_dumps()
+        if self.press_recorder is not None:
+            self.press_recorder.close()
         self.log_quitting_app()
         self.notifier.clean_up_leds()
+        self.log_led_animator_stats()
+        if self.exporter is not None:
+            self.exporter.close()
+        self.log_logger_stats()
         self.logger.close()
-        exit()
+        if exit_app is True:
+            exit()
 
     def toggle_like(self) -> tuple[str, bool]:
         """ Toggles the currently playing track's library save (likes/unlikes track). """
@@ -110,7 +296,12 @@ class QuickSaver:
         """ Quick saves currently playing track to given playlist and user library. """
 
         # Quick save currently playing track and save result
-        result = self.controller.quick_save(playlist_id)
+        try:
+            result = self.controller.quick_save(playlist_id)
+        except PartialWriteError as err:
+            self.log_partial_write(self.get_playlist_action(playlist_id), err)
+            self.notifier.trigger_os_error()
+            return None
 
         # Terminate function if there was no track currently playing
         if result is None:
@@ -137,7 +328,12 @@ class QuickSaver:
         """ Undoes last quick save by removing the track from the playlist and user library. """
 
         # Undo last quick saved track and save result
-        result = self.controller.undo_last_save()
+        try:
+            result = self.controller.undo_last_save()
+        except PartialWriteError as err:
+            self.log_partial_write(UNDO_SAVE, err)
+            self.notifier.trigger_os_error()
+            return None
 
         # Terminate function if there was no last save to undo
         if result is None:
@@ -151,29 +347,69 @@ class QuickSaver:
 
         return result
 
-    def process_input(self, button_pressed: str):
-        """ Executes the corresponding action based on the callback received. """
+    def process_input(self, button_pressed: str, edge: float = None):
+        """ Executes the corresponding action based on the callback received
+            (traced from the given button edge, see tracing.edge). """
+        with tracing.trace(button_pressed, edge):
+            try:
+                self.execute_action(button_pressed)
+            except Exception as err:
+                # Spotify is rate limiting the requests for longer than a press waits, keep accepting presses
+                if is_rate_limited(err):
+                    self.log_rate_limited(button_pressed, err)
+                    self.notifier.trigger_os_error()
+                    return
+                # Spotify can't be reached (and the action couldn't be journaled), keep accepting presses
+                if not is_network_error(err):
+                    raise
+                self.log_network_error(button_pressed, err)
+                self.notifier.trigger_os_error()
+
+    def start_trace_dumps(self):
+        """ Lets the press timings be dumped on request: to the trace file on SIGUSR1,
+            and to the trace socket (if one is configured) on every connection. """
+        if tracing.tracer.enabled is False:
+            return
+        tracing.tracer.dump_on_signal(self.trace_filename)
+        if self.trace_socket is not None:
+            tracing.tracer.serve(self.trace_socket)
+
+    def stop_trace_dumps(self):
+        """ Closes the trace socket and dumps the final press timings to the trace file. """
+        if tracing.tracer.enabled is False:
+            return
+        tracing.tracer.stop_serving()
+        tracing.tracer.dump(self.trace_filename)
+
+    def execute_action(self, button_pressed: str):
+        """ Executes the action of the given button. """
+
+        # Wait for the records the action checks against if they're still loading (after a fast start)
+        needs_indexes = button_pressed in self.save_actions or button_pressed is UNDO_SAVE or \
+            (button_pressed is TOGGLE_LIKE and self.controller.liked_mirror is not None)
+        if needs_indexes is True and self.wait_for_indexes(button_pressed) is False:
+            return
 
         # Saves only to user's library (likes track)
         if button_pressed is TOGGLE_LIKE:
             # can either be tuple, or None
-            result = self.toggle_like()#[1]  # Whether track was saved/removed
-        # Quick saves to the main playlist
-        elif button_pressed is SAVE_MAIN:
-            result = self.quick_save(self.main_playlist_id)
-        # Quick saves to the other playlist
-        elif button_pressed is SAVE_OTHER:
-            result = self.quick_save(self.other_playlist_id)
+            with self.controller.client.deadline(self.press_deadline):
+                result = self.toggle_like()#[1]  # Whether track was saved/removed
+        # Quick saves to the playlist of the button (main, other, or any other playlist in the config)
+        elif button_pressed in self.playlist_routes:
+            with self.controller.client.deadline(self.press_deadline):
+                result = self.quick_save(self.playlist_routes[button_pressed])
         # Undoes the last quick save
         elif button_pressed is UNDO_SAVE:
-            result = self.undo_last_save()
+            with self.controller.client.deadline(self.press_deadline):
+                result = self.undo_last_save()
         # Quits the app
         elif button_pressed is QUIT_APP:
             self.stop_quicksaver()
 
     def get_playlist_action(self, playlist_id: str) -> str:
-        """ Gets the corresponding playlist label (Main/Other) based on the given playlist ID. """
-        return SAVE_MAIN if playlist_id is self.main_playlist_id else SAVE_OTHER
+        """ Gets the corresponding save action (e.g. SAVE_MAIN) based on the given playlist ID. """
+        return self.playlist_actions[playlist_id]
 
     def get_playlist_label(self, playlist_id: str) -> str:
         """ Gets the corresponding playlist label (Main/Other) based on the given playlist ID. """
@@ -183,27 +419,110 @@ class QuickSaver:
         """ Gets the label of the given playlist action. """
         return playlist_action[5:]
 
+    def export_outcome(self, action: str, outcome: str, track_id: str = None, playlist_id: str = None):
+        """ Exports the outcome of the action to the session file if session exports are enabled. """
+        if self.exporter is not None:
+            self.exporter.record(action, outcome, track_id, playlist_id)
+
     def log_toggle_like_success(self, track_id: str, like_status: bool):
+        self.export_outcome(TOGGLE_LIKE, LIKED if like_status is True else UNLIKED, track_id)
         like_string = 'SAVED' if like_status is True else 'UNSAVED'
         self.logger.info(f'Successfully toggled like of track <{track_id}> to <{like_string}>')
 
     def log_quicksave_success(self, track_id: str, playlist_id: str):
+        self.export_outcome(self.get_playlist_action(playlist_id), SAVED, track_id, playlist_id)
         playlist_label = self.get_playlist_label(playlist_id)
         self.logger.info(f'Successfully QuickSaved track <{track_id}> to playlist <{playlist_id}> ({playlist_label} playlist)')
 
     def log_undo_success(self, track_id: str, playlist_id: str):
+        self.export_outcome(UNDO_SAVE, UNDONE, track_id, playlist_id)
         playlist_label = self.get_playlist_label(playlist_id)[5:]
         self.logger.info(f'Successfully undid save of track <{track_id}> from playlist <{playlist_id}> ({playlist_label} playlist)')
 
     def log_no_track_playing(self, attempted_action: str):
+        self.export_outcome(attempted_action, NO_TRACK)
         self.logger.info(f'No track is currently playing, the following action was attempted <{attempted_action}>')
 
     def log_duplicate_song_attempt(self, track_id: str, playlist_id: str):
+        self.export_outcome(self.get_playlist_action(playlist_id), DUPLICATE, track_id, playlist_id)
         playlist_label = self.get_playlist_label(playlist_id)[5:]
         self.logger.info(f'Duplicate track attempted to be added, track <{track_id}> to playlist <{playlist_id}> ({playlist_label} playlist)')
 
+    def log_partial_write(self, attempted_action: str, err: PartialWriteError):
+        self.export_outcome(attempted_action, PARTIAL_WRITE, err.track_id)
+        self.logger.error(f'Action <{attempted_action}> was only partially written: {err}')
+
+    def log_network_error(self, attempted_action: str, err: Exception):
+        self.export_outcome(attempted_action, NETWORK_ERROR)
+        self.logger.error(f'Spotify could not be reached, the following action failed <{attempted_action}>: {err}')
+
+    def log_rate_limited(self, attempted_action: str, err: Exception):
+        self.export_outcome(attempted_action, RATE_LIMITED)
+        self.logger.error(f'Spotify is rate limiting the requests, the following action failed <{attempted_action}>: {err}')
+
+    def log_startup_not_ready(self, attempted_action: str):
+        self.export_outcome(attempted_action, NETWORK_ERROR)
+        self.logger.error(f'The playlists were not loaded, the following action failed <{attempted_action}>')
+
     def log_max_undo_attempt(self):
+        self.export_outcome(UNDO_SAVE, MAX_UNDO)
         self.logger.info('Undo last saved track attempted, max undo warning')
 
+    def log_token_refresher_stats(self):
+        if self.controller.client.token_refresher is None:
+            return
+        stats = self.controller.client.token_refresher.stats()
+        self.logger.info('Token refresher stats: ' + ', '.join(f'{key}={value}' for key, value in stats.items()))
+
+    def log_playback_poller_stats(self):
+        if self.controller.playback_poller is None:
+            return
+        stats = self.controller.playback_poller.stats()
+        self.logger.info('Playback poller stats: ' + ', '.join(f'{key}={value}' for key, value in stats.items()))
+
+    def log_write_behind_stats(self):
+        if self.controller.write_behind is None:
+            return
+        stats = self.controller.write_behind.stats()
+        self.logger.info('Write-behind stats: ' + ', '.join(f'{key}={value}' for key, value in stats.items()))
+
+    def log_offline_journal_stats(self):
+        if self.controller.journal is None:
+            return
+        stats = self.controller.journal.stats()
+        self.logger.info('Offline journal stats: ' + ', '.join(f'{key}={value}' for key, value in stats.items()))
+
+    def log_request_scheduler_stats(self):
+        if self.controller.client.scheduler is None:
+            return
+        stats = self.controller.client.scheduler.stats()
+        self.logger.info('Request scheduler stats: ' + ', '.join(f'{key}={value}' for key, value in stats.items()))
+
+    def log_call_guard_stats(self):
+        if self.controller.client.guard is None:
+            return
+        stats = self.controller.client.guard.stats()
+        self.logger.info('Call guard stats: ' + ', '.join(f'{key}={value}' for key, value in stats.items()))
+
+    def log_playlist_reconciler_stats(self):
+        if self.controller.reconciler is None:
+            return
+        stats = self.controller.reconciler.stats()
+        self.logger.info('Playlist reconciler stats: ' + ', '.join(f'{key}={value}' for key, value in stats.items()))
+
+    def log_led_animator_stats(self):
+        if self.notifier.animator is None:
+            return
+        stats = self.notifier.animator.stats()
+        self.logger.info('LED animator stats: ' + ', '.join(f'{key}={value}' for key, value in stats.items()))
+
+    def log_input_pipeline_stats(self):
+        stats = self.input_pipeline.stats()
+        self.logger.info('Input pipeline stats: ' + ', '.join(f'{key}={value}' for key, value in stats.items()))
+
+    def log_logger_stats(self):
+        stats = self.logger.stats()
+        self.logger.info('Logger stats: ' + ', '.join(f'{key}={value}' for key, value in stats.items()))
+
     def log_quitting_app(self):
         self.logger.info('Quitting QuickSaver app')
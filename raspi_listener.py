@@ -1,20 +1,25 @@
-# Raspberry Pi
-from gpiozero import Button
+from functools import partial
+import tracing
 
 # constants
-from actions import TOGGLE_LIKE, SAVE_MAIN, SAVE_OTHER, UNDO_SAVE, QUIT_APP
+from actions import TOGGLE_LIKE, SAVE_MAIN, SAVE_OTHER, UNDO_SAVE, QUIT_APP, button_pin_key
 
 
 class RasPiListener:
 
-    def __init__(self, button_callback, gpio_pins: dict):
+    def __init__(self, button_callback, gpio_pins: dict, button_factory=None, save_actions: list[str] = None):
         self.callback = button_callback
 
+        # Buttons are physical gpiozero buttons unless another backend's factory is given (e.g. simulated ones)
+        if button_factory is None:
+            from gpiozero import Button  # Raspberry Pi (only imported when the physical buttons are used)
+            button_factory = Button
+
         # Initialize buttons
-        self.toggle_like_button = Button(gpio_pins['button_toggle_like'])
-        self.save_main_button = Button(gpio_pins['button_save_main'])
-        self.save_other_button = Button(gpio_pins['button_save_other'])
-        self.undo_save_button = Button(gpio_pins['button_undo_save'])
+        self.toggle_like_button = button_factory(gpio_pins['button_toggle_like'])
+        self.save_main_button = button_factory(gpio_pins['button_save_main'])
+        self.save_other_button = button_factory(gpio_pins['button_save_other'])
+        self.undo_save_button = button_factory(gpio_pins['button_undo_save'])
 
         # Map actions to buttons
         self.toggle_like_button.when_pressed = self.toggle_like
@@ -22,14 +27,26 @@ class RasPiListener:
         self.save_other_button.when_pressed = self.save_other
         self.undo_save_button.when_pressed = self.undo_save
 
+        # Buttons of the playlists besides main and other (the button_save_<name> pins, see actions.py)
+        self.extra_save_buttons = {}
+        for action in save_actions if save_actions is not None else []:
+            if action is SAVE_MAIN or action is SAVE_OTHER:
+                continue
+            self.extra_save_buttons[action] = button_factory(gpio_pins[button_pin_key(action)])
+            self.extra_save_buttons[action].when_pressed = partial(self.press, action)
+
     def toggle_like(self):
-        self.callback(TOGGLE_LIKE)
+        self.press(TOGGLE_LIKE)
 
     def save_main(self):
-        self.callback(SAVE_MAIN)
+        self.press(SAVE_MAIN)
 
     def save_other(self):
-        self.callback(SAVE_OTHER)
+        self.press(SAVE_OTHER)
 
     def undo_save(self):
-        self.callback(UNDO_SAVE)
+        self.press(UNDO_SAVE)
+
+    def press(self, action: str):
+        """ Passes the action to the callback along with the time of the button edge (for tracing). """
+        self.callback(action, tracing.edge())
@@ -1,5 +1,4 @@
-# Raspberry Pi
-from gpiozero import LED
+from led_animator import LEDAnimator, QUEUE, PREEMPT, BLINK_OFF_TIME, flash, blink, wave
 from time import sleep
 
 DURATION = 0.7  # Duration for standard indicators and warnings
@@ -9,35 +8,70 @@ DURATION = 0.7  # Duration for standard indicators and warnings
 class RasPiNotifier:
     """ RasPi notifier class that allows the app to trigger LED responses on the Pi. """
 
-    def __init__(self, gpio_pins: dict):
+    def __init__(self, gpio_pins: dict, led_factory=None, sleep_func=None, animate: bool = False,
+                 feedback_policy: str = QUEUE):
+        # LEDs are physical gpiozero LEDs unless another backend's factory is given (e.g. simulated ones)
+        if led_factory is None:
+            from gpiozero import LED  # Raspberry Pi (only imported when the physical LEDs are used)
+            led_factory = LED
+        self.sleep = sleep_func if sleep_func is not None else sleep  # The simulated backend records the time instead
+
         # Set GPIO pin numbers
-        self.success_led = LED(gpio_pins['led_success'])
-        self.alert_led = LED(gpio_pins['led_alert'])
-        self.error_led = LED(gpio_pins['led_error'])
+        self.success_led = led_factory(gpio_pins['led_success'])
+        self.alert_led = led_factory(gpio_pins['led_alert'])
+        self.error_led = led_factory(gpio_pins['led_error'])
+
+        # Optionally play the LED feedback on a background thread instead of sleeping on the caller's,
+        # with the press feedback waiting for the playing animation or cutting it short
+        if feedback_policy not in (QUEUE, PREEMPT):
+            raise ValueError('Unknown led_feedback_policy: ' + feedback_policy)
+        self.feedback_policy = feedback_policy
+        self.animator = None
+        if animate is True:
+            self.animator = LEDAnimator()
+            self.animator.start()
 
     def clean_up_leds(self):
-        """ Cleans up the LEDs by closing each one. """
+        """ Cleans up the LEDs by closing each one (after the LED feedback that's still playing). """
+        if self.animator is not None:
+            self.animator.stop()
         self.success_led.close()
         self.alert_led.close()
         self.error_led.close()
 
-    def _flash_led(self, flashing_led: LED, duration: float):
+    def _animate(self, timeline: list[tuple], preempt: bool = None):
+        """ Hands the timeline over to the animator, cutting the playing animation short if preempt
+            is True (follows the feedback policy if it's None). """
+        if preempt is None:
+            preempt = self.feedback_policy == PREEMPT
+        self.animator.play(timeline, preempt)
+
+    def _flash_led(self, flashing_led, duration: float):
         """ Flashes the given LED for the specified duration. """
+        if self.animator is not None:
+            self._animate(flash([flashing_led], duration))
+            return
         flashing_led.on()
-        sleep(duration)
+        self.sleep(duration)
         flashing_led.off()
 
-    def _flash_multiple_leds(self, flashing_leds: list[LED], duration: float):
+    def _flash_multiple_leds(self, flashing_leds: list, duration: float):
         """ Flashes the multiple given LEDs simultaneously for the specified duration. """
+        if self.animator is not None:
+            self._animate(flash(flashing_leds, duration))
+            return
         for flash_led in flashing_leds:
             flash_led.on()
-        sleep(duration)
+        self.sleep(duration)
         for flash_led in flashing_leds:
             flash_led.off()
 
-    def _quick_flash_led_repeatedly(self, flashing_led: LED, flash_count: int,
-                                    flash_speed: float = 0.13, background: bool = False):
+    def _quick_flash_led_repeatedly(self, flashing_led, flash_count: int,
+                                    flash_speed: float = 0.13, background: bool = False, preempt: bool = None):
         """ Repeatedly flashes the given LED for the specified number of times. """
+        if self.animator is not None:
+            self._animate(blink([flashing_led], flash_count, flash_speed), preempt)
+            return
         flashing_led.blink(on_time=flash_speed, n=flash_count, background=background)
 
     def trigger_song_unlike_success(self, duration: float = DURATION):
@@ -67,9 +101,14 @@ class RasPiNotifier:
             is currently playing, so no song can be saved. """
         self._quick_flash_led_repeatedly(self.alert_led, 3)
 
+    def trigger_press_rejected_warning(self):
+        """ Flashes the alert LED twice to warn that a button press was
+            dropped because too many presses are waiting to be handled. """
+        self._quick_flash_led_repeatedly(self.alert_led, 2)
+
     def trigger_os_error(self):
         """ Flashes the error LED repeatedly to indicate an OS error was received. """
-        self._quick_flash_led_repeatedly(self.error_led, 4)
+        self._quick_flash_led_repeatedly(self.error_led, 4, preempt=True)
 
     def trigger_unexpected_os_error(self, duration: float = DURATION):
         """ Flashes ____ to indicate an unexpected OS error was received. """
@@ -84,6 +123,10 @@ class RasPiNotifier:
 
         # Flash all the LEDs repeatedly for half the duration
         flash_speed, flash_count = 0.12, 3
+        if self.animator is not None:
+            all_leds = [self.error_led, self.alert_led, self.success_led]
+            self._animate(blink(all_leds, flash_count, flash_speed) + flash(all_leds, 0.7), preempt=True)
+            return
         self.error_led.blink(on_time=flash_speed, n=flash_count)
         self.alert_led.blink(on_time=flash_speed, n=flash_count)
         self.success_led.blink(on_time=flash_speed, n=flash_count, background=False)
@@ -92,7 +135,7 @@ class RasPiNotifier:
         self.error_led.on()
         self.alert_led.on()
         self.success_led.on()
-        sleep(0.7)
+        self.sleep(0.7)
         self.error_led.off()
         self.alert_led.off()
         self.success_led.off()
@@ -100,29 +143,42 @@ class RasPiNotifier:
     def trigger_wifi_connecting_status(self, flash_speed: float = 0.09):
         """ Triggers a single wave animation w/ all LEDs (that can be called repeatedly)
             to indicate that the device is connecting to Wi-Fi. """
+        if self.animator is not None:
+            self._animate(wave([self.success_led, self.alert_led, self.error_led], flash_speed), preempt=False)
+            return
         self.success_led.on()
-        sleep(flash_speed)
+        self.sleep(flash_speed)
         self.alert_led.on()
         self.success_led.off()
-        sleep(flash_speed)
+        self.sleep(flash_speed)
         self.error_led.on()
         self.alert_led.off()
-        sleep(flash_speed)
+        self.sleep(flash_speed)
         self.error_led.off()
 
     def trigger_wifi_connection_failed(self):
         """ Flashes the error LED repeatedly to indicate the Wi-Fi failed to connect. """
-        self._quick_flash_led_repeatedly(self.error_led, 3)
+        self._quick_flash_led_repeatedly(self.error_led, 3, preempt=True)
 
     def trigger_ready_lights(self, blink_count: int = 3, blink_time: float = 0.1):
         """ Triggers a sequence w/ all LEDs to indicate that the app is ready. """
 
+        # Blink the success and error LEDs, each time followed by the alert LED
+        if self.animator is not None:
+            timeline = []
+            for n in range(blink_count):
+                if n > 0:
+                    timeline += flash([], BLINK_OFF_TIME - blink_time)  # The rest of the off time
+                timeline += flash([self.success_led, self.error_led], blink_time) + flash([self.alert_led], blink_time)
+            self._animate(timeline, preempt=False)
+            return
+
         # Initiate blinking of the success and error LEDs
         self.success_led.blink(on_time=blink_time, n=blink_count)
         self.error_led.blink(on_time=blink_time, n=blink_count)
 
        # Wait for the LEDs to blink once, then start blinking the alert LED
-        sleep(blink_time)
+        self.sleep(blink_time)
         self.alert_led.blink(on_time=blink_time, n=blink_count, background=False)
 
         # Turns off all the LEDs once the blink method finishes and unblocks
@@ -0,0 +1,176 @@
+""" Schedules the requests to the Spotify API so they stay within the rate limit, with the presses going first.
+
+Every request takes a token from a token bucket that refills at the current rate. When Spotify answers
+with 429 Too Many Requests, every request waits out its Retry-After, the rate is halved, and the request
+is retried; the rate then creeps back up with every request that gets through. Interactive requests
+(what a press waits on) take their tokens before any background request (syncs, paging, batched writes),
+and the background requests leave a few tokens in the bucket so a press never waits on a token.
+A request can also be given the deadline of its press, and fails with a CallTimeoutError instead of
+waiting (for a token or a Retry-After) past it.
+"""
+from spotipy.exceptions import SpotifyException
+from call_guard import CallTimeoutError
+import threading
+import time
+
+# Priority classes
+INTERACTIVE = 0  # A press is waiting on the request (currently playing, save, undo)
+BACKGROUND = 1   # Nobody is waiting on it right away (playlist paging, syncs, polling, batched writes)
+
+RATE = 10.0  # Max requests per second (the bucket's refill rate)
+BURST = 20  # Max requests sent back to back (the bucket's size)
+MIN_RATE = 0.5  # The rate is never lowered below this many requests per second
+RATE_STEP = 0.5  # Requests per second the rate goes back up by with every request that gets through
+RESERVE = 2  # Tokens the background requests leave in the bucket for the presses
+MAX_RETRIES = 3  # Retries of a rate limited request
+RETRY_AFTER = 1.0  # Seconds to wait when a 429 doesn't say how long
+MAX_WAIT = 10.0  # Max seconds an interactive request waits to be sent before giving up
+
+
+def is_rate_limited(err: Exception) -> bool:
+    """ Checks whether the given error means Spotify rate limited the request. """
+    return isinstance(err, SpotifyException) and err.http_status == 429
+
+
+def retry_after(err: SpotifyException) -> float:
+    """ Gets the seconds the given 429 error asks to wait before retrying. """
+    try:
+        return float(err.headers['Retry-After'])
+    except (KeyError, TypeError, ValueError):
+        return RETRY_AFTER
+
+
+class RequestScheduler:
+    """ Token bucket in front of the API calls that follows the server's rate limit and lets interactive
+        requests go ahead of background ones. Tracks the throttled, deferred, and retried requests. """
+
+    def __init__(self, rate: float = RATE, burst: int = BURST, max_retries: int = MAX_RETRIES,
+                 max_wait: float = MAX_WAIT):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.blocked_until = 0.0  # Monotonic time until which the server asked not to send anything
+
+        self._cond = threading.Condition()
+        self._waiting = {INTERACTIVE: 0, BACKGROUND: 0}  # Requests waiting for a token, per priority
+
+        # Counters for the scheduler stats
+        self.requests = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.deferred = {INTERACTIVE: 0, BACKGROUND: 0}  # Requests that had to wait to be sent
+        self.total_wait = {INTERACTIVE: 0.0, BACKGROUND: 0.0}
+        self.throttled = 0  # 429 responses
+        self.retried = 0
+        self.gave_up = 0  # Interactive requests that would have waited longer than max_wait
+        self.timed_out = 0  # Requests that would have waited past their deadline
+
+    def call(self, priority: int, func, *args, deadline: float = None, **kwargs):
+        """ Sends the request made by calling func with the given arguments once a token is free,
+            retrying it (after the server's Retry-After) while it's rate limited, without waiting
+            past the given deadline (monotonic time, None for no deadline). """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(priority, deadline)
+            try:
+                result = func(*args, **kwargs)
+            except SpotifyException as err:
+                if not is_rate_limited(err):
+                    raise
+                self.on_throttled(retry_after(err))
+                if attempt == self.max_retries:
+                    raise
+                with self._cond:
+                    self.retried += 1
+                continue
+
+            self.on_success()
+            return result
+
+    def acquire(self, priority: int, deadline: float = None):
+        """ Waits until the request of the given priority can be sent and takes its token. Raises a 429
+            SpotifyException if an interactive request would have to wait longer than max_wait,
+            and a CallTimeoutError if the request would have to wait past the given deadline. """
+        with self._cond:
+            started_at = time.monotonic()
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(priority, now)
+                    if wait <= 0:
+                        break
+                    if deadline is not None and now + wait > deadline:
+                        self.timed_out += 1
+                        raise CallTimeoutError(f'The press ran out of time, the request would wait {wait:.1f}s to be sent')
+                    if priority == INTERACTIVE and now + wait - started_at > self.max_wait:
+                        self.gave_up += 1
+                        raise SpotifyException(429, -1, f'Rate limited, the request would wait {wait:.1f}s to be sent')
+                    self._cond.wait(wait)
+            finally:
+                self._waiting[priority] -= 1
+
+            self.tokens -= 1
+            self.requests[priority] += 1
+            waited = time.monotonic() - started_at
+            if waited > 0.001:
+                self.deferred[priority] += 1
+                self.total_wait[priority] += waited
+
+            # Let the waiting background requests check again once the interactive ones are out of the way
+            if priority == INTERACTIVE:
+                self._cond.notify_all()
+
+    def _wait_time(self, priority: int, now: float) -> float:
+        """ Gets the seconds until the request of the given priority can take a token (0 if it can right away),
+            refilling the bucket first (must be called while holding the lock). """
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        # Background requests wait for the interactive ones (which notify them) and leave the reserve alone
+        if priority == BACKGROUND and self._waiting[INTERACTIVE] > 0:
+            return 1 / self.rate
+        needed = 1 if priority == INTERACTIVE else 1 + min(RESERVE, self.burst - 1)
+        return max(0.0, (needed - self.tokens) / self.rate)
+
+    def on_throttled(self, wait: float):
+        """ Holds every request for the given seconds and halves the rate after a 429 response
+            (once per hold, the other requests that were already sent get a 429 for the same reason). """
+        with self._cond:
+            self.throttled += 1
+            now = time.monotonic()
+            if now >= self.blocked_until:
+                self.rate = max(MIN_RATE, self.rate / 2)
+            self.blocked_until = max(self.blocked_until, now + wait)
+            self.tokens = min(self.tokens, 0.0)  # No burst once the hold is over, the server's window is still full
+            self._cond.notify_all()
+
+    def on_success(self):
+        """ Raises the rate back towards the max rate after a request got through. """
+        if self.rate < self.max_rate:
+            with self._cond:
+                self.rate = min(self.max_rate, self.rate + RATE_STEP)
+
+    def stats(self) -> dict:
+        """ Returns the request, throttled, deferred, and retried counters, and the current rate. """
+        with self._cond:
+            return {
+                'interactive': self.requests[INTERACTIVE],
+                'background': self.requests[BACKGROUND],
+                'throttled': self.throttled,
+                'retried': self.retried,
+                'deferred_interactive': self.deferred[INTERACTIVE],
+                'deferred_background': self.deferred[BACKGROUND],
+                'avg_wait_interactive': round(self.total_wait[INTERACTIVE] / self.deferred[INTERACTIVE], 3)
+                if self.deferred[INTERACTIVE] > 0 else None,
+                'avg_wait_background': round(self.total_wait[BACKGROUND] / self.deferred[BACKGROUND], 3)
+                if self.deferred[BACKGROUND] > 0 else None,
+                'gave_up': self.gave_up,
+                'timed_out': self.timed_out,
+                'rate': round(self.rate, 2)
+            }
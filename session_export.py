@@ -0,0 +1,118 @@
+import threading
+import queue
+import json
+import time
+import os
+
+# Outcomes of the actions
+LIKED = "liked"
+UNLIKED = "unliked"
+SAVED = "saved"
+DUPLICATE = "duplicate"
+UNDONE = "undone"
+NO_TRACK = "no_track"
+MAX_UNDO = "max_undo"
+PARTIAL_WRITE = "partial_write"
+NETWORK_ERROR = "network_error"
+RATE_LIMITED = "rate_limited"
+
+FLUSH_INTERVAL = 5.0  # Max seconds a record waits before it's written to the session file
+FLUSH_SIZE = 32  # Number of records that get written at once
+SESSION_PREFIX = "session-"
+SESSION_SUFFIX = ".jsonl"
+STOP = object()  # Queued by close() to tell the writer to stop
+
+
+class SessionExporter:
+    """ Writes the outcome of every action to an append-only file of JSON lines (one file per session),
+        in batches from a background thread so the presses never wait on the SD card.
+
+        Each record is a compact JSON object on its own line:
+        {"t": <unix time>, "action": <action>, "outcome": <outcome>, "track": <track ID>, "playlist": <playlist ID>}
+        (track and playlist are left out when the action didn't have one). """
+
+    def __init__(self, directory: str, flush_interval: float = FLUSH_INTERVAL, flush_size: int = FLUSH_SIZE):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        os.makedirs(directory, exist_ok=True)
+
+        # Each session gets its own file, named after the time it started
+        session_name = time.strftime('%Y%m%d-%H%M%S') + f'-{os.getpid()}'
+        self.filename = os.path.join(directory, SESSION_PREFIX + session_name + SESSION_SUFFIX)
+        self.file = open(self.filename, 'a')
+
+        self.records = 0
+        self.batches = 0
+
+        self._queue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_batches, name='SessionExporter', daemon=True)
+        self._writer.start()
+
+    def record(self, action: str, outcome: str, track_id: str = None, playlist_id: str = None):
+        """ Queues the outcome of an action to be written to the session file. """
+        record = {'t': round(time.time(), 3), 'action': action, 'outcome': outcome}
+        if track_id is not None:
+            record['track'] = track_id
+        if playlist_id is not None:
+            record['playlist'] = playlist_id
+        self._queue.put(record)
+
+    def _write_batches(self):
+        """ Writes the queued records in batches, when enough of them are queued or the oldest one
+            waited for the flush interval, until the exporter is closed. """
+        batch, batch_started, stopping = [], None, False
+        while stopping is False:
+            timeout = None if batch_started is None else max(batch_started + self.flush_interval - time.monotonic(), 0)
+            try:
+                record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                record = None  # Flush interval is up
+
+            stopping = record is STOP
+            if record is not None and stopping is False:
+                batch.append(json.dumps(record, separators=(',', ':')) + '\n')
+                if batch_started is None:
+                    batch_started = time.monotonic()
+
+            # Write once the batch is full, the interval is up, or the exporter is closing
+            if len(batch) > 0 and (record is None or stopping is True or len(batch) >= self.flush_size):
+                self.file.write(''.join(batch))
+                self.file.flush()
+                self.records += len(batch)
+                self.batches += 1
+                batch, batch_started = [], None
+
+    def stats(self) -> dict:
+        """ Returns the number of records and batches written to the session file. """
+        return {'records': self.records, 'batches': self.batches, 'file': self.filename}
+
+    def close(self):
+        """ Writes the records that are still queued, then closes the session file. """
+        if self._writer is not None:
+            self._queue.put(STOP)
+            self._writer.join()
+            self._writer = None
+        self.file.close()
+
+
+def session_files(directory: str) -> list[str]:
+    """ Gets the paths of the session files in the given directory, oldest session first. """
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, filename) for filename in sorted(os.listdir(directory))
+            if filename.startswith(SESSION_PREFIX) and filename.endswith(SESSION_SUFFIX)]
+
+
+def read_records(path: str):
+    """ Yields the records of the given session file, or of every session file in the given directory
+        (oldest first), one line at a time so files are never loaded whole. A line cut short
+        by a crash (the last one of a session) is skipped. """
+    filenames = session_files(path) if os.path.isdir(path) else [path]
+    for filename in filenames:
+        with open(filename, 'r') as session_file:
+            for line in session_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
@@ -0,0 +1,239 @@
+from actions import TOGGLE_LIKE, SAVE_MAIN, SAVE_OTHER, UNDO_SAVE, SAVE_PREFIX, button_pin_key
+import threading
+import random
+import time
+import sys
+
+# Input/output backends
+GPIO = "gpio"  # Physical buttons and LEDs through gpiozero (only on a Pi)
+SIM = "sim"    # Simulated buttons and LEDs (any machine), pressed by a press trace
+
+# Config keys of the button pins, by the action they trigger
+BUTTON_PINS = {
+    TOGGLE_LIKE: 'button_toggle_like',
+    SAVE_MAIN: 'button_save_main',
+    SAVE_OTHER: 'button_save_other',
+    UNDO_SAVE: 'button_undo_save'
+}
+ACTIONS = set(BUTTON_PINS)  # Actions a press trace can have (besides the SAVE_<NAME> of any other playlist)
+
+TRACE_RATE = 1.0  # Default presses per second of the synthetic traces
+DOUBLE_PRESS_GAP = 0.15  # Seconds between the two presses of a double press
+
+
+class SimButton:
+    """ Stands in for a gpiozero Button: pressing it calls its when_pressed callback. """
+
+    def __init__(self, pin: int):
+        self.pin = pin
+        self.when_pressed = None
+
+    def press(self):
+        """ Presses the button (calls when_pressed on the calling thread, like a GPIO edge would on its own). """
+        if self.when_pressed is not None:
+            self.when_pressed()
+
+    def close(self):
+        self.when_pressed = None
+
+
+class SimButtonSource:
+    """ Holds the simulated buttons by pin, so press traces can press them by action. """
+
+    def __init__(self, gpio_pins: dict):
+        self.gpio_pins = gpio_pins
+        self.buttons = {}  # Pin -> SimButton
+
+    def button(self, pin: int) -> SimButton:
+        """ Creates the simulated button of the given pin (used as RasPiListener's button factory). """
+        self.buttons[pin] = SimButton(pin)
+        return self.buttons[pin]
+
+    def press(self, action: str):
+        """ Presses the button mapped to the given action. """
+        self.buttons[self.gpio_pins[button_pin_key(action)]].press()
+
+
+class SimLED:
+    """ Stands in for a gpiozero LED: records what it's told to show on its sink instead of driving a pin. """
+
+    def __init__(self, sink, pin: int):
+        self.sink = sink
+        self.pin = pin
+
+    def on(self):
+        self.sink.record(self.pin, 'on')
+
+    def off(self):
+        self.sink.record(self.pin, 'off')
+
+    def blink(self, on_time: float = 1, off_time: float = 1, n: int = None, background: bool = True):
+        """ Records the blink, and when it isn't in the background, the time the real blink would block for. """
+        self.sink.record(self.pin, f'blink {n}x{on_time}/{off_time}')
+        if background is False and n is not None:
+            self.sink.sleep(n * (on_time + off_time))
+
+    def close(self):
+        self.sink.record(self.pin, 'close')
+
+
+class SimLEDSink:
+    """ Records the LED feedback (what each LED was told to do, and how long the feedback
+        would have kept the caller waiting) instead of lighting LEDs and sleeping. """
+
+    def __init__(self, max_events: int = 1000):
+        self._lock = threading.Lock()
+        self.max_events = max_events  # Only the most recent events are kept (soak runs would grow forever)
+        self.events = []  # (monotonic time, pin, what the LED was told to do)
+        self.event_count = 0
+        self.feedback_time = 0.0  # Seconds the real LEDs would have blocked for in total
+        self.waits = 0            # Number of sleeps/blocking blinks skipped
+
+    def led(self, pin: int) -> SimLED:
+        """ Creates the simulated LED of the given pin (used as RasPiNotifier's LED factory). """
+        return SimLED(self, pin)
+
+    def record(self, pin: int, state: str):
+        with self._lock:
+            self.event_count += 1
+            self.events.append((time.monotonic(), pin, state))
+            if len(self.events) > self.max_events:
+                del self.events[:len(self.events) - self.max_events]
+
+    def sleep(self, seconds: float):
+        """ Records the time the feedback would have blocked for, without sleeping (used as RasPiNotifier's sleep). """
+        with self._lock:
+            self.feedback_time += seconds
+            self.waits += 1
+
+    def stats(self) -> dict:
+        """ Returns the LED event count and the feedback time that was skipped. """
+        with self._lock:
+            return {
+                'led_events': self.event_count,
+                'waits': self.waits,
+                'feedback_time': round(self.feedback_time, 3)
+            }
+
+
+class PressTraceReplayer:
+    """ Presses the simulated buttons by following a press trace, a list of (seconds from the start, action),
+        on a background thread. The speed scales the trace (2.0 plays it twice as fast). """
+
+    def __init__(self, source: SimButtonSource, trace: list[tuple[float, str]], speed: float = 1.0):
+        self.source = source
+        self.trace = trace
+        self.speed = speed
+        self.pressed = 0
+        self.late = 0.0  # Total seconds the presses went out behind the trace (a slow press holds up the next)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """ Starts replaying the trace in the background. """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='PressTraceReplayer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stops replaying the trace and waits for the background thread to exit. """
+        self._stop_event.set()
+        self.wait()
+
+    def wait(self, timeout: float = None) -> bool:
+        """ Waits for the trace to finish replaying (up to timeout seconds) and returns whether it finished. """
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                return False
+            self._thread = None
+        return True
+
+    def _run(self):
+        """ Presses every button of the trace at its time, until the trace ends or it's stopped. """
+        started_at = time.monotonic()
+        for offset, action in self.trace:
+            delay = started_at + offset / self.speed - time.monotonic()
+            if self._stop_event.wait(max(delay, 0)):
+                return
+            self.late += max(-delay, 0)
+            self.source.press(action)
+            self.pressed += 1
+
+
+def load_press_trace(filename: str) -> list[tuple[float, str]]:
+    """ Reads a press trace file: one `<seconds from the start> <ACTION>` line per press, `#` starts a comment. """
+    trace = []
+    with open(filename, 'r') as trace_file:
+        for line in trace_file:
+            line = line.split('#')[0].strip()
+            if line == '':
+                continue
+            offset, action = line.split()
+            # Any SAVE_<NAME> action is valid (the playlists come from the config), interned like the constants
+            if action not in ACTIONS and not action.startswith(SAVE_PREFIX):
+                raise ValueError('Unknown action in the press trace: ' + action)
+            trace.append((float(offset), sys.intern(action)))
+    return sorted(trace)
+
+
+class PressRecorder:
+    """ Wraps a button callback so every press is written to a press trace file (to replay it later). """
+
+    def __init__(self, callback, filename: str):
+        self.callback = callback
+        self.started_at = time.monotonic()
+        self.file = open(filename, 'w')
+        self.file.write(f'# Recorded {time.strftime("%Y-%m-%d %H:%M:%S")}\n')
+
+    def __call__(self, action: str, edge: float = None):
+        self.file.write(f'{time.monotonic() - self.started_at:.3f} {action}\n')
+        self.file.flush()
+        self.callback(action, edge)
+
+    def close(self):
+        self.file.close()
+
+
+def steady_trace(count: int, rate: float = TRACE_RATE, actions: list[str] = None, seed: int = 0) -> list[tuple[float, str]]:
+    """ Builds a trace of evenly spaced presses of random actions. """
+    rand = random.Random(seed)
+    actions = actions if actions is not None else list(BUTTON_PINS)
+    return [(n / rate, rand.choice(actions)) for n in range(count)]
+
+
+def burst_trace(bursts: int, burst_size: int, burst_rate: float = 20.0, gap: float = 5.0,
+                actions: list[str] = None, seed: int = 0) -> list[tuple[float, str]]:
+    """ Builds a trace of bursts of rapid presses (burst_rate per second) separated by gap seconds. """
+    rand = random.Random(seed)
+    actions = actions if actions is not None else list(BUTTON_PINS)
+    trace = []
+    for burst in range(bursts):
+        burst_start = burst * (gap + burst_size / burst_rate)
+        trace.extend((burst_start + n / burst_rate, rand.choice(actions)) for n in range(burst_size))
+    return trace
+
+
+def double_press_trace(count: int, rate: float = TRACE_RATE, gap: float = DOUBLE_PRESS_GAP,
+                       actions: list[str] = None, seed: int = 0) -> list[tuple[float, str]]:
+    """ Builds a trace of double presses (the same button twice, gap seconds apart). """
+    rand = random.Random(seed)
+    actions = actions if actions is not None else list(BUTTON_PINS)
+    trace = []
+    for n in range(count):
+        action = rand.choice(actions)
+        trace.extend([(n / rate, action), (n / rate + gap, action)])
+    return trace
+
+
+def soak_trace(duration: float, rate: float = TRACE_RATE, actions: list[str] = None,
+               seed: int = 0) -> list[tuple[float, str]]:
+    """ Builds a trace of random presses for the given number of seconds, with
+        exponentially distributed gaps (an average of rate presses per second). """
+    rand = random.Random(seed)
+    actions = actions if actions is not None else list(BUTTON_PINS)
+    trace, offset = [], rand.expovariate(rate)
+    while offset < duration:
+        trace.append((offset, rand.choice(actions)))
+        offset += rand.expovariate(rate)
+    return trace
@@ -1,7 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import requests
 import spotipy
-from spotipy.oauth2 import SpotifyOAuth
 from spotipy.exceptions import SpotifyException
+from token_refresher import RefreshingSpotifyOAuth, TokenRefresher, REFRESH_LEAD
+from page_stream import PageStream, CHUNK_SIZE
+from request_scheduler import RequestScheduler, INTERACTIVE, BACKGROUND, RATE as REQUEST_RATE, BURST as REQUEST_BURST
+from http_session import build_session, ping, KeepWarm, POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT, KEEP_WARM_INTERVAL, \
+    RETRIES
+from call_guard import CallGuard, CircuitBreaker, FAILURES as BREAKER_FAILURES, RESET_TIMEOUT as BREAKER_RESET_TIMEOUT
 import config_handler as config
+import tracing
 
 SCOPES = [
     "user-read-playback-state",     # Get current playback
@@ -13,19 +22,79 @@ SCOPES = [
     "playlist-modify-private"       # Add/remove user playlist tracks
 ]
 
+PAGE_LIMIT = 100  # Max number of items the API returns per playlist tracks page
+LOADER_WORKERS = 4  # Default number of concurrent page requests when loading a playlist
+TRACK_ID_FIELDS = 'items(track(id))'  # Only ask the API for the track IDs of each playlist item
+ADDED_AT_FIELDS = 'items(added_at,track(id))'  # The track IDs and when each playlist item was added
+SAVED_TRACKS_LIMIT = 50  # Max number of items the API returns per saved tracks page
+NETWORK_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+# Timeouts of the Spotipy calls a press waits on (connect, read seconds), the other calls use the HTTP timeouts
+CALL_TIMEOUTS = {
+    'current_user_playing_track': (1.0, 2.0),
+    'current_user_saved_tracks_contains': (1.0, 2.0),
+    'current_user_saved_tracks_add': (1.0, 3.0),
+    'current_user_saved_tracks_delete': (1.0, 3.0),
+    'playlist_add_items': (1.0, 3.0),
+    'playlist_remove_all_occurrences_of_items': (1.0, 3.0)
+}
+# Spotipy calls that only read, so they can be retried when they don't reach Spotify
+READ_CALLS = ('me', 'current_playback', 'current_user_playing_track', 'current_user_saved_tracks_contains',
+              'current_user_saved_tracks', 'playlist', 'playlist_tracks', 'playlist_items', 'next', 'open_stream')
+
+
+def is_network_error(err: Exception) -> bool:
+    """ Checks whether the given error means Spotify couldn't be reached, rather than it rejecting the request. """
+    if isinstance(err, NETWORK_ERRORS):
+        return True
+    return isinstance(err, SpotifyException) and err.http_status is not None and err.http_status >= 500
+
 
 class SpotifyClient:
     """ Wrapper for the Spotipy library that simplifies interaction with the Spotify API. """
 
-    def __init__(self, notifier, logger, teardown_func):
+    def __init__(self, notifier, logger, teardown_func, spotify_api: spotipy.Spotify = None, options: dict = None):
         self.notifier = notifier
         self.logger = logger
         self.teardown = teardown_func  # Teardown function from QuickSaver
-
-        # Initialize the Spotify auth manager and create the Spotify API client
-        self._load_api_creds()
-        self.auth_manager = self._init_spotify_auth_manager()
-        self.sp = spotipy.Spotify(auth_manager=self.auth_manager)
+        self.token_refresher = None
+        self.keep_warm = None
+
+        # Optionally pace the API calls to stay within the rate limit, with the presses going first
+        # (the scheduler then retries the rate limited calls instead of the session)
+        options = options if options is not None else {}
+        self.scheduler = None
+        if options.get('request_scheduler', False) is True:
+            self.scheduler = RequestScheduler(options.get('request_rate', REQUEST_RATE),
+                                              options.get('request_burst', REQUEST_BURST))
+
+        self.timeout = (options.get('http_connect_timeout', CONNECT_TIMEOUT),
+                        options.get('http_read_timeout', READ_TIMEOUT))
+
+        # Optionally bound the time each call can take, and stop calling Spotify for a while when it can't be reached
+        # (the guard then retries the reads that failed instead of the session retrying every call)
+        self.guard = None
+        if options.get('circuit_breaker', False) is True:
+            breaker = CircuitBreaker(options.get('breaker_failures', BREAKER_FAILURES),
+                                     options.get('breaker_reset_timeout', BREAKER_RESET_TIMEOUT))
+            self.guard = CallGuard(is_network_error, CALL_TIMEOUTS, self.timeout, READ_CALLS, breaker)
+
+        # Build the connection pool shared by every API call (including concurrent ones)
+        self.session = build_session(options.get('http_pool_size', POOL_SIZE), 0 if self.guard is not None else RETRIES,
+                                     retry_rate_limited=self.scheduler is None)
+
+        # Use the given Spotify API client if provided (e.g. pointed at a local fake API for benchmarks)
+        if spotify_api is not None:
+            self.auth_manager = None
+            self.sp = spotify_api
+        # Otherwise initialize the Spotify auth manager and create the Spotify API client
+        else:
+            self._load_api_creds()
+            self.auth_manager = self._init_spotify_auth_manager()
+            self.sp = spotipy.Spotify(auth_manager=self.auth_manager, requests_session=self.session,
+                                      requests_timeout=self.timeout)
+
+        # Getting the user ID also opens the first pooled connection to the API
         self.user_id = self.current_user_id()
 
     def _load_api_creds(self):
@@ -36,114 +105,74 @@ class SpotifyClient:
         self.redirect_uri = config_file['redirect_uri']
 
     def _init_spotify_auth_manager(self):
-        """ Initializes Spotify's OAuth authorization manager. """
-        return SpotifyOAuth(
+        """ Initializes Spotify's OAuth authorization manager (which can be refreshed in the background). """
+        return RefreshingSpotifyOAuth(
             client_id=self.client_id,
             client_secret=self.client_secret,
             redirect_uri=self.redirect_uri,
             scope=SCOPES,
-            open_browser=False
+            open_browser=False,
+            requests_session=self.session,
+            requests_timeout=self.timeout
         )
 
     """ Auth Token Handling
     SpotifyOAuth._get_auth_response_interactive
     """
 
-    # !!! ===v TODO: v=== !!!
-    # def _except_error(self, try_func):
-    #     """ Tries to run the given the function while catching errors. """
-    #     try:
-    #         return try_func()
-    #     # TODO: see what needs to be changed for regular python
-    #     # only thing to consider would be FileNotFoundError
-    #     except OSError as e:
-    #         self.logger.error(f'error received [{errno.errorcode[e.errno]}] handling accordingly...')
-    #         self._handle_os_error(e)
-
-    # def _handle_error(self, e: OSError):
-    #     """ Handles errors that were safely caught. """
-
-    #     # Build log string and get notifier method (handle unexpected errors differently)
-    #     errorcode = errno.errorcode[e.errno] if e.errno in errno.errorcode else e.errno
-    #     log_string = f'received [{errorcode}]'
-    #     notify_error = self.notifier.trigger_os_error
-
-    #     # Unexpected error
-    #     if e.errno not in [errno.ENOENT, errno.ENOMEM]:
-    #         notify_error = self.notifier.trigger_unexpected_os_error
-    #         log_string += ' <unexpected>'
-
-    #         # Add args to output if they exist
-    #         if len(e.args) > 1:
-    #             log_string += ' args: ' + ', '.join(e.args[1:])
-
-    #     # File not found error
-    #     elif e.errno == errno.ENOENT:
-    #         log_string += f' {e.args[1]} {e.args[2]}'
-    #     # Cannot allocate memory
-    #     elif e.errno == errno.ENOMEM:
-    #         log_string += ' <Cannot allocate memory> args: ' + ', '.join(e.args[1:])
-
-    #     # Log and notify error, then teardown and exit program
-    #     self.logger.error(log_string)
-    #     notify_error()
-    #     self.teardown()  # Cleans up LEDs, closes the logger, and exits the program
-
-    # !! REFRESH LOOP !!
-    # def start_access_token_refresh_loop(self):
-    #     # TODO: look into how spotipy handles refreshing
-    #     # je pense qu'il rafraîchit si tu fais une requête mais les jetons ont expiré
-    #     # TODO: still have a refresh loop that will refresh every 20 minutes so that the tokens are always fresh.
-    #     # Something we can also do is make the refresh directly after a user's input (wait 5 secs, incase e.g. they need to undo),
-    #     # this makes sure we do it at a time when they won't likely need the device
-    #     """ Starts a loop that refreshes the Spotify access tokens
-    #         every 20 minutes and retries upon failures. """
-
-    #     last_refresh_time = time.time()
-
-    #     while True:
-    #         # Deal with memory (code from vergogh)
-    #         # gc.collect()
-    #         # gc.threshold(gc.mem_free() // 4 + gc.mem_alloc())
-
-    #         curr_time = time.time()
-
-    #         # Refresh tokens every 20 minutes
-    #         if curr_time - last_refresh_time >= REFRESH_INTERVAL:
-    #             # Retry every 10 minutes if the access tokens fails to refresh
-    #             if self._refresh_access_token() is False:
-    #                 curr_time = self.start_retry_token_refresh_loop(curr_time)
-    #             last_refresh_time = curr_time
-
-    #         # Sleep to reduce CPU usage
-    #         time.sleep(60)
-
-    # def start_retry_token_refresh_loop(self, failed_refresh_time: int) -> int:
-    #     """ Starts a loop that retries to refresh the Spotify access tokens every 10 minutes
-    #         until it is successful, and returns the time of the successful refresh. """
-    #     last_refresh_time = failed_refresh_time
-
-    #     while True:
-    #         curr_time = time.time()
-
-    #         # Retry to refresh tokens every 10 minutes
-    #         if curr_time - last_refresh_time >= RETRY_INTERVAL:
-    #             # Return the time of the token refresh if it's successful
-    #             if self._refresh_access_token() is True:
-    #                 return curr_time
-    #             last_refresh_time = curr_time
-
-    #         # Sleep to reduce CPU usage
-    #         time.sleep(60)
-    # !!! ===^ TODO: ^=== !!!
+    def start_access_token_refresh_loop(self, lead: float = REFRESH_LEAD):
+        """ Starts refreshing the Spotify access token in the background ahead of its expiry. """
+        if self.auth_manager is None:
+            return  # Using a given Spotify API client, its auth is handled elsewhere
+        self.token_refresher = TokenRefresher(self.auth_manager, self.logger, lead)
+        self.token_refresher.start()
+
+    def stop_access_token_refresh_loop(self):
+        """ Stops the background access token refresher. """
+        if self.token_refresher is not None:
+            self.token_refresher.stop()
+
+    def start_keep_warm(self, is_active_func, interval: float = KEEP_WARM_INTERVAL):
+        """ Starts pinging the API in the background to keep a pooled connection open while is_active_func() is True. """
+        self.keep_warm = KeepWarm(self.session, self.logger, is_active_func, interval, self.sp.prefix)
+        self.keep_warm.start()
+
+    def stop_keep_warm(self):
+        """ Stops the background keep-warm pings. """
+        if self.keep_warm is not None:
+            self.keep_warm.stop()
+
+    def warm_up(self):
+        """ Opens a pooled connection to the API ahead of the next call. """
+        ping(self.session, self.sp.prefix, self.timeout)
+
+    def _request(self, priority: int, api_func, *args, **kwargs):
+        """ Calls the given Spotipy function with the given arguments, through the request scheduler
+            with the given priority (INTERACTIVE or BACKGROUND) and the call guard if they're enabled.
+            The scheduler waits within the press's deadline, so the guard gets what's left of it for the call. """
+        def send():
+            if self.guard is None:
+                return api_func(*args, **kwargs)
+            return self.guard.call(api_func.__name__, lambda: api_func(*args, **kwargs))
+
+        if self.scheduler is None:
+            return send()
+        deadline = self.guard.deadline_at() if self.guard is not None else None
+        return self.scheduler.call(priority, send, deadline=deadline)
+
+    def deadline(self, seconds: float):
+        """ Makes the calls in the with block (on this thread) fit in the given seconds if the call guard is enabled. """
+        if self.guard is None:
+            return nullcontext()
+        return self.guard.deadline(seconds)
 
     def current_user_id(self) -> str:
         """ Gets the current user's ID. """
-        return self.sp.me()['id']
+        return self._request(INTERACTIVE, self.sp.me)['id']
 
     def current_playback(self) -> bool:
         """ Gets information about the user's current playback. """
-        return self.sp.current_playback()
+        return self._request(INTERACTIVE, self.sp.current_playback)
 
     def is_playback_active(self) -> bool:
         """ Checks whether the user has an active playback session.  """
@@ -151,26 +180,45 @@ class SpotifyClient:
 
     def currently_playing_track(self) -> str:
         """ Gets the currently playing track ID (None if there's no active playback session). """
-        response = self.sp.current_user_playing_track()
+        with tracing.span('api.currently_playing'):
+            response = self._request(INTERACTIVE, self.sp.current_user_playing_track)
         return response['item']['id'] if response is not None else None
 
+    def currently_playing_state(self, priority: int = BACKGROUND) -> tuple[str, bool, float]:
+        """ Gets the currently playing track ID, whether it's playing (not paused), and the seconds left
+            in the track (None, False, None if there's no active playback session), sent with the given
+            priority (INTERACTIVE when a press is waiting on it). """
+        response = self._request(priority, self.sp.current_user_playing_track)
+        if response is None or response['item'] is None:
+            return None, False, None
+        remaining = (response['item']['duration_ms'] - (response['progress_ms'] or 0)) / 1000
+        return response['item']['id'], response['is_playing'], remaining
+
     def add_saved_tracks(self, track_id: str):
         """ Adds the given track to the user's Spotify library (saved tracks). """
-        self.sp.current_user_saved_tracks_add([track_id])
+        with tracing.span('api.saved_tracks_add'):
+            self._request(INTERACTIVE, self.sp.current_user_saved_tracks_add, [track_id])
 
     def remove_saved_tracks(self, track_id: str):
         """ Removes the given track from the user's Spotify library (saved tracks). """
-        self.sp.current_user_saved_tracks_delete([track_id])
+        with tracing.span('api.saved_tracks_delete'):
+            self._request(INTERACTIVE, self.sp.current_user_saved_tracks_delete, [track_id])
 
     def contains_saved_tracks(self, track_id: str) -> bool:
         """ Checks whether the given track is saved in the user's Spotify library (saved tracks). """
-        return self.sp.current_user_saved_tracks_contains([track_id])[0]
+        with tracing.span('api.saved_tracks_contains'):
+            return self._request(INTERACTIVE, self.sp.current_user_saved_tracks_contains, [track_id])[0]
+
+    def get_saved_tracks_page(self, offset: int = 0, limit: int = SAVED_TRACKS_LIMIT) -> tuple[list[str], int]:
+        """ Gets a page of the user's saved track IDs (newest first) and the total number of saved tracks. """
+        results = self._request(BACKGROUND, self.sp.current_user_saved_tracks, limit=limit, offset=offset)
+        return [item['track']['id'] for item in results['items'] if item['track']['id'] is not None], results['total']
 
     def get_playlist_owner_id(self, playlist_id: str) -> str:
         """ Gets the owner ID of the given playlist. """
         try:
             # Get playlist info of specified playlist ID
-            return self.sp.playlist(playlist_id, fields='owner(id)')['owner']['id']
+            return self._request(BACKGROUND, self.sp.playlist, playlist_id, fields='owner(id)')['owner']['id']
 
         except SpotifyException as sp_err:
             # Received 404 error, assumed to be due to non-existent playlist
@@ -181,23 +229,61 @@ class SpotifyClient:
                 self.logger.error('Unexpected SpotifyException in client.get_playlist_owner_id: ' + sp_err.__str__())
                 return None
 
-    def add_track_to_playlist(self, track_id: str, playlist_id: str):
-        """ Adds the given track to the specified playlist. """
-        self.sp.playlist_add_items(playlist_id, [track_id])
-
-    def remove_track_from_playlist(self, track_id: str, playlist_id: str):
-        """ Removes the given track from the specified playlist. """
-        self.sp.playlist_remove_all_occurrences_of_items(playlist_id, [track_id])
+    def get_playlist_snapshot_id(self, playlist_id: str) -> str:
+        """ Gets the snapshot ID of the given playlist (changes whenever the playlist is edited). """
+        return self._request(BACKGROUND, self.sp.playlist, playlist_id, fields='snapshot_id')['snapshot_id']
+
+    def get_playlist_state(self, playlist_id: str) -> tuple[str, int]:
+        """ Gets the snapshot ID and the number of items of the given playlist (a single small request). """
+        result = self._request(BACKGROUND, self.sp.playlist, playlist_id, fields='snapshot_id,tracks(total)')
+        return result['snapshot_id'], result['tracks']['total']
+
+    def get_playlist_items_page(self, playlist_id: str, offset: int = 0,
+                                limit: int = PAGE_LIMIT) -> tuple[list[tuple[str, str]], int]:
+        """ Gets a page of the given playlist's items as (track ID, added at) tuples, in playlist order, and the total
+            number of items. The track ID is None for items that aren't tracks (usually local files). """
+        page = self._request(BACKGROUND, self.sp.playlist_items, playlist_id, fields='total,' + ADDED_AT_FIELDS,
+                             limit=limit, offset=offset)
+        return [(item['track']['id'] if item['track'] is not None else None, item['added_at'])
+                for item in page['items']], page['total']
+
+    def add_track_to_playlist(self, track_id: str, playlist_id: str) -> str:
+        """ Adds the given track to the specified playlist and returns the playlist's new snapshot ID. """
+        with tracing.span('api.playlist_add'):
+            return self._request(INTERACTIVE, self.sp.playlist_add_items, playlist_id, [track_id])['snapshot_id']
+
+    def remove_track_from_playlist(self, track_id: str, playlist_id: str) -> str:
+        """ Removes the given track from the specified playlist and returns the playlist's new snapshot ID. """
+        with tracing.span('api.playlist_remove'):
+            return self._request(INTERACTIVE, self.sp.playlist_remove_all_occurrences_of_items,
+                                 playlist_id, [track_id])['snapshot_id']
+
+    def add_saved_tracks_batch(self, track_ids: list[str]):
+        """ Adds the given tracks to the user's Spotify library (up to 50 at once). """
+        self._request(BACKGROUND, self.sp.current_user_saved_tracks_add, track_ids)
+
+    def remove_saved_tracks_batch(self, track_ids: list[str]):
+        """ Removes the given tracks from the user's Spotify library (up to 50 at once). """
+        self._request(BACKGROUND, self.sp.current_user_saved_tracks_delete, track_ids)
+
+    def add_tracks_to_playlist(self, track_ids: list[str], playlist_id: str) -> str:
+        """ Adds the given tracks to the specified playlist (up to 100 at once) and returns the playlist's new snapshot ID. """
+        return self._request(BACKGROUND, self.sp.playlist_add_items, playlist_id, track_ids)['snapshot_id']
+
+    def remove_tracks_from_playlist(self, track_ids: list[str], playlist_id: str) -> str:
+        """ Removes the given tracks from the specified playlist (up to 100 at once) and returns the playlist's new snapshot ID. """
+        return self._request(BACKGROUND, self.sp.playlist_remove_all_occurrences_of_items, playlist_id, track_ids)['snapshot_id']
 
     def create_new_playlist(self, plist_name: str, description: str = None) -> str:
         """ Creates a new Spotify playlist using the provided details. """
-        return self.sp.user_playlist_create(self.user_id, plist_name, description=description)['id']
+        return self._request(INTERACTIVE, self.sp.user_playlist_create, self.user_id, plist_name,
+                             description=description)['id']
 
     def get_playlist_tracks(self, playlist_id: str) -> list[str]:
         """ Gets all the tracks in the given playlist. """
 
         # Make initial call to API
-        results = self.sp.playlist_tracks(playlist_id)
+        results = self._request(BACKGROUND, self.sp.playlist_tracks, playlist_id)
         playlist_tracks = []
 
         # Helper function to extract all track IDs from the current page of results
@@ -209,7 +295,68 @@ class SpotifyClient:
         # Continuously page the API response and extract the track IDs
         nested()
         while results['next']:
-            results = self.sp.next(results)
+            results = self._request(BACKGROUND, self.sp.next, results)
             nested()
 
         return playlist_tracks
+
+    def stream_playlist_tracks(self, playlist_id: str):
+        """ Yields the track IDs of the given playlist while its pages are downloaded, parsing each page
+            as it arrives so only one item at a time is ever built (instead of whole pages of dicts). """
+        url = f'{self.sp.prefix}playlists/{playlist_id}/items'
+        params = {'fields': 'next,' + TRACK_ID_FIELDS, 'limit': PAGE_LIMIT}
+
+        # Page through the playlist with the same session and authorization Spotipy uses for its own calls
+        while url:
+            with tracing.span('api.playlist_page'):
+                page = PageStream(self.stream_response(url, params))
+                for item in page:
+                    if item.get('track') is not None and item['track'].get('id') is not None:
+                        yield item['track']['id']
+            url, params = page.fields.get('next'), None  # The next URL already holds the parameters
+
+    def stream_response(self, url: str, params: dict = None):
+        """ Sends a GET request to the API and yields the body in chunks as it arrives,
+            raising a SpotifyException for error responses (like Spotipy's own calls). """
+        with self._request(BACKGROUND, self.open_stream, url, params) as response:
+            yield from response.iter_content(CHUNK_SIZE)
+
+    def open_stream(self, url: str, params: dict = None) -> requests.Response:
+        """ Sends a GET request to the API and returns the response once its headers arrived (the body is read
+            as it's iterated), raising a SpotifyException for error responses (like Spotipy's own calls). """
+        try:
+            response = self.sp._session.get(url, params=params, headers=self.sp._auth_headers(), stream=True,
+                                            timeout=self.sp.requests_timeout)
+            response.raise_for_status()
+            return response
+
+        except requests.exceptions.HTTPError as http_error:
+            http_error.response.close()
+            raise SpotifyException(http_error.response.status_code, -1, f'{http_error.response.url}:\n {http_error}',
+                                   headers=http_error.response.headers)
+        except requests.exceptions.RetryError:
+            raise SpotifyException(429, -1, f'{url}:\n Max Retries')
+
+    def get_playlist_tracks_parallel(self, playlist_id: str, max_workers: int = LOADER_WORKERS) -> list[str]:
+        """ Gets all the tracks in the given playlist, fetching the remaining pages concurrently
+            by offset once the first page reveals the playlist's total size. """
+
+        # Make initial call to API, which also tells us how many pages are left
+        first_page = self._request(BACKGROUND, self.sp.playlist_items, playlist_id, fields='total,' + TRACK_ID_FIELDS,
+                                   limit=PAGE_LIMIT)
+        offsets = range(PAGE_LIMIT, first_page['total'], PAGE_LIMIT)
+
+        # Helper function to fetch the page of results starting at the given offset
+        def fetch_page(offset: int) -> dict:
+            return self._request(BACKGROUND, self.sp.playlist_items, playlist_id, fields=TRACK_ID_FIELDS,
+                                 limit=PAGE_LIMIT, offset=offset)
+
+        # Fetch the remaining pages from a bounded pool of workers (map keeps the pages in order)
+        pages = [first_page]
+        if len(offsets) > 0:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(offsets))) as pool:
+                pages.extend(pool.map(fetch_page, offsets))
+
+        # Extract all track IDs from the pages, avoiding removed tracks and null IDs (usually local files)
+        return [item['track']['id'] for page in pages for item in page['items']
+                if item['track'] is not None and item['track']['id'] is not None]
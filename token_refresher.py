@@ -0,0 +1,131 @@
+from spotipy.oauth2 import SpotifyOAuth
+from collections import deque
+import threading
+import time
+
+REFRESH_LEAD = 300  # Seconds before the access token expires that it gets refreshed
+RETRY_DELAY = 5  # Seconds before the first retry of a failed refresh (doubles every failure)
+MAX_RETRY_DELAY = 300  # Longest wait between retries of a failed refresh
+STATS_WINDOW = 50  # Number of recent refreshes kept for the stats
+
+
+class RefreshingSpotifyOAuth(SpotifyOAuth):
+    """ Spotify OAuth manager that can be refreshed ahead of time from a background thread.
+        Token reads and refreshes share a lock, and every refresh is timed and recorded along
+        with whether a request had to wait on it (refreshed outside of the background thread). """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.token_lock = threading.RLock()
+        self.refresher_thread = None  # Thread of the background refresher, set once it starts
+
+        # Recent refreshes as (duration, waited_on) tuples, and the overall counters
+        self.refreshes = deque(maxlen=STATS_WINDOW)
+        self.refresh_count = 0
+        self.waited_refresh_count = 0
+        self.lock_waits = deque(maxlen=STATS_WINDOW)  # Recent times a request blocked on the lock (seconds)
+
+    def get_access_token(self, *args, **kwargs):
+        """ Gets the access token, refreshing it first if it expired (requests wait on this).
+            Blocking on the lock while the background refresher refreshes also counts as waiting on that refresh. """
+        if not self.token_lock.acquire(blocking=False):
+            start = time.perf_counter()
+            refresh_count = self.refresh_count
+            self.token_lock.acquire()
+            self.lock_waits.append(time.perf_counter() - start)
+            # A refresh finished while blocked, count it once no matter how many requests waited on it
+            if self.refresh_count != refresh_count and self.refreshes[-1][1] is False:
+                self.refreshes[-1] = (self.refreshes[-1][0], True)
+                self.waited_refresh_count += 1
+        try:
+            return super().get_access_token(*args, **kwargs)
+        finally:
+            self.token_lock.release()
+
+    def refresh_access_token(self, refresh_token: str) -> dict:
+        """ Refreshes the access token, swapping it in the cache under the lock, and records how long it took. """
+        with self.token_lock:
+            start = time.perf_counter()
+            token_info = super().refresh_access_token(refresh_token)
+            duration = time.perf_counter() - start
+
+            # Any refresh that doesn't come from the background refresher held up a request
+            waited_on = threading.current_thread() is not self.refresher_thread
+            self.refreshes.append((duration, waited_on))
+            self.refresh_count += 1
+            if waited_on is True:
+                self.waited_refresh_count += 1
+
+            return token_info
+
+
+class TokenRefresher:
+    """ Background refresher that renews the Spotify access token ahead of its expiry,
+        so no button press has to wait on a refresh. """
+
+    def __init__(self, auth_manager: RefreshingSpotifyOAuth, logger, lead: float = REFRESH_LEAD):
+        self.auth_manager = auth_manager
+        self.logger = logger
+        self.lead = lead
+        self.failures = 0
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """ Starts refreshing the token in the background. """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='TokenRefresher', daemon=True)
+        self.auth_manager.refresher_thread = self._thread
+        self._thread.start()
+
+    def stop(self):
+        """ Stops refreshing and waits for the background thread to exit. """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def seconds_until_refresh(self) -> float:
+        """ Gets the number of seconds until the cached token should be refreshed. """
+        token_info = self.auth_manager.cache_handler.get_cached_token()
+        if token_info is None:
+            return 0
+        return max(token_info['expires_at'] - self.lead - time.time(), 0)
+
+    def refresh(self):
+        """ Refreshes the access token right away. """
+        with self.auth_manager.token_lock:
+            token_info = self.auth_manager.cache_handler.get_cached_token()
+            self.auth_manager.refresh_access_token(token_info['refresh_token'])
+
+    def _run(self):
+        """ Sleeps until the token is due (waking early only to stop), refreshes it, and retries with backoff. """
+        retry_delay = RETRY_DELAY
+
+        while not self._stop_event.wait(self.seconds_until_refresh()):
+            try:
+                self.refresh()
+                retry_delay = RETRY_DELAY
+            except Exception as err:
+                self.failures += 1
+                self.logger.error(f'Access token refresh failed, retrying in {retry_delay}s: ' + str(err))
+                if self._stop_event.wait(retry_delay):
+                    break
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+
+    def stats(self) -> dict:
+        """ Returns how long the recent refreshes took and how many of them a request waited on. """
+        with self.auth_manager.token_lock:
+            durations = [duration for duration, _ in self.auth_manager.refreshes]
+            lock_waits = self.auth_manager.lock_waits
+            return {
+                'refreshes': self.auth_manager.refresh_count,
+                'waited_on': self.auth_manager.waited_refresh_count,
+                'failures': self.failures,
+                'avg_duration': sum(durations) / len(durations) if len(durations) > 0 else None,
+                'max_duration': max(durations) if len(durations) > 0 else None,
+                'lock_waits': len(lock_waits),
+                'max_lock_wait': max(lock_waits) if len(lock_waits) > 0 else None,
+                'seconds_until_refresh': self.seconds_until_refresh()
+            }
@@ -0,0 +1,315 @@
+from collections import deque
+import threading
+import socket
+import signal
+import json
+import time
+import os
+
+ROLLING_WINDOW = 512  # Number of recent timings kept per action stage (percentiles are over these)
+DUMP_FILENAME = "trace_stats.json"
+HISTOGRAM_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)  # Upper bounds (ms) of the histogram buckets
+PERCENTILES = (50, 90, 99)
+QUEUED = "queued"  # Stage from the button edge to the action starting (GPIO callback + input queue)
+TOTAL = "total"    # Stage from the button edge to the action finishing
+
+
+class _NullSpan:
+    """ Span used when no action is being traced on the current thread (does nothing). """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """ The stage timings of a single action. """
+
+    __slots__ = ('action', 'started_at', 'stages')
+
+    def __init__(self, action: str, started_at: float):
+        self.action = action
+        self.started_at = started_at  # perf_counter() time of the button edge
+        self.stages = []  # (stage, seconds) tuples, appended from any thread working on the action
+
+    def record(self, stage: str, seconds: float):
+        self.stages.append((stage, seconds))
+
+
+class Span:
+    """ Times a stage of the traced action while the with block runs. """
+
+    __slots__ = ('trace', 'stage', 'started_at')
+
+    def __init__(self, trace: Trace, stage: str):
+        self.trace = trace
+        self.stage = stage
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.record(self.stage, time.perf_counter() - self.started_at)
+        return False
+
+
+class BoundTrace:
+    """ Makes the given trace the current one of the thread while the with block runs,
+        without finishing it (the thread that started the trace does that). """
+
+    __slots__ = ('tracer', 'trace', 'previous')
+
+    def __init__(self, tracer, trace: Trace):
+        self.tracer = tracer
+        self.trace = trace
+
+    def __enter__(self):
+        self.previous = getattr(self.tracer._local, 'trace', None)
+        self.tracer._local.trace = self.trace
+        return self.trace
+
+    def __exit__(self, *exc_info):
+        self.tracer._local.trace = self.previous
+        return False
+
+
+class TraceScope(BoundTrace):
+    """ Makes the given trace the current one of the thread while the with block runs,
+        and hands it to the tracer once the action is done. """
+
+    __slots__ = ()
+
+    def __exit__(self, *exc_info):
+        self.tracer._local.trace = self.previous
+        self.tracer.finish(self.trace)
+        return False
+
+
+class Tracer:
+    """ Records how long each stage of each action takes (from the button edge to the LED feedback)
+        and keeps the recent timings per action type, so their percentiles can be dumped on request. """
+
+    def __init__(self, window: int = ROLLING_WINDOW):
+        self.enabled = True
+        self.window = window
+        self._local = threading.local()  # Holds the trace of the action running on each thread
+        self._lock = threading.Lock()
+        self._samples = {}  # Action -> stage -> deque of the recent timings (seconds)
+        self._counts = {}   # Action -> number of traced actions
+        self._socket_server = None
+
+    def edge(self) -> float:
+        """ Gets the time of a button edge (called from the GPIO callback), which is carried along
+            with the press to its trace (None when tracing is disabled). """
+        return time.perf_counter() if self.enabled is True else None
+
+    def trace(self, action: str, edge: float = None):
+        """ Traces the given action on the current thread for the duration of the with block.
+            The trace starts at the given button edge of the press (see edge), if it has one. """
+        if self.enabled is False:
+            return NULL_SPAN
+        now = time.perf_counter()
+        edge = edge if edge is not None else now
+        trace = Trace(action, edge)
+        trace.record(QUEUED, now - edge)
+        return TraceScope(self, trace)
+
+    def span(self, stage: str):
+        """ Times the given stage of the action traced on the current thread (does nothing if there's none). """
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            return NULL_SPAN
+        return Span(trace, stage)
+
+    def bind(self, func):
+        """ Wraps the given function so it runs as part of the current thread's trace
+            when it's called from another thread (e.g. a write pool worker). """
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            return func
+
+        def traced(*args, **kwargs):
+            with BoundTrace(self, trace):
+                return func(*args, **kwargs)
+        return traced
+
+    def finish(self, trace: Trace):
+        """ Adds the timings of the finished trace to the rolling samples of its action. """
+        trace.record(TOTAL, time.perf_counter() - trace.started_at)
+        with self._lock:
+            self._counts[trace.action] = self._counts.get(trace.action, 0) + 1
+            action_samples = self._samples.setdefault(trace.action, {})
+            for stage, seconds in trace.stages:
+                samples = action_samples.get(stage)
+                if samples is None:
+                    samples = action_samples[stage] = deque(maxlen=self.window)
+                samples.append(seconds)
+
+    def stats(self) -> dict:
+        """ Returns the count, percentiles (ms), max (ms), and histogram of every stage of every action. """
+        with self._lock:
+            samples = {action: {stage: list(timings) for stage, timings in stages.items()}
+                       for action, stages in self._samples.items()}
+            counts = dict(self._counts)
+
+        return {action: {'count': counts[action],
+                         'stages': {stage: summarize(timings) for stage, timings in stages.items()}}
+                for action, stages in samples.items()}
+
+    def dump(self, filename: str = DUMP_FILENAME):
+        """ Writes the stats to the given file (replaced atomically so readers never see half a dump). """
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as dump_file:
+            json.dump(self.stats(), dump_file, indent=4)
+        os.replace(tmp_filename, filename)
+
+    def dump_on_signal(self, filename: str = DUMP_FILENAME, signum: int = signal.SIGUSR1):
+        """ Dumps the stats to the given file whenever the process gets the given signal (`kill -USR1 <pid>`).
+            The dump runs on its own thread, the handler could otherwise interrupt a thread holding the lock. """
+        def handler(received_signum, frame):
+            threading.Thread(target=self.dump, args=(filename,), name='TraceDump', daemon=True).start()
+        signal.signal(signum, handler)
+
+    def serve(self, socket_path: str):
+        """ Serves the stats as JSON to every connection made to the given Unix socket
+            (e.g. `nc -U <socket_path>`), from a background thread. """
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self._socket_server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket_server.bind(socket_path)
+        self._socket_server.listen(1)
+        threading.Thread(target=self._serve_forever, args=(self._socket_server,),
+                         name='TraceSocket', daemon=True).start()
+
+    def _serve_forever(self, server: socket.socket):
+        """ Answers connections to the stats socket until it's closed. """
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return  # Socket was closed by stop_serving()
+            with connection:
+                connection.sendall(json.dumps(self.stats()).encode() + b'\n')
+
+    def stop_serving(self):
+        """ Closes the stats socket if it's being served. """
+        if self._socket_server is None:
+            return
+        socket_path = self._socket_server.getsockname()
+        self._socket_server.close()
+        self._socket_server = None
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+class TracedNotifier:
+    """ Wraps a notifier so the time its LED triggers take on the press path is traced. """
+
+    def __init__(self, notifier, tracer: Tracer):
+        self.notifier = notifier
+        self.tracer = tracer
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.notifier, name)
+
+        # Only the LED triggers are traced
+        if not name.startswith('trigger_'):
+            return attribute
+
+        def trigger(*args, **kwargs):
+            with self.tracer.span('notify'):
+                return attribute(*args, **kwargs)
+        return trigger
+
+
+class StartupStep:
+    """ Times a startup step while the with block runs. """
+
+    __slots__ = ('profiler', 'name', 'started_at')
+
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.started_at, time.perf_counter())
+        return False
+
+
+class StartupProfiler:
+    """ Records when each startup step started and how long it took (on which thread),
+        to report where the startup time went (`python main.py --profile-startup`). """
+
+    def __init__(self, enabled: bool = True, started_at: float = None):
+        self.enabled = enabled
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.steps = []  # (name, thread name, start offset, seconds)
+        self._lock = threading.Lock()
+
+    def step(self, name: str):
+        """ Times the given startup step for the duration of the with block (does nothing when disabled). """
+        if self.enabled is False:
+            return NULL_SPAN
+        return StartupStep(self, name)
+
+    def record(self, name: str, started_at: float, ended_at: float):
+        """ Records a step that ran between the given perf_counter() times (does nothing when disabled). """
+        if self.enabled is False:
+            return
+        with self._lock:
+            self.steps.append((name, threading.current_thread().name, started_at - self.started_at,
+                               ended_at - started_at))
+
+    def mark(self, name: str):
+        """ Records a point in the startup (e.g. the buttons going live). """
+        now = time.perf_counter()
+        self.record(name, now, now)
+
+    def report(self) -> str:
+        """ Formats the steps in the order they started, with their start offset and duration. """
+        with self._lock:
+            steps = sorted(self.steps, key=lambda step: step[2])
+        lines = ['Startup profile (seconds since the startup began):',
+                 f'  {"step":<32} {"thread":<18} {"start":>8} {"took":>8}']
+        for name, thread_name, offset, seconds in steps:
+            took = f'{seconds:8.3f}' if seconds > 0 else f'{"-":>8}'
+            lines.append(f'  {name:<32} {thread_name[:18]:<18} {offset:8.3f} {took}')
+        return '\n'.join(lines)
+
+
+def summarize(timings: list[float]) -> dict:
+    """ Summarizes the given timings (seconds) into percentiles and a histogram, in milliseconds. """
+    timings = sorted(timings)
+    summary = {f'p{percentile}': round(timings[min(len(timings) - 1, len(timings) * percentile // 100)] * 1000, 2)
+               for percentile in PERCENTILES}
+    summary['max'] = round(timings[-1] * 1000, 2)
+
+    # Count the timings that fall under each bucket's upper bound (the last bucket holds the rest)
+    histogram = dict.fromkeys([f'<{bound}' for bound in HISTOGRAM_BUCKETS] + [f'>={HISTOGRAM_BUCKETS[-1]}'], 0)
+    labels = list(histogram)
+    bucket = 0
+    for seconds in timings:
+        while bucket < len(HISTOGRAM_BUCKETS) and seconds * 1000 >= HISTOGRAM_BUCKETS[bucket]:
+            bucket += 1
+        histogram[labels[bucket]] += 1
+    summary['histogram'] = {label: count for label, count in histogram.items() if count > 0}
+
+    return summary
+
+
+# Tracer shared by every component (so the tracing doesn't have to be passed through each of them)
+tracer = Tracer()
+edge = tracer.edge
+trace = tracer.trace
+span = tracer.span
+bind = tracer.bind
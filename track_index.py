@@ -0,0 +1,243 @@
+""" Compact in-memory indexes of track IDs: TrackIndex, a drop-in for a set of ID strings, and TrackMaskIndex,
+a drop-in for the dict of ID strings the playlist membership uses.
+
+Spotify track IDs are 128-bit numbers written as 22 base62 characters. Each one is decoded back into its
+number and kept as two 64-bit halves in a pair of sorted arrays (16 bytes per track, plus 8 for the mask
+in TrackMaskIndex, instead of the 100+ bytes of a string in a set or dict), and looked up with a binary
+search. IDs that aren't 128-bit base62 (e.g. local files) are kept as strings on the side.
+"""
+from bisect import bisect_left
+from operator import mul
+from array import array
+import utils as utl
+import sys
+
+KEY_LIMIT = 1 << 128  # Spotify IDs encode 128-bit numbers
+LOW_MASK = (1 << 64) - 1
+POWERS = [62 ** power for power in range(utl.SPOTIFY_ID_LENGTH - 1, -1, -1)]  # Place value of each base62 digit
+
+# Maps each base62 character to its value (anything else to 255), to decode a whole ID in one go
+DIGIT_VALUES = bytearray([255]) * 256
+for value, char in enumerate(utl.BASE62):
+    DIGIT_VALUES[ord(char)] = value
+DIGIT_VALUES = bytes(DIGIT_VALUES)
+
+
+def track_key(track_id: str) -> int:
+    """ Decodes the given track ID into the 128-bit number it encodes, or None if it isn't a 128-bit base62 ID. """
+    if not isinstance(track_id, str) or len(track_id) != utl.SPOTIFY_ID_LENGTH:
+        return None
+    digits = track_id.encode('ascii', 'replace').translate(DIGIT_VALUES)
+    if max(digits) >= 62:
+        return None
+    key = sum(map(mul, digits, POWERS))
+    return key if key < KEY_LIMIT else None
+
+
+def find_key(high_keys: array, low_keys: array, key: int) -> tuple[int, bool]:
+    """ Gets the position the given key is at in the sorted halves (or would be inserted at), and whether it's there. """
+    high, low = key >> 64, key & LOW_MASK
+    position = bisect_left(high_keys, high)
+    while position < len(high_keys) and high_keys[position] == high:
+        if low_keys[position] >= low:
+            return position, low_keys[position] == low
+        position += 1
+    return position, False
+
+
+class TrackIndex:
+    """ Set of track IDs stored as sorted 128-bit numbers: O(log n) membership tests,
+        and inserts/removes that shift the arrays (a memmove, fast enough for a press). """
+
+    def __init__(self, track_ids=()):
+        keys = []
+        self._others = set()  # IDs that can't be stored as numbers
+        for track_id in track_ids:
+            key = track_key(track_id)
+            if key is None:
+                self._others.add(track_id)
+            else:
+                keys.append(key)
+
+        # Sorted by number, which is also the order of the ID strings (the base62 digits are in ASCII order)
+        keys = sorted(set(keys))
+        self._high = array('Q', [key >> 64 for key in keys])
+        self._low = array('Q', [key & LOW_MASK for key in keys])
+
+    def _find(self, key: int) -> tuple[int, bool]:
+        """ Gets the position the given key is at (or would be inserted at), and whether it's there. """
+        return find_key(self._high, self._low, key)
+
+    def __contains__(self, track_id: str) -> bool:
+        key = track_key(track_id)
+        if key is None:
+            return track_id in self._others
+        return self._find(key)[1]
+
+    def __len__(self) -> int:
+        return len(self._high) + len(self._others)
+
+    def __iter__(self):
+        """ Yields the track IDs (the numeric ones in sorted order). """
+        for high, low in zip(self._high, self._low):
+            yield utl.int_to_track_id(high << 64 | low)
+        yield from self._others
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, TrackIndex):
+            return self._high == other._high and self._low == other._low and self._others == other._others
+        if isinstance(other, (set, frozenset)):
+            return len(self) == len(other) and all(track_id in self for track_id in other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'TrackIndex({len(self)} tracks)'
+
+    def add(self, track_id: str):
+        """ Adds the given track ID (does nothing if it's already in the index). """
+        key = track_key(track_id)
+        if key is None:
+            self._others.add(track_id)
+            return
+        position, found = self._find(key)
+        if found is False:
+            self._high.insert(position, key >> 64)
+            self._low.insert(position, key & LOW_MASK)
+
+    def discard(self, track_id: str):
+        """ Removes the given track ID if it's in the index. """
+        key = track_key(track_id)
+        if key is None:
+            self._others.discard(track_id)
+            return
+        position, found = self._find(key)
+        if found is True:
+            del self._high[position]
+            del self._low[position]
+
+    def remove(self, track_id: str):
+        """ Removes the given track ID, raises a KeyError if it isn't in the index. """
+        if track_id not in self:
+            raise KeyError(track_id)
+        self.discard(track_id)
+
+    def memory_bytes(self) -> int:
+        """ Gets the (approximate) number of bytes the index takes up. """
+        return sys.getsizeof(self._high) + sys.getsizeof(self._low) + sys.getsizeof(self._others) + \
+            sum(sys.getsizeof(track_id) for track_id in self._others)
+
+
+class TrackMaskIndex:
+    """ Mapping of track IDs to 64-bit masks (e.g. the playlists each track is in), stored as sorted 128-bit
+        numbers with the masks alongside (24 bytes per track): O(log n) lookups, and inserts/removes that shift
+        the arrays (a memmove, fast enough for a press). Supports the subset of the dict interface the playlist
+        membership index uses: get, item assignment and deletion, items, len. """
+
+    def __init__(self):
+        self._high = array('Q')
+        self._low = array('Q')
+        self._masks = array('Q')
+        self._others = {}  # Masks of the IDs that can't be stored as numbers
+
+    def get(self, track_id: str, default: int = 0) -> int:
+        key = track_key(track_id)
+        if key is None:
+            return self._others.get(track_id, default)
+        position, found = find_key(self._high, self._low, key)
+        return self._masks[position] if found is True else default
+
+    def __setitem__(self, track_id: str, mask: int):
+        key = track_key(track_id)
+        if key is None:
+            self._others[track_id] = mask
+            return
+        position, found = find_key(self._high, self._low, key)
+        if found is True:
+            self._masks[position] = mask
+        else:
+            self._high.insert(position, key >> 64)
+            self._low.insert(position, key & LOW_MASK)
+            self._masks.insert(position, mask)
+
+    def __delitem__(self, track_id: str):
+        key = track_key(track_id)
+        if key is None:
+            del self._others[track_id]
+            return
+        position, found = find_key(self._high, self._low, key)
+        if found is False:
+            raise KeyError(track_id)
+        del self._high[position]
+        del self._low[position]
+        del self._masks[position]
+
+    def __len__(self) -> int:
+        return len(self._high) + len(self._others)
+
+    def add_bit(self, track_ids, bit: int) -> int:
+        """ Sets the given bit in the masks of the given track IDs (adding the ones that aren't in the index),
+            merging them in one pass instead of shifting the arrays for every new track. Only the numbers
+            of the IDs are held while they come in. Returns the number of tracks that didn't have the bit. """
+        keys, added = [], 0
+        for track_id in track_ids:
+            key = track_key(track_id)
+            if key is None:
+                mask = self._others.get(track_id, 0)
+                if mask & bit == 0:
+                    self._others[track_id] = mask | bit
+                    added += 1
+            else:
+                keys.append(key)
+        keys.sort()
+
+        # Copy the runs of existing tracks between the new keys, marking the ones that were already there
+        high, low, masks = array('Q'), array('Q'), array('Q')
+        copied, previous = 0, None
+        for key in keys:
+            if key == previous:
+                continue  # The track is in the playlist twice
+            previous = key
+            position, found = find_key(self._high, self._low, key)
+            high.extend(self._high[copied:position])
+            low.extend(self._low[copied:position])
+            masks.extend(self._masks[copied:position])
+            high.append(key >> 64)
+            low.append(key & LOW_MASK)
+            mask = self._masks[position] if found is True else 0
+            masks.append(mask | bit)
+            added += mask & bit == 0
+            copied = position + 1 if found is True else position
+        high.extend(self._high[copied:])
+        low.extend(self._low[copied:])
+        masks.extend(self._masks[copied:])
+        self._high, self._low, self._masks = high, low, masks
+        return added
+
+    def clear_bit(self, bit: int):
+        """ Clears the given bit from every mask, dropping the tracks left without any bits. """
+        kept = [position for position, mask in enumerate(self._masks) if mask & ~bit != 0]
+        self._high = array('Q', [self._high[position] for position in kept])
+        self._low = array('Q', [self._low[position] for position in kept])
+        self._masks = array('Q', [self._masks[position] & ~bit for position in kept])
+        self._others = {track_id: mask & ~bit for track_id, mask in self._others.items() if mask & ~bit != 0}
+
+    def with_bit(self, bit: int) -> tuple[array, array, list]:
+        """ Gets the tracks whose mask has the given bit, as the (high, low) halves of their numbers
+            and the IDs that aren't numbers (a copy, so it can be iterated while the index changes). """
+        high, low = array('Q'), array('Q')
+        for position, mask in enumerate(self._masks):
+            if mask & bit != 0:
+                high.append(self._high[position])
+                low.append(self._low[position])
+        return high, low, [track_id for track_id, mask in self._others.items() if mask & bit != 0]
+
+    def items(self):
+        """ Yields the (track ID, mask) pairs (the numeric IDs in sorted order). """
+        for high, low, mask in zip(self._high, self._low, self._masks):
+            yield utl.int_to_track_id(high << 64 | low), mask
+        yield from self._others.items()
+
+    def memory_bytes(self) -> int:
+        """ Gets the (approximate) number of bytes the index takes up. """
+        return sys.getsizeof(self._high) + sys.getsizeof(self._low) + sys.getsizeof(self._masks) + \
+            sys.getsizeof(self._others) + sum(sys.getsizeof(track_id) for track_id in self._others)
@@ -13,13 +13,29 @@ def write_json(data: dict, filename: str, indent: int = None):
     with open(filename, 'w+') as json_outfile:
         json.dump(data, json_outfile, indent=indent)
 
+def write_json_atomic(data: dict, filename: str, indent: int = None):
+    """ Atomically writes the given data to the given JSON file (a crash or power cut leaves either the old or the new file). """
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w') as json_outfile:
+        json.dump(data, json_outfile, indent=indent)
+        json_outfile.flush()
+        os.fsync(json_outfile.fileno())
+    os.replace(temp_filename, filename)
+
+    # Persist the rename itself
+    dir_fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
 def format_json(data: dict, indent: int = None) -> str:
     """ Returns the given data as a JSON formatted string. """
     return json.dumps(data, indent=indent)
 
 def file_exists(filename: str) -> bool:
     """ Returns whether the given file exists. """
-    return filename in os.listdir()
+    return os.path.isfile(filename)
 
 def file_exists_error(filename: str) -> bool:
     """ Returns True if the given file exists, otherwise raises a FileNotFoundError. """
@@ -30,3 +46,25 @@ def file_exists_error(filename: str) -> bool:
 def spotify_id_from_link(spotify_link: str) -> str:
     """ Extracts and returns the Spotify ID from the given Spotify link. """
     return spotify_link.split('/')[-1].split('?')[0]
+
+BASE62 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE62_VALUES = {char: value for value, char in enumerate(BASE62)}
+SPOTIFY_ID_LENGTH = 22
+
+def track_id_to_int(track_id: str) -> int:
+    """ Decodes the given base62 Spotify ID into the integer it encodes (raises ValueError if it isn't base62). """
+    value = 0
+    try:
+        for char in track_id:
+            value = value * 62 + BASE62_VALUES[char]
+    except KeyError:
+        raise ValueError('Not a base62 Spotify ID: ' + track_id)
+    return value
+
+def int_to_track_id(value: int) -> str:
+    """ Encodes the given integer back into a 22 character base62 Spotify ID. """
+    chars = []
+    while value > 0:
+        value, remainder = divmod(value, 62)
+        chars.append(BASE62[remainder])
+    return ''.join(reversed(chars)).rjust(SPOTIFY_ID_LENGTH, '0')
@@ -0,0 +1,244 @@
+from spotify_client import is_network_error
+from collections import deque
+import threading
+import time
+
+FLUSH_DELAY = 2.0  # Seconds writes are held for so they can be batched (or cancelled by an undo)
+LIBRARY_BATCH_LIMIT = 50  # Max number of tracks the API accepts per library write
+PLAYLIST_BATCH_LIMIT = 100  # Max number of tracks the API accepts per playlist write
+MAX_FLUSH_ATTEMPTS = 5  # Writes that fail this many flushes in a row are dropped
+STATS_WINDOW = 100  # Number of recent batches kept for the stats
+
+ADD = "ADD"
+REMOVE = "REMOVE"
+LIBRARY = None  # Target of library writes (playlist writes are targeted by the playlist ID)
+
+
+class WriteBehindQueue:
+    """ Acknowledges library and playlist writes right away, then sends them to Spotify in batches
+        on a short timer. A write that's reversed before it's flushed (e.g. undone) is cancelled. """
+
+    def __init__(self, client, logger, flush_delay: float = FLUSH_DELAY, on_playlist_flushed=None, journal=None,
+                 on_write_dropped=None):
+        self.client = client
+        self.logger = logger
+        self.flush_delay = flush_delay
+        self.on_playlist_flushed = on_playlist_flushed  # Called with (playlist_id, snapshot_id) after a flush
+        self.journal = journal  # Offline journal that takes over writes while Spotify can't be reached
+        self.on_write_dropped = on_write_dropped  # Called with (target, operation, track_id) after a write is dropped
+
+        # Pending writes: target -> {track_id: ADD/REMOVE}, only accessed while holding the lock
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._in_flight = {}  # Writes taken out of the queue by the flush that's sending them (same layout)
+        self._attempts = {}  # (target, track_id) -> number of failed flushes
+
+        # Counters and recent measurements for the stats
+        self.queued = 0
+        self.cancelled = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.batch_sizes = deque(maxlen=STATS_WINDOW)
+        self.flush_latencies = deque(maxlen=STATS_WINDOW)
+
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """ Starts the background thread that flushes the pending writes. """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='WriteBehind', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Flushes the pending writes one last time and stops the background thread. """
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def save_to_library(self, track_id: str):
+        """ Queues saving the given track to the user's library. """
+        self._enqueue(LIBRARY, track_id, ADD)
+
+    def unsave_from_library(self, track_id: str):
+        """ Queues removing the given track from the user's library. """
+        self._enqueue(LIBRARY, track_id, REMOVE)
+
+    def add_to_playlist(self, track_id: str, playlist_id: str):
+        """ Queues adding the given track to the specified playlist. """
+        self._enqueue(playlist_id, track_id, ADD)
+
+    def remove_from_playlist(self, track_id: str, playlist_id: str):
+        """ Queues removing the given track from the specified playlist. """
+        self._enqueue(playlist_id, track_id, REMOVE)
+
+    def has_pending(self, target: str) -> bool:
+        """ Checks whether the given target (playlist ID or LIBRARY) has writes that haven't reached Spotify yet
+            (queued or being flushed). """
+        with self._lock:
+            return len(self._pending.get(target, {})) > 0 or len(self._in_flight.get(target, {})) > 0
+
+    def pending_operation(self, target: str, track_id: str) -> str:
+        """ Gets the write (ADD/REMOVE) for the given track and target that hasn't reached Spotify yet
+            (queued or being flushed), or None if there's none. """
+        with self._lock:
+            operation = self._pending.get(target, {}).get(track_id)
+            if operation is None:
+                operation = self._in_flight.get(target, {}).get(track_id)
+            return operation
+
+    def _enqueue(self, target: str, track_id: str, operation: str):
+        """ Queues the given write, or cancels the pending write it reverses. """
+        with self._lock:
+            pending = self._pending.setdefault(target, {})
+            pending_operation = pending.get(track_id)
+
+            # The write reverses one that hasn't been sent yet, so neither of them needs to be sent
+            if pending_operation is not None and pending_operation != operation:
+                del pending[track_id]
+                self._attempts.pop((target, track_id), None)
+                self.cancelled += 1
+                return
+
+            pending[track_id] = operation
+            self.queued += 1
+
+        self._wake_event.set()
+
+    def _run(self):
+        """ Flushes the pending writes a flush delay after the first one arrives, until stopped. """
+        while not self._stop_event.is_set():
+            self._wake_event.wait()
+
+            # Wait out the flush delay so more writes can join the batch (stopping flushes right away)
+            self._stop_event.wait(self.flush_delay)
+            self._wake_event.clear()
+            self.flush()
+
+        # Send whatever arrived while stopping
+        self.flush()
+
+    def flush(self):
+        """ Sends all the pending writes to Spotify in batches. """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._in_flight = {target: dict(operations) for target, operations in pending.items()}
+
+        try:
+            for target, operations in pending.items():
+                for operation in (REMOVE, ADD):
+                    track_ids = [track_id for track_id, op in operations.items() if op == operation]
+                    batch_limit = LIBRARY_BATCH_LIMIT if target is LIBRARY else PLAYLIST_BATCH_LIMIT
+                    for i in range(0, len(track_ids), batch_limit):
+                        self._send_batch(target, operation, track_ids[i:i + batch_limit])
+        finally:
+            with self._lock:
+                self._in_flight = {}
+
+    def _send_batch(self, target: str, operation: str, track_ids: list[str]):
+        """ Sends a single batch of writes, putting them back in the queue if it fails. """
+        # Journal the writes behind the older ones the journal still holds, so they're replayed in order
+        if self.journal is not None and len(self.journal) > 0:
+            self._journal_batch(target, operation, track_ids)
+            return
+
+        start = time.perf_counter()
+        try:
+            snapshot_id = self._write(target, operation, track_ids)
+        except Exception as err:
+            # Hand the writes over to the offline journal if Spotify can't be reached
+            if self.journal is not None and is_network_error(err):
+                self._journal_batch(target, operation, track_ids)
+                return
+            self.logger.error(f'Write-behind flush of {len(track_ids)} <{operation}> writes failed: ' + str(err))
+            self._requeue(target, operation, track_ids)
+            return
+
+        with self._lock:
+            self.flushed += len(track_ids)
+            self.batch_sizes.append(len(track_ids))
+            self.flush_latencies.append(time.perf_counter() - start)
+            for track_id in track_ids:
+                self._attempts.pop((target, track_id), None)
+            self._clear_in_flight(target, track_ids)
+
+        if target is not LIBRARY and self.on_playlist_flushed is not None:
+            self.on_playlist_flushed(target, snapshot_id)
+
+    def _journal_batch(self, target: str, operation: str, track_ids: list[str]):
+        """ Hands the given writes over to the offline journal. """
+        for track_id in track_ids:
+            self.journal.append(operation, track_id, target)
+        with self._lock:
+            self._clear_in_flight(target, track_ids)
+
+    def _clear_in_flight(self, target: str, track_ids: list[str]):
+        """ Takes the given writes out of the in-flight ones once they're sent, journaled or requeued (must hold the lock). """
+        in_flight = self._in_flight.get(target, {})
+        for track_id in track_ids:
+            in_flight.pop(track_id, None)
+
+    def _write(self, target: str, operation: str, track_ids: list[str]) -> str:
+        """ Sends the given writes with the matching client call (returns the new snapshot ID for playlists). """
+        if target is LIBRARY and operation == ADD:
+            return self.client.add_saved_tracks_batch(track_ids)
+        if target is LIBRARY:
+            return self.client.remove_saved_tracks_batch(track_ids)
+        if operation == ADD:
+            return self.client.add_tracks_to_playlist(track_ids, target)
+        return self.client.remove_tracks_from_playlist(track_ids, target)
+
+    def _requeue(self, target: str, operation: str, track_ids: list[str]):
+        """ Puts failed writes back in the queue unless they were superseded or failed too many times
+            (dropped writes are handed to on_write_dropped so their local state can be reverted). """
+        dropped = []
+        with self._lock:
+            self._clear_in_flight(target, track_ids)
+            pending = self._pending.setdefault(target, {})
+            for track_id in track_ids:
+                attempts = self._attempts.get((target, track_id), 0) + 1
+                if attempts >= MAX_FLUSH_ATTEMPTS:
+                    self._attempts.pop((target, track_id), None)
+                    self.dropped += 1
+                    self.logger.error(f'Dropped <{operation}> write of track <{track_id}> after {attempts} attempts')
+                    # Only revert it if no newer write for the track was queued since
+                    if track_id not in pending:
+                        dropped.append(track_id)
+                    continue
+
+                # A newer write for the track already supersedes this one
+                if pending.get(track_id) == operation:
+                    continue
+                # A newer write for the track reverses this one, so they cancel out
+                if track_id in pending:
+                    del pending[track_id]
+                    self._attempts.pop((target, track_id), None)
+                    self.cancelled += 1
+                    continue
+
+                pending[track_id] = operation
+                self._attempts[(target, track_id)] = attempts
+
+        if self.on_write_dropped is not None:
+            for track_id in dropped:
+                self.on_write_dropped(target, operation, track_id)
+        self._wake_event.set()
+
+    def stats(self) -> dict:
+        """ Returns the batch sizes and flush latencies along with the write counters. """
+        with self._lock:
+            batches = len(self.batch_sizes)
+            return {
+                'pending': sum(len(operations) for operations in self._pending.values()),
+                'queued': self.queued,
+                'cancelled': self.cancelled,
+                'flushed': self.flushed,
+                'dropped': self.dropped,
+                'avg_batch_size': sum(self.batch_sizes) / batches if batches > 0 else None,
+                'max_batch_size': max(self.batch_sizes) if batches > 0 else None,
+                'avg_flush_latency': sum(self.flush_latencies) / batches if batches > 0 else None,
+                'max_flush_latency': max(self.flush_latencies) if batches > 0 else None
+            }